@@ -22,6 +22,13 @@ from enum import Enum
 from tool.msg_util import axsbe_base, axsbe_exe, axsbe_order, axsbe_snap_stock, price_level, CYB_cage_upper, CYB_cage_lower, bitSizeOf, MARKET_SUBTYPE, market_subtype
 import tool.msg_util as msg_util
 from tool.axsbe_base import SecurityIDSource_SSE, SecurityIDSource_SZSE, INSTRUMENT_TYPE, MsgType_exe_sse_bond
+from tool.axsbe_base import MSG_KIND_ORDER, MSG_KIND_EXE, MSG_KIND_SNAP, MSG_KIND_SIGNAL
+from tool.axsbe_snap_stock import axsbe_snap_compact
+from behave.level_tree import new_level_tree
+from behave.order_store import new_order_store
+from behave.axob_trace import axob_trace
+from behave.snap_cache import snap_cache
+from behave.axob_checkpoint import checkpoint_save, levels_to_records, levels_from_records, snaps_to_records, snaps_from_records
 from copy import deepcopy
 
 import logging
@@ -29,6 +36,17 @@ axob_logger = logging.getLogger(__name__)
 
 #### 静态工作开关 ####
 EXPORT_LEVEL_ACCESS = False # 是否导出对价格档位的读写请求
+LEVEL_TREE_TYPE = 'sorted'  # 价格档位容器：'sorted'=有序价格数组+二分查找；'dict'=哈希表，有序访问时全排序(原实现，用于对照)；
+                            #   'ladder'=以涨跌停价预分配的稠密价格阶梯+位图(同FPGA RAM布局)，涨跌停价确定前或无涨跌停限制时为'sorted'
+ORDER_STORE_TYPE = 'dict'   # 订单容器：'dict'=哈希表，每个订单一个ob_order对象(原实现)；
+                            #   'soa'=按列保存的定长数组+开放寻址索引，每个订单约50B(为'dict'的1/5)，用于全市场回放；
+                            #   'dense'=按ApplSeqNum直接寻址的分块数组，深交所由MU按通道共享(order_map和illegal_order_map)
+SNAP_TOP_LEVEL_NB = 10      # 增量维护的买/卖方盘口最优档数，连续竞价快照直接读取；快照档数超过该值时退回遍历价格档
+SNAP_COALESCE_TICK = 0      # 重建快照合并：0=每次订单簿变化都生成快照；>0时同一时戳窗口(current_inc_tick//此值，深交所单位10ms，须整除1秒)内的变化
+                            #   只生成窗口内最后的状态，在时戳进入下一窗口、交易阶段切换、收到快照或信号、缓存主动单之前生成
+SNAP_RETAIN_NUMTRADES = 0   # 比对用的重建/交易所快照缓存(rebuilt_snaps/market_snaps)的保留策略，0为不限：只保留NumTrades不小于最新快照NumTrades-此值的；
+SNAP_RETAIN_MS = 0          #   只保留日内时戳不早于最新快照此毫秒数的；
+SNAP_RETAIN_MAX = 0         #   每个标的各自最多保留的快照数。被淘汰的交易所快照视为未匹配，可用setSnapSpill写盘
 
 #### 内部计算精度 ####
 APPSEQ_BIT_SIZE = 32    # 序列号，34b，约40亿，因为不同channel的序列号各自独立，所以单channel整形就够
@@ -73,6 +91,38 @@ class TYPE(Enum): # 2bit
 
     UNKNOWN = -1    # 仅用于测试
 
+# 原始委托方向/类型代码 到 SIDE/TYPE 的查表，代替逐条比较Side_str/Type_str
+_SIDE_OF = {
+    (SecurityIDSource_SZSE, ord('1')) : SIDE.BID,     # 买入
+    (SecurityIDSource_SZSE, ord('2')) : SIDE.ASK,     # 卖出
+    (SecurityIDSource_SZSE, ord('G')) : SIDE.UNKNOWN, # 借入 TODO-SSE
+    (SecurityIDSource_SZSE, ord('F')) : SIDE.UNKNOWN, # 出借
+    (SecurityIDSource_SSE, ord('B'))  : SIDE.BID,
+    (SecurityIDSource_SSE, ord('S'))  : SIDE.ASK,
+}
+_TYPE_OF = {
+    (SecurityIDSource_SZSE, ord('2')) : TYPE.LIMIT,   # 限价
+    (SecurityIDSource_SZSE, ord('1')) : TYPE.MARKET,  # 市价
+    (SecurityIDSource_SZSE, ord('U')) : TYPE.SIDE,    # 本方最优
+    (SecurityIDSource_SSE, ord('A'))  : TYPE.LIMIT,   # 新增
+    (SecurityIDSource_SSE, ord('D'))  : TYPE.UNKNOWN, # 删除
+}
+SSE_ORDTYPE_ADD = ord('A')
+SSE_ORDTYPE_DEL = ord('D')
+SZSE_EXECTYPE_TRADE = ord('F')
+
+
+class CHECK_POLICY(Enum): # onMsg后的自检（缓存/加权量/位宽等不变量审计）时机，审计为O(价格档数)
+    OFF     = 0  # 不检查
+    EVERY   = 1  # 每条消息后检查，用于回归
+    EVERY_N = 2  # 每check_interval条消息检查一次
+    PHASE   = 3  # 交易阶段切换时检查
+    SNAP    = 4  # 收到交易所快照（与重建快照比对）时检查
+
+#### 自检策略，全局默认值；单个AXOB可用setCheckPolicy单独设置 ####
+CHECK_POLICY_DEFAULT = CHECK_POLICY.PHASE
+CHECK_INTERVAL_DEFAULT = 1000
+
 # 用于将原始精度转换到ob精度
 SZSE_STOCK_PRICE_RD = msg_util.PRICE_SZSE_INCR_PRECISION // PRICE_INTER_STOCK_PRECISION
 SZSE_FUND_PRICE_RD = msg_util.PRICE_SZSE_INCR_PRECISION // PRICE_INTER_FUND_PRECISION
@@ -98,24 +148,12 @@ class ob_order():
         # self.securityID = order.SecurityID
         self.applSeqNum = order.ApplSeqNum
 
-        if order.Side_str=='买入':
-            self.side = SIDE.BID
-        elif order.Side_str=='卖出':
-            self.side = SIDE.ASK
-        else:
-            '''TODO-SSE'''
-            self.side = SIDE.UNKNOWN
-
-        if order.Type_str=='限价':          # SZ
-            self.type = TYPE.LIMIT
-        elif order.Type_str=='市价':        # SZ
-            self.type = TYPE.MARKET
-        elif order.Type_str=='本方最优':    # SZ
-            self.type = TYPE.SIDE
-        elif order.Type_str=='新增':        # SH
-            self.type = TYPE.LIMIT
-        else:
-            self.type = TYPE.UNKNOWN
+        self.side = _SIDE_OF.get((order.SecurityIDSource, order.Side))
+        if self.side is None:
+            raise RuntimeError(f"非法委托方向:{order.Side}")
+        self.type = _TYPE_OF.get((order.SecurityIDSource, order.OrdType))
+        if self.type is None:
+            raise RuntimeError(f"非法委托类型:{order.OrdType}")
 
         # 溢出检查
         if order.Price==msg_util.ORDER_PRICE_OVERFLOW: #原始价格越界 (不用管是否是LIMIT)
@@ -289,6 +327,10 @@ class AX_SIGNAL(Enum):  # 发送给AXOB的信号
     PMTRADING_END = 5  # 下午连续竞价结束
     ALL_END = 6        # 闭市
 
+    @property
+    def KIND(self):
+        return MSG_KIND_SIGNAL
+
 CHANNELNO_INIT = -1
 
 class AXOB():
@@ -299,8 +341,8 @@ class AXOB():
 
         'order_map',    # map of ob_order, 保存了 所有的 委托号对应的订单详情, 当收到撤单或成交消息时 有时只有订单号需要根据订单号找到价格和数量
         'illegal_order_map',    # map of illegal_order  保存因超出涨跌幅限制或其他原因被判为非法但尚未处理完毕的订单（主要用于创业板无涨跌幅限制期间的特殊逻辑）  seqnum 是key, order 对象是 value
-        'bid_level_tree', # map of level_node  买方/卖方价格树。以价格为 Key，保存该价位上的总挂单量（Qty）
-        'ask_level_tree', # map of level_node  同上
+        'bid_level_tree', # level_tree of level_node  买方/卖方价格树。以价格为 Key，保存该价位上的总挂单量（Qty），见behave.level_tree
+        'ask_level_tree', # level_tree of level_node  同上
 
         'NumTrades',  # 成交笔数
 
@@ -310,6 +352,13 @@ class AXOB():
         'ask_min_level_price',
         'ask_min_level_qty',
 
+        # 买/卖方盘口最优N档(SNAP_TOP_LEVEL_NB)缓存，只含笼内价格档，按最优到次优排列，元素即价格树中的level_node(数量随之更新)
+        # *_top_key: 建立缓存时的笼外价格档(无笼外档时为0)，与当前不一致或为None时缓存失效，读取时重建
+        'bid_top_levels',
+        'ask_top_levels',
+        'bid_top_key',
+        'ask_top_key',
+
         # 统计类字段 最新、最高、最低、开盘价
         'LastPx',
         'HighPx',
@@ -353,6 +402,8 @@ class AXOB():
         # 如果收到了新的委托, 表示上一个委托已经结束了撮合, 需要处理 holding_order
         'holding_order',  # 保存了 ob_order 对象
         'holding_nb',     # 计数
+        'snap_pending',         # 合并模式(SNAP_COALESCE_TICK)下有待生成的快照
+        'snap_pending_window',  # 待生成快照的时戳窗口
 
         'TradingPhaseMarket',     # 市场交易阶段
         # 'VolatilityBreaking_end_tick',
@@ -386,12 +437,18 @@ class AXOB():
 
         # for test olny
         'msg_nb',
-        'rebuilt_snaps',    # list of snap
-        'market_snaps',     # list of snap
+        'rebuilt_snaps',    # snap_cache {NumTrades:{fingerprint:[snap]}}
+        'market_snaps',     # snap_cache {NumTrades:{fingerprint:[snap]}}
+        'snap_spill',       # 被淘汰的交易所快照写盘(bytes_stream首尾相接)，None为不写
         'last_snap',
         'last_inc_applSeqNum',  # 这个上一次处理的消息号
+        'check_policy',     # 自检策略 CHECK_POLICY
+        'check_interval',   # CHECK_POLICY.EVERY_N 的检查间隔
+        'check_phase',      # 上次自检时的交易阶段，用于CHECK_POLICY.PHASE
+        'trace',            # axob_trace，None为不跟踪
 
         'logger',
+        'DBG_ON',           # 构造时缓存的logger是否输出DEBUG，为False时不格式化调试信息
         'DBG',
         'INFO',
         'WARN',
@@ -410,16 +467,20 @@ class AXOB():
             self.instrument_type = instrument_type
 
             ## 结构数据：
-            self.order_map = {} #订单队列，以applSeqNum作为索引
-            self.illegal_order_map = {} #
-            self.bid_level_tree = {} #买方价格档，以价格作为索引
-            self.ask_level_tree = {} #卖方价格档
+            self.order_map = new_order_store(ORDER_STORE_TYPE) #订单队列，以applSeqNum作为索引
+            self.illegal_order_map = new_order_store(ORDER_STORE_TYPE) #
+            self.bid_level_tree = new_level_tree(LEVEL_TREE_TYPE) #买方价格档，以价格作为索引
+            self.ask_level_tree = new_level_tree(LEVEL_TREE_TYPE) #卖方价格档
 
             self.NumTrades = 0
             self.bid_max_level_price = 0
             self.bid_max_level_qty = 0
             self.ask_min_level_price = 0
             self.ask_min_level_qty = 0
+            self.bid_top_levels = []
+            self.ask_top_levels = []
+            self.bid_top_key = None
+            self.ask_top_key = None
             self.LastPx = 0
             self.HighPx = 0
             self.LowPx = 0
@@ -449,6 +510,8 @@ class AXOB():
 
             self.holding_order = None
             self.holding_nb = 0
+            self.snap_pending = False
+            self.snap_pending_window = 0
 
             self.TradingPhaseMarket = axsbe_base.TPM.Starting    # 市场交易阶段
 
@@ -477,10 +540,15 @@ class AXOB():
 
 
             self.msg_nb = 0
-            self.rebuilt_snaps = {}
-            self.market_snaps = {}
+            self.rebuilt_snaps = snap_cache()
+            self.market_snaps = snap_cache()
+            self.snap_spill = None
             self.last_snap = None
             self.last_inc_applSeqNum = 0
+            self.check_policy = CHECK_POLICY_DEFAULT
+            self.check_interval = CHECK_INTERVAL_DEFAULT
+            self.check_phase = self.TradingPhaseMarket
+            self.trace = None
 
             ## 日志
             self.logger = logging.getLogger(f'{self.SecurityID:06d}')
@@ -492,25 +560,28 @@ class AXOB():
                 axob_logger.addHandler(h) #这里补上模块日志的handler，有点ugly TODO: better way [low prioryty]
 
             self.DBG = self.logger.debug
+            self.DBG_ON = self.logger.isEnabledFor(logging.DEBUG)
             self.INFO = self.logger.info
             self.WARN = self.logger.warning
             self.ERR = self.logger.error
 
     def onMsg(self, msg):
         '''处理总入口'''
-        if isinstance(msg, (axsbe_order, axsbe_exe, axsbe_snap_stock)):
+        kind = msg.KIND
+        if kind==MSG_KIND_ORDER or kind==MSG_KIND_EXE or kind==MSG_KIND_SNAP:
+            is_inc = kind!=MSG_KIND_SNAP
             if msg.SecurityID!=self.SecurityID:
                 return
 
             # 深交所：始终逐笔序列号递增，这里做检查
             # 上交所：非合并流逐笔会乱序，不检查
             # 这里是3个条件 必须是深圳股票, 必须是逐笔数据, 如果当前数据小于等于 上次处理的数据 说明 乱续了
-            if self.SecurityIDSource==SecurityIDSource_SZSE and isinstance(msg, (axsbe_order, axsbe_exe)) and msg.ApplSeqNum<=self.last_inc_applSeqNum:
+            if self.SecurityIDSource==SecurityIDSource_SZSE and is_inc and msg.ApplSeqNum<=self.last_inc_applSeqNum:
                 self.ERR(f"ApplSeqNum={msg.ApplSeqNum} <= last_inc_applSeqNum={self.last_inc_applSeqNum} repeated or outOfOrder!")
                 # 打印完了日志, 直接返回
                 return
 
-            if isinstance(msg, (axsbe_order, axsbe_exe)):
+            if is_inc:
                 # 这里会有问题, 所以放到了下面实现: 
                 #     1. 缓存单问题：在连续竞价结束瞬间，可能还有未处理的“缓存单”（holding_order，通常是等待成交的市价单或特定限价单）。
                 #          必须先处理完这些缓存单（尝试插入或撤销），然后再切换到收盘集合竞价状态。
@@ -527,10 +598,12 @@ class AXOB():
                 self._useTimestamp(msg.TransactTime)
                 
                 # 如果不是处在波动性中断状态 (防止错误覆盖), 才进行状态切换
-                # 这里主动更新状态, 如果没有主动, 那就被动等待 MU广播进入 elif isinstance(msg, AX_SIGNAL): 的分支
+                # 这里主动更新状态, 如果没有主动, 那就被动等待 MU广播进入 elif kind==MSG_KIND_SIGNAL: 的分支
                 # 这里如果 msg如果是波动性中断, 那这里是切换, 给self也赋值, 
                 # ps: 在 onTrade中进行恢复到连续竞价阶段, 波动性中断（临停）结束的标志是进行一次集合竞价撮合。当这次撮合完成（即买卖盘不再交叉）时，状态就会切换回连续竞价。
                 if self.TradingPhaseMarket!=axsbe_base.TPM.VolatilityBreaking:
+                    if self.snap_pending and msg.TradingPhaseMarket!=self.TradingPhaseMarket:
+                        self._flushSnap()   # 合并模式：阶段切换前生成上一阶段的快照
                     # 那就把外部传来的消息内的状态 更新到当前对象中
                     self.TradingPhaseMarket = msg.TradingPhaseMarket # 只用逐笔，在阶段切换期间，逐笔和快照的速率不同，可能快照切了逐笔没切，或反过来，
                                                                     # 由于我们重建完全基于逐笔，快照仅用来做检查，故阶段切换基于逐笔。
@@ -546,20 +619,19 @@ class AXOB():
                 #             self.TradingPhaseMarket = msg.TradingPhaseMarket
 
                 
+            elif self.snap_pending:
+                self._flushSnap()   # 合并模式：与交易所快照比对前生成待生成的快照
 
-            if isinstance(msg, axsbe_order):
-                self.onOrder(msg)
-            elif isinstance(msg, axsbe_exe):
-                self.onExec(msg)
-            elif isinstance(msg, axsbe_snap_stock):
-                self.onSnap(msg)
+            _AXOB_ON_MSG[kind](self, msg)
 
             # 深交所：始终逐笔序列号递增，这里做记录
             # 上交所：非合并流逐笔会乱序，不记录
-            if self.SecurityIDSource==SecurityIDSource_SZSE and isinstance(msg, (axsbe_order, axsbe_exe)):
+            if self.SecurityIDSource==SecurityIDSource_SZSE and is_inc:
                 self.last_inc_applSeqNum = msg.ApplSeqNum
         
-        elif isinstance(msg, AX_SIGNAL):
+        elif kind==MSG_KIND_SIGNAL:
+            if self.snap_pending:
+                self._flushSnap()   # 合并模式：信号会修改交易阶段
             if msg==AX_SIGNAL.OPENCALL_END:
                 if self.bid_max_level_price<self.ask_min_level_price and self.TradingPhaseMarket==axsbe_base.TPM.OpenCall: #双方最优价无法成交，否则等成交
                     self.TradingPhaseMarket = axsbe_base.TPM.PreTradingBreaking #自行修改交易阶段，使生成的快照为交易快照
@@ -585,6 +657,7 @@ class AXOB():
                         self.holding_nb = 0
                     if self.holding_nb==0: #不再有缓存单
                         self.genSnap() # 先生成最后一个快照
+                        self._flushSnap()   # 合并模式：下面自行修改交易阶段，须先生成
 
                         self.TradingPhaseMarket = axsbe_base.TPM.CloseCall #自行修改交易阶段，使生成的快照为集合竞价快照
                         self.openCage() #开笼子，再生成集合竞价
@@ -616,19 +689,86 @@ class AXOB():
         ## 调试数据，仅用于测试算法是否正确：
         self.msg_nb += 1
         self.profile()
+        if self.trace is not None:
+            self.trace.write(self, kind, msg)
 
+        if self.check_policy==CHECK_POLICY.OFF:
+            return
+        elif self.check_policy==CHECK_POLICY.EVERY:
+            self.checkInvariant()
+        elif self.check_policy==CHECK_POLICY.EVERY_N:
+            if self.msg_nb % self.check_interval==0:
+                self.checkInvariant()
+        elif self.check_policy==CHECK_POLICY.PHASE:
+            if self.TradingPhaseMarket!=self.check_phase:
+                self.checkInvariant()
+                self.check_phase = self.TradingPhaseMarket
+        elif self.check_policy==CHECK_POLICY.SNAP:
+            if kind==MSG_KIND_SNAP:
+                self.checkInvariant()
+
+
+    def setCheckPolicy(self, policy:CHECK_POLICY, interval=None):
+        '''设置本AXOB的自检策略，interval仅用于CHECK_POLICY.EVERY_N'''
+        self.check_policy = policy
+        if interval is not None:
+            if interval<=0:
+                raise Exception(f'check interval={interval} must be positive!')
+            self.check_interval = interval
+        self.check_phase = self.TradingPhaseMarket
+
+
+    def setTrace(self, fileName):
+        '''每条消息处理后写一条二进制跟踪记录到fileName，见axob_trace；fileName为None时关闭跟踪'''
+        if self.trace is not None:
+            self.trace.close()
+        self.trace = None if fileName is None else axob_trace(fileName)
+
+    def setSnapSpill(self, fileName):
+        '''按保留策略淘汰的交易所快照写到fileName，可用msg_util.axsbe_bytes读回；fileName为None时关闭'''
+        if self.snap_spill is not None:
+            self.snap_spill.close()
+        self.snap_spill = None if fileName is None else open(fileName, 'wb')
+
+    def flush(self):
+        '''回放结束时调用：合并模式下生成待生成的快照，跟踪记录、淘汰的快照写盘'''
+        self._flushSnap()
+        self._flushFiles()
+
+    def _flushFiles(self):
+        '''跟踪记录、淘汰的快照写盘'''
+        if self.trace is not None:
+            self.trace.flush()
+        if self.snap_spill is not None:
+            self.snap_spill.flush()
+
+    def close(self):
+        '''写盘并关闭跟踪、快照淘汰文件'''
+        self.setTrace(None)
+        self.setSnapSpill(None)
+
+
+    def checkInvariant(self):
+        '''审计本地缓存与价格档是否一致、加权量与位宽是否正确，O(价格档数)'''
         if len(self.ask_level_tree):
             if self.market_subtype==MARKET_SUBTYPE.SZSE_STK_GEM and self.ask_cage_lower_ex_max_level_qty:
                 assert self.ask_min_level_price>self.ask_cage_lower_ex_max_level_price, f'{self.SecurityID:06d} cache ask-min-price/cage-max NG'
             else:
-                assert self.ask_min_level_price==min(self.ask_level_tree.keys()), f'{self.SecurityID:06d} cache ask-min-price NG'
-                assert self.ask_min_level_qty==min(self.ask_level_tree.items(), key=lambda x: x[0])[1].qty, f'{self.SecurityID:06d} cache ask-min-qty NG'
+                assert self.ask_min_level_price==self.ask_level_tree.locate_min().price, f'{self.SecurityID:06d} cache ask-min-price NG'
+                assert self.ask_min_level_qty==self.ask_level_tree.locate_min().qty, f'{self.SecurityID:06d} cache ask-min-qty NG'
         if len(self.bid_level_tree):
             if self.market_subtype==MARKET_SUBTYPE.SZSE_STK_GEM and self.bid_cage_upper_ex_min_level_qty:
                 assert self.bid_max_level_price<self.bid_cage_upper_ex_min_level_price, f'{self.SecurityID:06d} cache bid-max-price/cage-min NG'
             else:
-                assert self.bid_max_level_price==max(self.bid_level_tree.keys()), f'{self.SecurityID:06d} cache bid-max-price NG'
-                assert self.bid_max_level_qty==max(self.bid_level_tree.items(), key=lambda x: x[0])[1].qty, f'{self.SecurityID:06d} ache bid-max-qty NG'
+                assert self.bid_max_level_price==self.bid_level_tree.locate_max().price, f'{self.SecurityID:06d} cache bid-max-price NG'
+                assert self.bid_max_level_qty==self.bid_level_tree.locate_max().qty, f'{self.SecurityID:06d} ache bid-max-qty NG'
+
+        if self.bid_top_key is not None and self.bid_top_key==self._bidTopKey():
+            top = [l for p, l in self.bid_level_tree.inorder_list_dec() if self.bid_top_key==0 or p<self.bid_top_key][:SNAP_TOP_LEVEL_NB]
+            assert top==self.bid_top_levels, f'{self.SecurityID:06d} cache bid-top-levels NG'
+        if self.ask_top_key is not None and self.ask_top_key==self._askTopKey():
+            top = [l for p, l in self.ask_level_tree.inorder_list_inc() if self.ask_top_key==0 or p>self.ask_top_key][:SNAP_TOP_LEVEL_NB]
+            assert top==self.ask_top_levels, f'{self.SecurityID:06d} cache ask-top-levels NG'
 
         if (self.TradingPhaseMarket==axsbe_base.TPM.AMTrading or self.TradingPhaseMarket==axsbe_base.TPM.PMTrading) and self.bid_max_level_qty and self.ask_min_level_qty:
             assert self.bid_max_level_price<self.ask_min_level_price, f'{self.SecurityID:06d} bid.max({self.bid_max_level_price})/ask.min({self.ask_min_level_price}) NG @{self.current_inc_tick}'
@@ -657,8 +797,11 @@ class AXOB():
         assert static_BidWeightSize==self.BidWeightSize, f'{self.SecurityID:06d} static BidWeightSize={static_BidWeightSize}, dynamic BidWeightSize={self.BidWeightSize}'
         assert static_BidWeightValue==self.BidWeightValue, f'{self.SecurityID:06d} static BidWeightValue={self.BidWeightValue}, dynamic BidWeightValue={self.BidWeightValue}'
 
-        for _,ls in self.market_snaps.items():
-            assert len(ls)!=0, f'{self.SecurityID:06d} market snap not pop clean'
+        for _,bucket in self.market_snaps.items():
+            assert len(bucket)!=0, f'{self.SecurityID:06d} market snap not pop clean'
+            for _,ls in bucket.items():
+                assert len(ls)!=0, f'{self.SecurityID:06d} market snap not pop clean'
+        assert self.market_snaps.nb==sum(1 for _ in self.market_snaps.snaps()), f'{self.SecurityID:06d} market snap nb NG'
 
 
     def openCage(self):
@@ -669,7 +812,7 @@ class AXOB():
         if self.UpLimitPx==msg_util.ORDER_PRICE_OVERFLOW: #无涨跌停限制=创业板上市头5日 TODO: 更精确
             ex_p = []
             self._export_level_access(f'LEVEL_ACCESS ASK inorder_list_inc //remove invalid price')
-            for p, l in sorted(self.ask_level_tree.items(),key=lambda x:x[0], reverse=False):    #从小到大遍历
+            for p, l in self.ask_level_tree.inorder_list_inc():    #从小到大遍历
                 if p>msg_util.CYB_match_upper(self.LastPx) or p<msg_util.CYB_match_lower(self.LastPx):
                     ex_p.append(p)
                     if not self.ask_cage_lower_ex_max_level_qty or p>self.ask_cage_lower_ex_max_level_price:    #属于被纳入动态统计的价格档
@@ -681,7 +824,7 @@ class AXOB():
 
             ex_p = []
             self._export_level_access(f'LEVEL_ACCESS BID inorder_list_dec //remove invalid price')
-            for p, l in sorted(self.bid_level_tree.items(),key=lambda x:x[0], reverse=True):    #从大到小遍历
+            for p, l in self.bid_level_tree.inorder_list_dec():    #从大到小遍历
                 if p>msg_util.CYB_match_upper(self.LastPx) or p<msg_util.CYB_match_lower(self.LastPx):
                     ex_p.append(p)
                     if not self.bid_cage_upper_ex_min_level_qty or p<self.bid_cage_upper_ex_min_level_price:    #属于被纳入动态统计的价格档
@@ -690,11 +833,12 @@ class AXOB():
             for p in ex_p:
                 self.bid_level_tree.pop(p)
                 self._export_level_access(f'LEVEL_ACCESS BID remove {p} //remove invalid price') #二叉树也不能边遍历边修改, TODO: 全部remove后再平衡？
+            self._topLevelReset()
 
 
         if self.ask_cage_lower_ex_max_level_qty:
             self._export_level_access(f'LEVEL_ACCESS ASK inorder_list_inc while <={self.ask_cage_lower_ex_max_level_price} //openCage')
-            for p, l in sorted(self.ask_level_tree.items(),key=lambda x:x[0], reverse=False):    #从小到大遍历
+            for p, l in self.ask_level_tree.inorder_list_inc():    #从小到大遍历
                 if p<=self.ask_cage_lower_ex_max_level_price:
                     self.AskWeightSize += l.qty
                     self.AskWeightValue += p * l.qty
@@ -702,13 +846,14 @@ class AXOB():
                     break
 
             self.ask_cage_lower_ex_max_level_qty = 0
-            self.ask_min_level_price = min(self.ask_level_tree.keys())
-            self.ask_min_level_qty = self.ask_level_tree[self.ask_min_level_price].qty
+            l = self.ask_level_tree.locate_min()
+            self.ask_min_level_price = l.price
+            self.ask_min_level_qty = l.qty
             self._export_level_access(f'LEVEL_ACCESS ASK locate_min //openCage') #TODO: 直接在上面遍历时赋值
 
         if self.bid_cage_upper_ex_min_level_qty:
             self._export_level_access(f'LEVEL_ACCESS BID inorder_list_dec while >={self.bid_cage_upper_ex_min_level_price} //openCage')
-            for p, l in sorted(self.bid_level_tree.items(),key=lambda x:x[0], reverse=True):    #从大到小遍历
+            for p, l in self.bid_level_tree.inorder_list_dec():    #从大到小遍历
                 if p>=self.bid_cage_upper_ex_min_level_price:
                     self.BidWeightSize += l.qty
                     self.BidWeightValue += p * l.qty
@@ -716,8 +861,9 @@ class AXOB():
                     break
 
             self.bid_cage_upper_ex_min_level_qty = 0
-            self.bid_max_level_price = max(self.bid_level_tree.keys())
-            self.bid_max_level_qty = self.bid_level_tree[self.bid_max_level_price].qty
+            l = self.bid_level_tree.locate_max()
+            self.bid_max_level_price = l.price
+            self.bid_max_level_qty = l.qty
             self._export_level_access(f'LEVEL_ACCESS BID locate_max //openCage') #TODO: 直接在上面遍历时赋值
         # self._print_levels()
 
@@ -751,15 +897,12 @@ class AXOB():
             _order = ob_order(order, self.instrument_type)
         elif self.SecurityIDSource == SecurityIDSource_SSE:
             # order or cancel
-            if order.Type_str=='新增':
+            if order.OrdType==SSE_ORDTYPE_ADD:
                 _order = ob_order(order, self.instrument_type)
             
             # 上海的 撤单 是在 委托回报中的
-            elif order.Type_str=='删除':
-                if order.Side_str=='买入':
-                    Side=SIDE.BID
-                elif order.Side_str=='卖出':
-                    Side=SIDE.ASK
+            elif order.OrdType==SSE_ORDTYPE_DEL:
+                Side = _SIDE_OF[(SecurityIDSource_SSE, order.Side)]
                 _cancel = ob_cancel(order.OrderNo, order.Qty, order.Price, Side, order.TransactTime, self.SecurityIDSource, self.instrument_type, self.SecurityID)
                 self.onCancel(_cancel)
                 return
@@ -894,6 +1037,7 @@ class AXOB():
                 
                 # 1. 判断是否为市价单, 市价单 暂存起来
                 if order.type == TYPE.MARKET:
+                    self._flushSnap()   # 合并模式：缓存单成交完成前的中间态不能合并进来，先生成
                     self.holding_order = order
                     self.holding_nb += 1
                     self.DBG('hold MARKET-order')
@@ -919,6 +1063,7 @@ class AXOB():
                     # 如果能满足成交, 那先缓存, 等待后续的成交回报(因为后续肯定会接着一个成交回报)
                     if is_crossing_spread:
                         # 情况 A: 跨价限价单，缓存住，等待后续成交消息确认
+                        self._flushSnap()   # 合并模式：缓存单成交完成前的中间态不能合并进来，先生成
                         self.holding_order = order
                         self.holding_nb += 1
                         self.DBG('hold LIMIT-order')
@@ -1023,6 +1168,7 @@ self.ask_cage_ref_px = 9.80
                 # 如果是订单簿之外的 新价格 那就插入
                 node = level_node(order.price, order.qty, order.applSeqNum)
                 self.bid_level_tree[order.price] = node
+                self._topLevelInsert(SIDE.BID, node)
 
                 # self._export_level_access(f'LEVEL_ACCESS BID insert {order.price} //insertOrder')
                 # 插入订单之后, 再检查是否要修正缓存, 需要判断, 只有没出笼的才需要判断更新
@@ -1038,13 +1184,13 @@ self.ask_cage_ref_px = 9.80
                         # 更新卖方笼子 基准价
                         # 买一价变了，卖方的价格笼子基准价通常依赖于买一价，所以要同步更新
                         self.ask_cage_ref_px = order.price
-                        self.DBG(f'Ask cage ref px={self.ask_cage_ref_px}')
+                        if self.DBG_ON: self.DBG(f'Ask cage ref px={self.ask_cage_ref_px}')
 
                         # 如果没有卖单
                         # 如果没有对手盘（ask_min_level_qty为0）买方笼子的基准价也暂时由买一价决定。
                         if not self.ask_min_level_qty:  #没有对手价
                             self.bid_cage_ref_px = order.price
-                            self.DBG(f'bid cage ref px={self.bid_cage_ref_px}')
+                            if self.DBG_ON: self.DBG(f'bid cage ref px={self.bid_cage_ref_px}')
 
                         # 既然“卖方笼子基准价”变了（可能变高了），那么卖方笼子上限可能提高。
                         # 必须通知系统去检查是否有卖方隐藏单可以放出来。
@@ -1065,7 +1211,7 @@ self.ask_cage_ref_px = 9.80
                         # 更新候补信息
                         self.bid_cage_upper_ex_min_level_price = order.price
                         self.bid_cage_upper_ex_min_level_qty = order.qty
-                        self.DBG(f'Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by new price')
+                        if self.DBG_ON: self.DBG(f'Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by new price')
 
             # 没进笼子的都统计一下, 买方委托总量以及 买方委托总金额
             if not outOfCage:
@@ -1090,6 +1236,7 @@ self.ask_cage_ref_px = 9.80
             else:
                 node = level_node(order.price, order.qty, order.applSeqNum)
                 self.ask_level_tree[order.price] = node
+                self._topLevelInsert(SIDE.ASK, node)
                 # self._export_level_access(f'LEVEL_ACCESS ASK insert {order.price} //insertOrder')
 
                 if order.price==PRICE_MAXIMUM:
@@ -1145,8 +1292,8 @@ self.ask_cage_ref_px = 9.80
         逐笔成交入口
         跳转到处理成交或处理撤单
         '''
-        self.DBG(f'msg#{self.msg_nb} onExec:{exec}')
-        if exec.ExecType_str=='成交' or self.SecurityIDSource==SecurityIDSource_SSE:
+        if self.DBG_ON: self.DBG(f'msg#{self.msg_nb} onExec:{exec}')
+        if exec.ExecType==SZSE_EXECTYPE_TRADE or self.SecurityIDSource==SecurityIDSource_SSE:
             _exec = ob_exec(exec, self.instrument_type)
             self.onTrade(_exec)
         else:
@@ -1248,7 +1395,7 @@ self.ask_cage_ref_px = 9.80
 
             # 当前缓存的单子（主动单/Taker）到底是买方还是卖方？如果成交记录里买方的序号（BidApplSeqNum）等于我们缓存单的序号，说明我们缓存的是个买单
             level_side = SIDE.ASK if exec.BidApplSeqNum==self.holding_order.applSeqNum else SIDE.BID #level_side:缓存单的对手盘
-            self.DBG(f'level_side={level_side}')
+            if self.DBG_ON: self.DBG(f'level_side={level_side}')
             assert self.holding_order.qty>=exec.LastQty, f"{self.SecurityID:06d} holding order Qty unmatch"
             if self.holding_order.qty==exec.LastQty:
                 self.holding_nb = 0  # 恰好全部成交，清空缓存
@@ -1315,6 +1462,7 @@ self.ask_cage_ref_px = 9.80
 
             # 无论这笔成交是由于集合竞价产生的，还是因为交易所乱序推送产生的，只要成交发生了，买卖双方的单子就是确确实实被消耗了。
             # 因此，无条件进入内部的价格档位树（Level Tree）中扣减掉对应的 LastQty
+            self._flushSnap()   # 合并模式：集合竞价成交完成前的中间态不能合并进来，成交完成后还可能切换交易阶段，先生成
             self.tradeLimit(SIDE.ASK, exec.LastQty, exec.OfferApplSeqNum)
             self.tradeLimit(SIDE.BID, exec.LastQty, exec.BidApplSeqNum)
 
@@ -1355,7 +1503,7 @@ self.ask_cage_ref_px = 9.80
                     # 在连续竞价阶段，订单簿的 买一价必须永远小于卖一价。
                     # 等待“逐笔成交”驱动 (Event Driven)
             
-                    self.DBG(f'ASK px may changed: waiting for BID level' 
+                    if self.DBG_ON: self.DBG(f'ASK px may changed: waiting for BID level' 
                              f'({self.bid_cage_upper_ex_min_level_price} x {self.bid_cage_upper_ex_min_level_qty}) to enter cage & exec')
                     break
                 else:   #无法成交，将隐藏订单加到买方队列
@@ -1381,12 +1529,12 @@ self.ask_cage_ref_px = 9.80
                     # 寻找下一个隐藏订单，继续循环，直到无隐藏订单、隐藏订单可成交
                     self.bid_cage_upper_ex_min_level_qty = 0
                     # self._export_level_access(f'LEVEL_ACCESS BID locate_higher {self.bid_cage_upper_ex_min_level_price} //enterCage:find next order out of cage')
-                    for p, l in sorted(self.bid_level_tree.items(),key=lambda x:x[0], reverse=False):    #从小到大遍历
-                        if p>self.bid_cage_upper_ex_min_level_price:
-                            self.bid_cage_upper_ex_min_level_price = p
-                            self.bid_cage_upper_ex_min_level_qty = l.qty
-                            self.DBG(f'Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by prev bid level enter cage')
-                            break
+                    l = self.bid_level_tree.locate_higher(self.bid_cage_upper_ex_min_level_price)
+                    if l is not None:
+                        self.bid_cage_upper_ex_min_level_price = l.price
+                        self.bid_cage_upper_ex_min_level_qty = l.qty
+                        if self.DBG_ON: self.DBG(f'Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by prev bid level enter cage')
+                    self._topLevelEnterCage(SIDE.BID, self.bid_max_level_price)
             else:
                 # 买方最优价没有被修改
                 # 如果没有买单能进笼子，重置标记，表示不需要特意等待买方检查
@@ -1407,7 +1555,7 @@ self.ask_cage_ref_px = 9.80
                 # self.TradingPhaseMarket != ...: 非波动性中断
                 if self.bid_max_level_qty and self.ask_cage_lower_ex_max_level_price<=self.bid_max_level_price and self.TradingPhaseMarket!=axsbe_base.TPM.VolatilityBreaking: #可与买方最优成交
                     # 同样，如果能成交，跳出循环，交由外部逻辑处理成交
-                    self.DBG(f'BID px may changed: waiting for ASK level'
+                    if self.DBG_ON: self.DBG(f'BID px may changed: waiting for ASK level'
                              f'({self.ask_cage_lower_ex_max_level_price} x {self.ask_cage_lower_ex_max_level_qty}) to enter cage & exec')
                     break
                 else:   #无法成交，将隐藏订单加到买方队列
@@ -1435,12 +1583,12 @@ self.ask_cage_ref_px = 9.80
                     # 当前的进来了，找剩下还在外面的卖单里价格最高的（最接近有效区间的）
                     self.ask_cage_lower_ex_max_level_qty = 0
                     # self._export_level_access(f'LEVEL_ACCESS ASK locate_lower {self.ask_cage_lower_ex_max_level_price} //enterCage:find next order out of cage')
-                    for p, l in sorted(self.ask_level_tree.items(),key=lambda x:x[0], reverse=True):    #从大到小遍历
-                        if p<self.ask_cage_lower_ex_max_level_price:
-                            self.ask_cage_lower_ex_max_level_price = p
-                            self.ask_cage_lower_ex_max_level_qty = l.qty
-                            # self.DBG(f'Refresh ask_cage_lower_ex_max_level_price={self.ask_cage_lower_ex_max_level_price} by prev ask level enter cage')
-                            break
+                    l = self.ask_level_tree.locate_lower(self.ask_cage_lower_ex_max_level_price)
+                    if l is not None:
+                        self.ask_cage_lower_ex_max_level_price = l.price
+                        self.ask_cage_lower_ex_max_level_qty = l.qty
+                        # self.DBG(f'Refresh ask_cage_lower_ex_max_level_price={self.ask_cage_lower_ex_max_level_price} by prev ask level enter cage')
+                    self._topLevelEnterCage(SIDE.ASK, self.ask_min_level_price)
             else:
                 # 如果没有卖单能进笼子，重置标记
                 self.ask_waiting_for_cage = False
@@ -1533,12 +1681,11 @@ self.ask_cage_ref_px = 9.80
                     # 只有这样，当笼子上限由于基准价变动而上移时，模型才能准确知道接下来该把哪一档暗单“释放”进盘口。
                     # 从小到大遍历买方价格树
                     self._export_level_access(f'LEVEL_ACCESS BID locate_higher {self.bid_cage_upper_ex_min_level_price} //levelDequeue:find next level out of cage')
-                    for p, l in sorted(self.bid_level_tree.items(),key=lambda x:x[0], reverse=False):    #从小到大遍历，TODO:可以先判断是否存在
-                        if p>self.bid_cage_upper_ex_min_level_price:
-                            self.bid_cage_upper_ex_min_level_price = p
-                            self.bid_cage_upper_ex_min_level_qty = l.qty
-                            self.DBG(f'Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by canceled/traded all')
-                            break
+                    l = self.bid_level_tree.locate_higher(self.bid_cage_upper_ex_min_level_price)
+                    if l is not None:
+                        self.bid_cage_upper_ex_min_level_price = l.price
+                        self.bid_cage_upper_ex_min_level_qty = l.qty
+                        if self.DBG_ON: self.DBG(f'Refresh bid_cage_upper_ex_min_level_price={self.bid_cage_upper_ex_min_level_price} by canceled/traded all')
             
             # 继续判断 当前成交的量是否被吃完
             #     如果只是减少，档位依然存在，不需要调整整体结构。
@@ -1553,11 +1700,10 @@ self.ask_cage_ref_px = 9.80
                     # locate next lower bid level
                     # 从大到小, 寻找第一个严格小于旧买一价（p < self.bid_max_level_price）的价格档位，让它接班成为新的买一价
                     self._export_level_access(f'LEVEL_ACCESS BID locate_lower {self.bid_max_level_price} //levelDequeue:find next side level')
-                    for p, l in sorted(self.bid_level_tree.items(),key=lambda x:x[0], reverse=True):    #从大到小遍历
-                        if p<self.bid_max_level_price:
-                            self.bid_max_level_price = p
-                            self.bid_max_level_qty = l.qty
-                            break
+                    l = self.bid_level_tree.locate_lower(self.bid_max_level_price)
+                    if l is not None:
+                        self.bid_max_level_price = l.price
+                        self.bid_max_level_qty = l.qty
                     
                     # 既然买方最高价（买一）发生了变化，或者买盘直接被抽干了，那么以“买一”作为基准价的“卖方价格笼子”就必须立刻跟着重新计算！
                     # 前面代码已经找出了新的买方最高价。如果买方盘口还有单子（qty != 0），那么卖方（Ask）价格笼子的新基准价，理所当然就是这个新的“买一价”
@@ -1585,7 +1731,7 @@ self.ask_cage_ref_px = 9.80
                         else:
                             # 最新价
                             self.ask_cage_ref_px = self.LastPx # 一旦lastPx被更新，总会到这里，而此后就不会再用PreClosePx了
-                    self.DBG(f'Ask cage ref px={self.ask_cage_ref_px}')
+                    if self.DBG_ON: self.DBG(f'Ask cage ref px={self.ask_cage_ref_px}')
                     
                     # 当前的市场交易阶段，是否处于上午的连续竞价（AMTrading，9:30-11:30）或下午的连续竞价（PMTrading，13:00-14:57）
                     # 否则如果在集合竞价期间（或者停牌、中午休市），直接走 else 分支，把标志位设为 False，禁止触发笼子扫描
@@ -1598,6 +1744,7 @@ self.ask_cage_ref_px = 9.80
                 #remove要在locate_lower之后
                 self.bid_level_tree.pop(price)
                 self._export_level_access(f'LEVEL_ACCESS BID remove {price} //levelDequeue')
+                self._topLevelRemove(SIDE.BID, price)
             else:
                 self._export_level_access(f'LEVEL_ACCESS BID writeback {price} //levelDequeue')
 
@@ -1620,12 +1767,11 @@ self.ask_cage_ref_px = 9.80
                 if self.ask_cage_lower_ex_max_level_qty==0: #卖方价格笼子外最高价被cancel/trade光
                     # locate next high bid level
                     self._export_level_access(f'LEVEL_ACCESS ASK locate_lower {self.ask_cage_lower_ex_max_level_price} //levelDequeue:find next level out of cage')
-                    for p, l in sorted(self.ask_level_tree.items(),key=lambda x:x[0], reverse=True):    #从大到小遍历，TODO:可以先判断是否存在
-                        if p<self.ask_cage_lower_ex_max_level_price:
-                            self.ask_cage_lower_ex_max_level_price = p
-                            self.ask_cage_lower_ex_max_level_qty = l.qty
-                            self.DBG(f'Refresh ask_cage_lower_ex_max_level_price={self.ask_cage_lower_ex_max_level_price} by canceled/traded all')
-                            break
+                    l = self.ask_level_tree.locate_lower(self.ask_cage_lower_ex_max_level_price)
+                    if l is not None:
+                        self.ask_cage_lower_ex_max_level_price = l.price
+                        self.ask_cage_lower_ex_max_level_qty = l.qty
+                        if self.DBG_ON: self.DBG(f'Refresh ask_cage_lower_ex_max_level_price={self.ask_cage_lower_ex_max_level_price} by canceled/traded all')
 
 
             if self.ask_level_tree[price].qty==0:
@@ -1636,11 +1782,10 @@ self.ask_cage_ref_px = 9.80
                     # locate next higher ask level
                     self.ask_min_level_qty = 0
                     self._export_level_access(f'LEVEL_ACCESS ASK locate_higher {self.ask_min_level_price} //levelDequeue:find next side level')
-                    for p, l in sorted(self.ask_level_tree.items(),key=lambda x:x[0], reverse=False):    #从小到大遍历
-                        if p>self.ask_min_level_price:
-                            self.ask_min_level_price = p
-                            self.ask_min_level_qty = l.qty
-                            break
+                    l = self.ask_level_tree.locate_higher(self.ask_min_level_price)
+                    if l is not None:
+                        self.ask_min_level_price = l.price
+                        self.ask_min_level_qty = l.qty
 
                     # 修改买方价格笼子参考价
                     if self.ask_min_level_qty!=0:                           # 卖方还有下一档
@@ -1653,7 +1798,7 @@ self.ask_cage_ref_px = 9.80
                             self.bid_cage_ref_px = self.bid_max_level_price
                         else:
                             self.bid_cage_ref_px = self.LastPx # 一旦lastPx被更新，总会到这里，而此后就不会再用PreClosePx了
-                    self.DBG(f'Bid cage ref px={self.bid_cage_ref_px}')
+                    if self.DBG_ON: self.DBG(f'Bid cage ref px={self.bid_cage_ref_px}')
 
                     if self.TradingPhaseMarket==axsbe_base.TPM.AMTrading or self.TradingPhaseMarket==axsbe_base.TPM.PMTrading:
                         self.bid_waiting_for_cage = True if self.market_subtype==MARKET_SUBTYPE.SZSE_STK_GEM else False
@@ -1663,12 +1808,161 @@ self.ask_cage_ref_px = 9.80
                 #remove要在locate_lower之后
                 self.ask_level_tree.pop(price)
                 self._export_level_access(f'LEVEL_ACCESS ASK remove {price} //levelDequeue')
+                self._topLevelRemove(SIDE.ASK, price)
             else:
                 self._export_level_access(f'LEVEL_ACCESS ASK writeback {price} //levelDequeue')
 
 
+    def _bidTopKey(self):
+        return self.bid_cage_upper_ex_min_level_price if self.bid_cage_upper_ex_min_level_qty else 0
+
+    def _askTopKey(self):
+        return self.ask_cage_lower_ex_max_level_price if self.ask_cage_lower_ex_max_level_qty else 0
+
+    def _topLevelReset(self):
+        '''盘口最优档缓存失效，下次读取时重建'''
+        self.bid_top_key = None
+        self.ask_top_key = None
+
+    def _topLevelInsert(self, side, node):
+        '''价格树新增价格档后调用：若为笼内价格且优于缓存末档(或缓存未满)，插入缓存'''
+        if side==SIDE.BID:
+            key, top = self.bid_top_key, self.bid_top_levels
+            if key is None:
+                return
+            if key!=self._bidTopKey():
+                self.bid_top_key = None
+                return
+            if key and node.price>=key: #笼外
+                return
+            if len(top)>=SNAP_TOP_LEVEL_NB and node.price<top[-1].price:
+                return
+            i = 0
+            while i<len(top) and top[i].price>node.price:
+                i += 1
+        else:
+            key, top = self.ask_top_key, self.ask_top_levels
+            if key is None:
+                return
+            if key!=self._askTopKey():
+                self.ask_top_key = None
+                return
+            if key and node.price<=key: #笼外
+                return
+            if len(top)>=SNAP_TOP_LEVEL_NB and node.price>top[-1].price:
+                return
+            i = 0
+            while i<len(top) and top[i].price<node.price:
+                i += 1
+        top.insert(i, node)
+        del top[SNAP_TOP_LEVEL_NB:]
+
+    def _topLevelRemove(self, side, price):
+        '''价格树删除价格档后调用：若在缓存中则删除，缓存原本已满时从价格树补入下一档'''
+        if side==SIDE.BID:
+            key, top, tree = self.bid_top_key, self.bid_top_levels, self.bid_level_tree
+            if key is None:
+                return
+            new_key = self._bidTopKey()
+            if key!=new_key:
+                # 仅笼外最低档被删光、笼外最低档后移(或不再有笼外档)时，笼内价格档不变
+                if price==key and (new_key==0 or new_key>key):
+                    self.bid_top_key = new_key
+                    return
+                self.bid_top_key = None
+                return
+        else:
+            key, top, tree = self.ask_top_key, self.ask_top_levels, self.ask_level_tree
+            if key is None:
+                return
+            new_key = self._askTopKey()
+            if key!=new_key:
+                if price==key and (new_key==0 or new_key<key):
+                    self.ask_top_key = new_key
+                    return
+                self.ask_top_key = None
+                return
+
+        for i in range(len(top)):
+            if top[i].price==price:
+                break
+        else:
+            return
+        full = len(top)>=SNAP_TOP_LEVEL_NB
+        del top[i]
+        if full:
+            last = top[-1].price if len(top) else price
+            l = tree.locate_lower(last) if side==SIDE.BID else tree.locate_higher(last)  # 笼内价格档之后的价格档必在笼内
+            if l is not None:
+                top.append(l)
+
+    def _topLevelEnterCage(self, side, price):
+        '''笼外价格档进笼(成为新的最优档)后调用'''
+        if side==SIDE.BID:
+            if self.bid_top_key is None or self.bid_top_key!=price: # 进笼的不是缓存时的笼外最低档
+                self.bid_top_key = None
+                return
+            self.bid_top_levels.insert(0, self.bid_level_tree[price])
+            del self.bid_top_levels[SNAP_TOP_LEVEL_NB:]
+            self.bid_top_key = self._bidTopKey()
+        else:
+            if self.ask_top_key is None or self.ask_top_key!=price:
+                self.ask_top_key = None
+                return
+            self.ask_top_levels.insert(0, self.ask_level_tree[price])
+            del self.ask_top_levels[SNAP_TOP_LEVEL_NB:]
+            self.ask_top_key = self._askTopKey()
+
+    def _getTopLevels(self, side):
+        '''读取盘口最优档缓存，失效时遍历价格树重建'''
+        if side==SIDE.BID:
+            key = self._bidTopKey()
+            if self.bid_top_key is None or self.bid_top_key!=key:
+                top = []
+                for p, l in self.bid_level_tree.inorder_list_dec():    #从大到小遍历
+                    if key==0 or p<key:
+                        top.append(l)
+                        if len(top)>=SNAP_TOP_LEVEL_NB:
+                            break
+                self.bid_top_levels = top
+                self.bid_top_key = key
+            return self.bid_top_levels
+        else:
+            key = self._askTopKey()
+            if self.ask_top_key is None or self.ask_top_key!=key:
+                top = []
+                for p, l in self.ask_level_tree.inorder_list_inc():    #从小到大遍历
+                    if key==0 or p>key:
+                        top.append(l)
+                        if len(top)>=SNAP_TOP_LEVEL_NB:
+                            break
+                self.ask_top_levels = top
+                self.ask_top_key = key
+            return self.ask_top_levels
+
+
+    def resetLevelTree(self):
+        '''涨跌停价确定后按LEVEL_TREE_TYPE重建价格档容器，已有价格档原样迁移；只有'ladder'依赖涨跌停价'''
+        if LEVEL_TREE_TYPE!='ladder':
+            return
+        if self.UpLimitPx==msg_util.ORDER_PRICE_OVERFLOW: #无涨跌停限制=创业板上市头5日，保持稀疏存储
+            lo, hi = 0, 0
+        else:
+            lo, hi = self.DnLimitPrice, self.UpLimitPrice
+        for attr in ['bid_level_tree', 'ask_level_tree']:
+            old = getattr(self, attr)
+            if getattr(old, 'lo', 0)==lo and getattr(old, 'hi', 0)==hi:
+                continue
+            v = new_level_tree(LEVEL_TREE_TYPE, lo, hi)
+            for p, l in old.items():
+                v[p] = l
+            setattr(self, attr, v)
+        self._topLevelReset()
+        if self.DBG_ON: self.DBG(f'Level tree: {type(self.bid_level_tree).__name__} [{lo}, {hi}]')
+
+
     def onSnap(self, snap:axsbe_snap_stock):
-        self.DBG(f'msg#{self.msg_nb} onSnap:{snap}')
+        if self.DBG_ON: self.DBG(f'msg#{self.msg_nb} onSnap:{snap}')
         if snap.TradingPhaseSecurity != axsbe_base.TPI.Normal:
             if self.SecurityIDSource==SecurityIDSource_SZSE: #深交所：当天可交易的始终都是可交易
                 self.ERR(f'TradingPhaseSecurity={axsbe_base.TPI.str(snap.TradingPhaseSecurity)}@{snap.HHMMSSms}')
@@ -1680,7 +1974,7 @@ self.ask_cage_ref_px = 9.80
         if snap.TradingPhaseMarket==axsbe_base.TPM.Starting: # 每天最早的一批快照(7点半前)是没有涨停价、跌停价的，不能只锁一次
             self.constantValue_ready = True
             if self.ChannelNo==CHANNELNO_INIT:
-                self.DBG(f"Update constatant: ChannelNo={snap.ChannelNo}, PrevClosePx={snap.PrevClosePx}, UpLimitPx={snap.UpLimitPx}, DnLimitPx={snap.DnLimitPx}")
+                if self.DBG_ON: self.DBG(f"Update constatant: ChannelNo={snap.ChannelNo}, PrevClosePx={snap.PrevClosePx}, UpLimitPx={snap.UpLimitPx}, DnLimitPx={snap.DnLimitPx}")
 
             self.ChannelNo = snap.ChannelNo
             if self.SecurityIDSource==SecurityIDSource_SZSE:
@@ -1707,7 +2001,7 @@ self.ask_cage_ref_px = 9.80
             if self.SecurityIDSource==SecurityIDSource_SZSE:
                 self.ask_cage_ref_px = self.PrevClosePx
                 self.bid_cage_ref_px = self.PrevClosePx
-                self.DBG(f'Init Bid cage ref px={self.bid_cage_ref_px}')
+                if self.DBG_ON: self.DBG(f'Init Bid cage ref px={self.bid_cage_ref_px}')
 
                 self.UpLimitPx = snap.UpLimitPx
                 self.DnLimitPx = snap.DnLimitPx
@@ -1724,6 +2018,7 @@ self.ask_cage_ref_px = 9.80
                         self.DnLimitPrice = snap.DnLimitPx // (msg_util.PRICE_SZSE_SNAP_PRECISION//PRICE_INTER_KZZ_PRECISION)
                     else:
                         raise Exception(f'instrument_type={self.instrument_type} is not ready!')    # TODO:
+                self.resetLevelTree()
             elif self.SecurityIDSource==SecurityIDSource_SSE:
                 pass
             else:
@@ -1764,35 +2059,33 @@ self.ask_cage_ref_px = 9.80
             # 上交所：从开盘集合竞价后休市开始生成快照，之前的不记录
             pass
         else:
-            # 在重建的快照中检索是否有相同的快照
-            if self.last_snap and snap.is_same(self.last_snap) and self._chkSnapTimestamp(snap, self.last_snap):
-                self.DBG(f'market snap #{self.msg_nb}({snap.TransactTime})'+
+            # 在重建的快照中检索是否有相同的快照：先按NumTrades和内容指纹定位，再用is_same确认
+            fp = snap.fingerprint(True) # 输入的快照可能被复制后改过字段，重算
+            if self.last_snap and fp==self.last_snap.fingerprint() and snap.is_same(self.last_snap) and self._chkSnapTimestamp(snap, self.last_snap):
+                if self.DBG_ON: self.DBG(f'market snap #{self.msg_nb}({snap.TransactTime})'+
                           f' matches last rebuilt snap #{self.last_snap._seq}({self.last_snap.TransactTime})')
-                ks = list(self.rebuilt_snaps.keys())
-                for k in ks:
-                    if k < snap.NumTrades:
-                        self.rebuilt_snaps.pop(k)
+                self.rebuilt_snaps.drop_below(snap.NumTrades)
                 #这里不丢弃last_snap，因为可能无逐笔数据而导致快照不更新
             else:
                 matched = False
-                if snap.NumTrades in self.rebuilt_snaps:
-                    for gen in self.rebuilt_snaps[snap.NumTrades]:
+                ls = self.rebuilt_snaps.find(snap)
+                if ls is not None:
+                    for gen in ls:
                         if snap.is_same(gen) and self._chkSnapTimestamp(snap, gen):
-                            self.DBG(f'market snap #{self.msg_nb}({snap.TransactTime})'+
+                            if self.DBG_ON: self.DBG(f'market snap #{self.msg_nb}({snap.TransactTime})'+
                                     f' matches history rebuilt snap #{gen._seq}({gen.TransactTime})')
                             matched = True
                             break
                 
                 if matched:
-                    ks = list(self.rebuilt_snaps.keys())
-                    for k in ks:
-                        if k < snap.NumTrades:
-                            self.rebuilt_snaps.pop(k)
+                    self.rebuilt_snaps.drop_below(snap.NumTrades)
                 else:
-                    if snap.NumTrades not in self.market_snaps:
-                        self.market_snaps[snap.NumTrades] = [snap]
-                    else:
-                        self.market_snaps[snap.NumTrades].append(snap) #缓存交易所快照
+                    self.market_snaps.add(snap) #缓存交易所快照
+                    evicted = self.market_snaps.retain(snap, SNAP_RETAIN_NUMTRADES, SNAP_RETAIN_MS, SNAP_RETAIN_MAX)
+                    if len(evicted):
+                        self.WARN(f'market snap evicted unmatched: {len(evicted)}')
+                        if self.snap_spill is not None:
+                            self.snap_spill.write(b''.join(x.bytes_stream for x in evicted))
                     # self.WARN(f'market snap #{self.msg_nb}({snap.TransactTime}) not found in history rebuilt snaps!')
 
 
@@ -1802,6 +2095,20 @@ self.ask_cage_ref_px = 9.80
         # 波动性中断）期间，交易暂停，可能会有订单挂在队列里无法成交，此时允许生成快照。
         assert self.TradingPhaseMarket==axsbe_base.TPM.VolatilityBreaking or self.holding_nb==0, f'{self.SecurityID:06d} genSnap but with holding'
 
+        if SNAP_COALESCE_TICK:
+            # 合并模式：只记下待生成，同一窗口内后续的变化会覆盖，见_flushSnap
+            self.snap_pending = True
+            self.snap_pending_window = self.current_inc_tick // SNAP_COALESCE_TICK
+        else:
+            self._genSnap()
+
+    def _flushSnap(self):
+        '''合并模式下生成待生成的快照，此时订单簿须仍为最后一次genSnap时的状态'''
+        if self.snap_pending:
+            self.snap_pending = False
+            self._genSnap()
+
+    def _genSnap(self):
         snap = None
         if self.TradingPhaseMarket < axsbe_base.TPM.OpenCall or self.TradingPhaseMarket > axsbe_base.TPM.Ending:
             # 还没开盘无需生成
@@ -1832,36 +2139,32 @@ self.ask_cage_ref_px = 9.80
 
         ## 调试数据，仅用于测试算法是否正确：
         if snap is not None:
-            self.DBG(snap)
+            if self.DBG_ON: self.DBG(snap)
 
             # 连续竞价期间（上午或下午），卖一价必须严格大于买一价
             # 如果出现 Bid >= Ask，说明有可以成交的订单没有成交，这意味着之前的逻辑（如 onLimitOrder 或 onExec）有漏网之鱼，模型状态错误。
+            # snap.levels 首档依次为 BidPrice BidQty AskPrice AskQty
+            levels = snap.levels
             if (snap.TradingPhaseMarket==axsbe_base.TPM.AMTrading or snap.TradingPhaseMarket==axsbe_base.TPM.PMTrading) and\
-                len(snap.ask)>0 and snap.ask[0].Qty and len(snap.bid) and snap.bid[0].Qty:
-                assert snap.ask[0].Price>snap.bid[0].Price, f'{self.SecurityID:06d} bid.max({snap.bid[0].Price})/ask.min({snap.ask[0].Price}) NG'
+                levels[3] and levels[1]:
+                assert levels[2]>levels[0], f'{self.SecurityID:06d} bid.max({levels[0]})/ask.min({levels[2]}) NG'
 
             snap._seq = self.msg_nb # 用于调试
             self.last_snap = snap
 
-            #在收到的交易所快照中查找是否有一样的,允许匹配多个快照
-            matched = []
-            if snap.NumTrades in self.market_snaps:
-                for rcv in self.market_snaps[snap.NumTrades]:
+            #在收到的交易所快照中查找是否有一样的,允许匹配多个快照；只需比对NumTrades和内容指纹都相同的
+            ls = self.market_snaps.find(snap)
+            if ls is not None:
+                matched = []
+                for rcv in ls:
                     if snap.is_same(rcv) and self._chkSnapTimestamp(rcv, snap):
                         self.WARN(f'rebuilt snap #{snap._seq}({snap.TransactTime}) matches history market snap #{rcv._seq}({rcv.TransactTime})') # 重建快照在市场快照之后，属于警告
                         matched.append(rcv)
-            
-            if len(matched): 
-                for rcv in matched:
-                    self.market_snaps[snap.NumTrades].remove(rcv)    #丢弃已匹配的
-                if len(self.market_snaps[snap.NumTrades])==0:
-                    self.market_snaps.pop(snap.NumTrades)
+                self.market_snaps.remove(matched)    #丢弃已匹配的
 
             # 总是缓存生成的快照，因为可能要跟多个市场快照匹配
-            if snap.NumTrades not in self.rebuilt_snaps:
-                self.rebuilt_snaps[snap.NumTrades] = [snap]
-            else:
-                self.rebuilt_snaps[snap.NumTrades].append(snap)
+            self.rebuilt_snaps.add(snap)
+            self.rebuilt_snaps.retain(snap, SNAP_RETAIN_NUMTRADES, SNAP_RETAIN_MS, SNAP_RETAIN_MAX)
 
 
     def _setSnapFixParam(self, snap):
@@ -1892,9 +2195,12 @@ self.ask_cage_ref_px = 9.80
     def _useTimestamp(self, TransactTime):
         if self.SecurityIDSource == SecurityIDSource_SZSE:
             # TransactTime 20220426092044460  -- > 9204446
-            self.current_inc_tick = TransactTime // SZSE_TICK_MS_TAIL % (SZSE_TICK_CUT // SZSE_TICK_MS_TAIL)    #只用逐笔 (10ms精度) 15000000 24b
+            tick = TransactTime // SZSE_TICK_MS_TAIL % (SZSE_TICK_CUT // SZSE_TICK_MS_TAIL)    #只用逐笔 (10ms精度) 15000000 24b
         else:
-            self.current_inc_tick = TransactTime # 上交所(1ms精度) 150000000
+            tick = TransactTime # 上交所(1ms精度) 150000000
+        if self.snap_pending and tick // SNAP_COALESCE_TICK != self.snap_pending_window:
+            self._flushSnap()   # 合并模式：进入下一窗口前生成上一窗口的快照，时戳用上一窗口的
+        self.current_inc_tick = tick
         if self.current_inc_tick >= (1<<TIMESTAMP_BIT_SIZE):
             self.ERR(f'msg.TransactTime={TransactTime} ovf!')
 
@@ -2004,13 +2310,12 @@ self.ask_cage_ref_px = 9.80
                     _bid_max_level_qty = 0  # 清空旧量
                     # self._export_level_access(f'LEVEL_ACCESS BID locate_lower {_bid_max_level_price} //callSnap:next side level')
                     # 遍历买单树（从高到低）
-                    for p, l in sorted(self.bid_level_tree.items(),key=lambda x:x[0], reverse=True):
-                        if p<_bid_max_level_price: # 找到第一个比当前价格低的价格
-                            # if price<=p:
-                            #     price = p+1
-                            _bid_max_level_price = p   # 更新买一价指针
-                            _bid_max_level_qty = l.qty # 更新买一量指针
-                            break                           # 找到即停止，准备下一轮撮合
+                    l = self.bid_level_tree.locate_lower(_bid_max_level_price) # 找到第一个比当前价格低的价格
+                    if l is not None:
+                        # if price<=l.price:
+                        #     price = l.price+1
+                        _bid_max_level_price = l.price  # 更新买一价指针
+                        _bid_max_level_qty = l.qty      # 更新买一量指针，准备下一轮撮合
 
                 if ask_Qty == 0:
                     if bid_Qty != 0:
@@ -2018,13 +2323,12 @@ self.ask_cage_ref_px = 9.80
                     # locate next higher ask level
                     _ask_min_level_qty = 0
                     # self._export_level_access(f'LEVEL_ACCESS ASK locate_higher {_ask_min_level_price} //callSnap:next side level')
-                    for p, l in sorted(self.ask_level_tree.items(),key=lambda x:x[0], reverse=False):    #从小到大遍历
-                        if p>_ask_min_level_price:     # 找到第一个比当前价格高的价格
-                            # if price>=p:
-                            #     price = p-1
-                            _ask_min_level_price = p   # 更新卖一价指针
-                            _ask_min_level_qty = l.qty # 更新卖一量指针
-                            break
+                    l = self.ask_level_tree.locate_higher(_ask_min_level_price) # 找到第一个比当前价格高的价格
+                    if l is not None:
+                        # if price>=l.price:
+                        #     price = l.price-1
+                        _ask_min_level_price = l.price  # 更新卖一价指针
+                        _ask_min_level_qty = l.qty      # 更新卖一量指针
 
             else:   #后续买卖双方至少一方无委托，或价格无交叉, （买一价 < 卖一价，不再有交叉）
                 
@@ -2137,12 +2441,12 @@ self.ask_cage_ref_px = 9.80
         #### 开始构造快照
         if self.SecurityIDSource==SecurityIDSource_SZSE:
             if self.instrument_type==INSTRUMENT_TYPE.STOCK or self.instrument_type==INSTRUMENT_TYPE.KZZ:
-                snap_call = axsbe_snap_stock(SecurityIDSource=self.SecurityIDSource, source=f"AXOB-call")
+                snap_call = axsbe_snap_compact(SecurityIDSource=self.SecurityIDSource, source=f"AXOB-call")
             else:
                 raise Exception(f'genCallSnap for instrument_type={self.instrument_type} is not ready!')
         elif self.SecurityIDSource==SecurityIDSource_SSE:
             if self.instrument_type==INSTRUMENT_TYPE.BOND or self.instrument_type==INSTRUMENT_TYPE.KZZ or self.instrument_type==INSTRUMENT_TYPE.NHG:
-                snap_call = axsbe_snap_stock(SecurityIDSource=self.SecurityIDSource, MsgType=MsgType_exe_sse_bond, source=f"AXOB-call")
+                snap_call = axsbe_snap_compact(SecurityIDSource=self.SecurityIDSource, MsgType=MsgType_exe_sse_bond, source=f"AXOB-call")
             else:
                 raise Exception(f'genCallSnap for instrument_type={self.instrument_type} is not ready!')
         
@@ -2196,54 +2500,55 @@ self.ask_cage_ref_px = 9.80
         生成连续竞价期间快照
         level_nb: 快照单边档数
         '''
-        snap_bid_levels = {}
+        # 根据证券类型（股票或可转债）创建对应的快照对象，重建快照用紧凑表示
+        if self.instrument_type==INSTRUMENT_TYPE.STOCK or self.instrument_type==INSTRUMENT_TYPE.KZZ:
+            snap = axsbe_snap_compact(SecurityIDSource=self.SecurityIDSource, source=f"AXOB-{level_nb}")
+        else:
+            self.WARN(f'genTradingSnap for instrument_type={self.instrument_type} is not ready!')
+            return None # TODO: not ready [Mid priority]
+
+        # 买卖盘直接写入snap.levels，各档依次为 BidPrice BidQty AskPrice AskQty；
+        # 实际档位不足 10 档（例如只有 5 个买单）时，剩下的档保持 (0, 0)
+        levels = snap.levels
         lv = 0
-        if not isVolatilityBreaking: #临停期间，各档均填0；非临停期间才从价格档中取值
-            # 遍历买方价格树：sorted(..., reverse=True) 表示从大到小排序（买一价最高）
-            for p, l in sorted(self.bid_level_tree.items(),key=lambda x:x[0], reverse=True):
+        if not isVolatilityBreaking and level_nb<=SNAP_TOP_LEVEL_NB: #直接读取增量维护的盘口最优档
+            for l in self._getTopLevels(SIDE.BID)[:level_nb]:
+                levels[lv*4] = self._fmtPrice_inter2snap(l.price)
+                levels[lv*4+1] = l.qty
+                lv += 1
+        elif not isVolatilityBreaking: #临停期间，各档均填0；非临停期间才从价格档中取值
+            # 遍历买方价格树：inorder_list_dec 表示从大到小遍历（买一价最高）
+            for p, l in self.bid_level_tree.inorder_list_dec():
                 # 【关键逻辑：价格笼子过滤】
                 # bid_cage_upper_ex_min_level_qty==0: 表示没有被笼子隐藏的订单
                 # p < self.bid_cage_upper_ex_min_level_price: 或者当前价格 p 小于“笼子外最低价”（即 p 在笼子内）
                 if self.bid_cage_upper_ex_min_level_qty==0 or p<self.bid_cage_upper_ex_min_level_price:
-                    # 创建价格档位对象：将内部价格精度转换为快照精度，并填入数量
-                    snap_bid_levels[lv] = price_level(self._fmtPrice_inter2snap(p), l.qty)
+                    # 将内部价格精度转换为快照精度，并填入数量
+                    levels[lv*4] = self._fmtPrice_inter2snap(p)
+                    levels[lv*4+1] = l.qty
                     lv += 1
                     # 如果填满了需要的档位数（如10档），就停止遍历
                     if lv>=level_nb:
                         break
-        
-        # 如果实际档位不足 10 档（例如只有 5 个买单），剩下的 5-9 档用 (0, 0) 填充
-        for i in range(lv, level_nb):
-            snap_bid_levels[i] = price_level(0, 0)
-            
-        snap_ask_levels = {}
+
         lv = 0
-        if not isVolatilityBreaking: #临停期间，各档均填0；非临停期间才从价格档中取值
+        if not isVolatilityBreaking and level_nb<=SNAP_TOP_LEVEL_NB:
+            for l in self._getTopLevels(SIDE.ASK)[:level_nb]:
+                levels[lv*4+2] = self._fmtPrice_inter2snap(l.price)
+                levels[lv*4+3] = l.qty
+                lv += 1
+        elif not isVolatilityBreaking: #临停期间，各档均填0；非临停期间才从价格档中取值
             # self._export_level_access(f'LEVEL_ACCESS ASK locate_higher {self.ask_min_level_price} x{level_nb} //tradingSnap:traverse side level')
-            # # 遍历卖方价格树：sorted(..., reverse=False) 表示从小到大排序（卖一价最低）
-            for p, l in sorted(self.ask_level_tree.items(),key=lambda x:x[0], reverse=False):    #从小到大遍历
+            # # 遍历卖方价格树：inorder_list_inc 表示从小到大遍历（卖一价最低）
+            for p, l in self.ask_level_tree.inorder_list_inc():    #从小到大遍历
                 # 【关键逻辑：价格笼子过滤】
                 if self.ask_cage_lower_ex_max_level_qty==0 or p>self.ask_cage_lower_ex_max_level_price:
-                    snap_ask_levels[lv] = price_level(self._fmtPrice_inter2snap(p), l.qty)
+                    levels[lv*4+2] = self._fmtPrice_inter2snap(p)
+                    levels[lv*4+3] = l.qty
                     lv += 1
                     if lv>=level_nb:
                         break
-        # 填充剩余空档
-        for i in range(lv, level_nb):
-            snap_ask_levels[i] = price_level(0, 0)
-
 
-        # 根据证券类型（股票或可转债）创建对应的快照对象
-        if self.instrument_type==INSTRUMENT_TYPE.STOCK or self.instrument_type==INSTRUMENT_TYPE.KZZ:
-            snap = axsbe_snap_stock(SecurityIDSource=self.SecurityIDSource, source=f"AXOB-{level_nb}")
-        else:
-            self.WARN(f'genTradingSnap for instrument_type={self.instrument_type} is not ready!')
-            return None # TODO: not ready [Mid priority]
-        
-        # 将构建好的买卖盘字典赋值给快照对象
-        snap.ask = snap_ask_levels
-        snap.bid = snap_bid_levels
-        
         # 固定参数
         # 设置固定参数：如证券代码、昨收价、涨跌停价等（这些在开盘前就确定了）
         self._setSnapFixParam(snap)
@@ -2349,11 +2654,10 @@ self.ask_cage_ref_px = 9.80
                 # locate next higher ask level
                 _ask_min_level_qty = 0
                 self._export_level_access(f'LEVEL_ACCESS ASK locate_higher {_ask_min_level_price} //snap:traverse side level')
-                for p, l in sorted(self.ask_level_tree.items(),key=lambda x:x[0], reverse=False):    #从小到大遍历
-                    if p>_ask_min_level_price:
-                        _ask_min_level_price = p
-                        _ask_min_level_qty = l.qty
-                        break
+                l = self.ask_level_tree.locate_higher(_ask_min_level_price)
+                if l is not None:
+                    _ask_min_level_price = l.price
+                    _ask_min_level_qty = l.qty
             else:
                 snap_ask_levels[nb] = price_level(0,0)
 
@@ -2362,11 +2666,10 @@ self.ask_cage_ref_px = 9.80
                 # locate next lower bid level
                 _bid_max_level_qty = 0
                 self._export_level_access(f'LEVEL_ACCESS BID locate_lower {_bid_max_level_price} //snap:traverse side level')
-                for p, l in sorted(self.bid_level_tree.items(),key=lambda x:x[0], reverse=True):    #从大到小遍历
-                    if p<_bid_max_level_price:
-                        _bid_max_level_price = p
-                        _bid_max_level_qty = l.qty
-                        break
+                l = self.bid_level_tree.locate_lower(_bid_max_level_price)
+                if l is not None:
+                    _bid_max_level_price = l.price
+                    _bid_max_level_qty = l.qty
             else:
                 snap_bid_levels[nb] = price_level(0,0)
 
@@ -2398,19 +2701,23 @@ self.ask_cage_ref_px = 9.80
             return False
 
     def are_you_ok(self):
+        self.flush()
         im_ok = True
         if len(self.market_snaps):
             self.ERR(f'unmatched market snap size={len(self.market_snaps)}:')
             n = 0
-            for s,ls in self.market_snaps.items():
+            for s,bucket in self.market_snaps.items():
                 self.ERR(f'\tNumTrades={s}')
-                for ss in ls:
+                for ss in sorted((ss for ls in bucket.values() for ss in ls), key=lambda x:x._seq):
                     self.ERR(f'\t\t#{ss._seq}\t@{ss.TransactTime}')
                 n += 1
                 if n>=3:
                     self.ERR("\t......")
                     break
             im_ok = False
+        if self.market_snaps.evict_nb:
+            self.ERR(f'evicted unmatched market snap nb={self.market_snaps.evict_nb}')
+            im_ok = False
         return im_ok
 
     @property
@@ -2456,23 +2763,23 @@ self.ask_cage_ref_px = 9.80
         return s
 
     def _print_levels(self):
-        for p, l in sorted(self.ask_level_tree.items(),key=lambda x:x[0], reverse=True):    #从大到小遍历
+        for p, l in self.ask_level_tree.inorder_list_dec():    #从大到小遍历
             s = f'ask\t{l}{self._describe_px(l.price)}'
             self.DBG(s)
-        for p, l in sorted(self.bid_level_tree.items(),key=lambda x:x[0], reverse=True):    #从大到小遍历
+        for p, l in self.bid_level_tree.inorder_list_dec():    #从大到小遍历
             s = f'bid\t{l}{self._describe_px(l.price)}'
             self.DBG(s)
 
     def _export_level_access(self, msg):
         if EXPORT_LEVEL_ACCESS:
-            self.DBG(msg)
+            if self.DBG_ON: self.DBG(msg)
 
     def __str__(self) -> str:
         s = f'axob-behave {self.SecurityID:06d} {self.YYMMDD}-{self.current_inc_tick} msg_nb={self.msg_nb}\n'
         s+= f'  order_map={len(self.order_map)} bid_level_tree={len(self.bid_level_tree)} ask_level_tree={len(self.ask_level_tree)}\n'
         s+= f'  bid_max_level_price={self.bid_max_level_price} bid_max_level_qty={self.bid_max_level_qty}\n'
         s+= f'  ask_min_level_price={self.ask_min_level_price} ask_min_level_qty={self.ask_min_level_qty}\n'
-        s+= f'  rebuilt_snaps={len(self.rebuilt_snaps)} market_snaps={len(self.market_snaps)}\n'
+        s+= f'  rebuilt_snaps={self.rebuilt_snaps.nb}(evicted {self.rebuilt_snaps.evict_nb}) market_snaps={self.market_snaps.nb}(evicted {self.market_snaps.evict_nb})\n'
         s+= '\n'
         s+= f'  pf_order_map_maxSize={self.pf_order_map_maxSize}({bitSizeOf(self.pf_order_map_maxSize)}b)\n'
         s+= f'  pf_level_tree_maxSize={self.pf_level_tree_maxSize}({bitSizeOf(self.pf_level_tree_maxSize)}b)\n'
@@ -2484,27 +2791,33 @@ self.ask_cage_ref_px = 9.80
 
         return s
 
+    def saveCheckpoint(self, fileName, compress=False):
+        '''save()的结果写为二进制检查点，见behave.axob_checkpoint；加载：AXOB(-1, -1, INSTRUMENT_TYPE.UNKNOWN, load_data=checkpoint_load(fileName))'''
+        checkpoint_save(fileName, self.save(), compress)
+
     def save(self):
-        '''save/load 用于保存/加载测试时刻'''
+        '''save/load 用于保存/加载测试时刻；订单、价格档、快照保存为结构数组；跟踪、快照淘汰文件不保存，先写盘'''
+        self._flushFiles()  # 待生成的快照随snap_pending保存，不在此生成
         data = {}
         for attr in self.__slots__:
-            if attr in ['logger', 'DBG', 'INFO', 'WARN', 'ERR']:
+            if attr in ['logger', 'DBG', 'DBG_ON', 'INFO', 'WARN', 'ERR', 'trace', 'snap_spill']:
                 continue
 
             value = getattr(self, attr)
-            if attr in ['order_map', 'bid_level_tree', 'ask_level_tree']:
-                data[attr] = {}
-                for i in value:
-                    data[attr][i] = value[i].save()
+            if attr in ['bid_top_levels', 'ask_top_levels', 'bid_top_key', 'ask_top_key']: #缓存，加载时重建
+                continue
+            elif attr in ['order_map', 'illegal_order_map']:
+                data[attr], data[attr+'_members'] = value.to_records()
+            elif attr in ['bid_level_tree', 'ask_level_tree']:
+                data[attr] = levels_to_records(value)
             elif attr == 'rebuilt_snaps' or attr == 'market_snaps':
-                data[attr] = {}
-                for i in value:
-                    data[attr][i] = [x.save() for x in value[i]]
+                data[attr] = snaps_to_records(value.snaps())
+                data[attr+'_evict_nb'] = value.evict_nb
             elif attr == 'last_snap':
                 if value is None:
                     data[attr] = None
                 else:
-                    data[attr] = value.save()
+                    data[attr] = snaps_to_records([value])
             else:
                 data[attr] = value
         return data
@@ -2512,43 +2825,32 @@ self.ask_cage_ref_px = 9.80
     def load(self, data):
         setattr(self, 'instrument_type', data['instrument_type'])
         for attr in self.__slots__:
-            if attr in ['logger', 'DBG', 'INFO', 'WARN', 'ERR']:
+            if attr in ['logger', 'DBG', 'DBG_ON', 'INFO', 'WARN', 'ERR', 'trace', 'snap_spill']:
                 continue
 
-            if attr == 'order_map':
-                v = {}
-                for i in data[attr]:
-                    v[i] = ob_order(axsbe_order(), INSTRUMENT_TYPE.UNKNOWN)
-                    v[i].load(data[attr][i])
+            if attr in ['bid_top_levels', 'ask_top_levels']:
+                setattr(self, attr, [])
+            elif attr in ['bid_top_key', 'ask_top_key']:
+                setattr(self, attr, None)
+            elif attr in ['order_map', 'illegal_order_map']:
+                v = new_order_store(ORDER_STORE_TYPE)
+                v.from_records(data[attr], data[attr+'_members'])
                 setattr(self, attr, v)
             elif attr in ['bid_level_tree', 'ask_level_tree']:
-                v = {}
-                for i in data[attr]:
-                    v[i] = level_node(-1, -1, -1)
-                    v[i].load(data[attr][i])
+                v = new_level_tree(LEVEL_TREE_TYPE)
+                levels_from_records(data[attr], v, level_node)
                 setattr(self, attr, v)
             elif attr == 'rebuilt_snaps' or attr == 'market_snaps':
-                v = {}
-                for i in data[attr]:
-                    vv = []
-                    for d in data[attr][i]:
-                        if self.instrument_type==INSTRUMENT_TYPE.STOCK:
-                            s = axsbe_snap_stock()
-                        else:
-                            raise f'unable to load instrument_type={self.instrument_type}'
-                        s.load(d)
-                        vv.append(s)
-                    v[i] = vv
+                v = snap_cache()
+                for s in snaps_from_records(data[attr]):
+                    v.add(s)
+                v.evict_nb = data.get(attr+'_evict_nb', 0)
                 setattr(self, attr, v)
             elif attr == 'last_snap':
                 if data[attr] is None:
                     v = None
                 else:
-                    if self.instrument_type==INSTRUMENT_TYPE.STOCK:
-                        v = axsbe_snap_stock()
-                    else:
-                        raise f'unable to load instrument_type={self.instrument_type}'
-                    v.load(data[attr])
+                    v = snaps_from_records(data[attr])[0]
                 setattr(self, attr, v)
             else:
                 setattr(self, attr, data[attr])
@@ -2568,6 +2870,20 @@ self.ask_cage_ref_px = 9.80
             axob_logger.addHandler(h) #这里补上模块日志的handler，有点ugly TODO: better way [low prioryty]
 
         self.DBG = self.logger.debug
+        self.DBG_ON = self.logger.isEnabledFor(logging.DEBUG)
         self.INFO = self.logger.info
         self.WARN = self.logger.warning
         self.ERR = self.logger.error
+        self.trace = None
+        self.snap_spill = None
+
+        if self.SecurityIDSource==SecurityIDSource_SZSE and self.constantValue_ready:
+            self.resetLevelTree()
+
+
+# 消息种类 : 处理入口，AXOB.onMsg按msg.KIND查表分派
+_AXOB_ON_MSG = {
+    MSG_KIND_ORDER : AXOB.onOrder,
+    MSG_KIND_EXE   : AXOB.onExec,
+    MSG_KIND_SNAP  : AXOB.onSnap,
+}
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+'''
+AXOB/MU的二进制检查点，用于从日中某一时刻继续回放：
+  * 订单容器、价格档按列导出为定长结构数组(ORDER_REC_DTYPE、LEVEL_REC_DTYPE)，快照导出为紧凑记录(SNAP_REC_DTYPE)
+  * 文件为npz：AXOB.save()/MU.save()结果中的每个结构数组是一个成员，其余标量字段连同成员路径pickle后为'state'成员，
+    'meta'成员记录检查点版本，不一致时拒绝加载；可选zlib压缩
+  * 加载时soa/dense订单容器直接由数组恢复，快照恢复为axsbe_snap_compact，不逐个构造订单、价格档对象(price_level)
+'''
+
+import pickle
+import numpy as np
+from array import array
+from tool.axsbe_snap_stock import axsbe_snap_compact
+
+AXOB_CHECKPOINT_VERSION = 1
+
+LEVEL_REC_DTYPE = np.dtype([
+    ('price', '<i8'),
+    ('qty', '<i8'),
+])
+
+SNAP_REC_FIELDS = [
+    ('SecurityIDSource', '<u2'),
+    ('MsgType', '<u2'),
+    ('SecurityID', '<i8'),
+    ('ChannelNo', '<i8'),
+    ('ApplSeqNum', '<u8'),
+    ('TransactTime', '<u8'),
+    ('TradingPhaseCode', 'u1'),
+    ('TradingPhaseCodePack', 'u1'),
+    ('NumTrades', '<i8'),
+    ('TotalVolumeTrade', '<i8'),
+    ('TotalValueTrade', '<i8'),
+    ('PrevClosePx', '<i8'),
+    ('LastPx', '<i8'),
+    ('OpenPx', '<i8'),
+    ('HighPx', '<i8'),
+    ('LowPx', '<i8'),
+    ('BidWeightPx', '<i8'),
+    ('BidWeightSize', '<i8'),
+    ('AskWeightPx', '<i8'),
+    ('AskWeightSize', '<i8'),
+    ('UpLimitPx', '<i8'),
+    ('DnLimitPx', '<i8'),
+    ('AskWeightPx_uncertain', '?'),
+    ('_seq', '<i8'),
+]
+SNAP_REC_ATTRS = [f for f, _ in SNAP_REC_FIELDS]
+SNAP_REC_DTYPE = np.dtype(SNAP_REC_FIELDS + [
+    ('_source', 'U16'),
+    ('levels', '<i8', (40,)),   # 10档，各档依次为 BidPrice BidQty AskPrice AskQty(同axsbe_snap_compact.levels)
+])
+
+
+def levels_to_records(tree):
+    '''价格档容器导出为LEVEL_REC_DTYPE结构数组'''
+    return np.array([(l.price, l.qty) for l in tree.values()], dtype=LEVEL_REC_DTYPE)
+
+def levels_from_records(rec, tree, node_cls):
+    '''rec中的价格档加入tree，价格档为node_cls(price, qty, ts)'''
+    for price, qty in rec.tolist():
+        tree[price] = node_cls(price, qty, 0)
+
+
+def snaps_to_records(snaps):
+    '''快照导出为SNAP_REC_DTYPE结构数组'''
+    recs = []
+    for s in snaps:
+        if isinstance(s, axsbe_snap_compact):
+            levels = s.levels
+        else:
+            levels = []
+            for i in range(10):
+                levels += [s.bid[i].Price, s.bid[i].Qty, s.ask[i].Price, s.ask[i].Qty]
+        recs.append(tuple(getattr(s, a) for a in SNAP_REC_ATTRS) + (s._source, levels))
+    return np.array(recs, dtype=SNAP_REC_DTYPE)
+
+def snaps_from_records(rec):
+    '''SNAP_REC_DTYPE结构数组恢复为axsbe_snap_compact列表'''
+    snaps = []
+    n = len(SNAP_REC_ATTRS)
+    for r in rec.tolist():
+        s = axsbe_snap_compact(SecurityIDSource=r[0], source=r[n], MsgType=r[1])
+        for a, x in zip(SNAP_REC_ATTRS, r):
+            setattr(s, a, x)
+        s.levels = array('q', r[n+1])
+        snaps.append(s)
+    return snaps
+
+
+def _split(data:dict, path:tuple, arrays:dict, paths:list):
+    '''取出data中的结构数组放入arrays，路径依次记入paths；返回其余字段'''
+    out = {}
+    for k, v in data.items():
+        if isinstance(v, dict):
+            out[k] = _split(v, path+(k,), arrays, paths)
+        elif isinstance(v, np.ndarray):
+            arrays[f'a{len(paths)}'] = v
+            paths.append(path+(k,))
+        else:
+            out[k] = v
+    return out
+
+
+def checkpoint_save(fileName, data:dict, compress=False):
+    '''data为AXOB.save()或MU.save()的结果，compress时zlib压缩'''
+    arrays = {}
+    paths = []
+    state = _split(data, (), arrays, paths)
+    arrays['meta'] = np.array([AXOB_CHECKPOINT_VERSION], dtype='i8')
+    arrays['state'] = np.frombuffer(pickle.dumps({'paths':paths, 'data':state}, protocol=pickle.HIGHEST_PROTOCOL), dtype='u1')
+    with open(fileName, 'wb') as f:    # 用文件对象，np.savez不再追加.npz后缀
+        if compress:
+            np.savez_compressed(f, **arrays)
+        else:
+            np.savez(f, **arrays)
+
+
+def checkpoint_load(fileName):
+    '''返回checkpoint_save时的data，用于AXOB/MU的load_data'''
+    with np.load(fileName, allow_pickle=False) as z:
+        version = int(z['meta'][0])
+        if version!=AXOB_CHECKPOINT_VERSION:
+            raise Exception(f'{fileName} checkpoint version={version} != {AXOB_CHECKPOINT_VERSION}')
+        state = pickle.loads(z['state'].tobytes())
+        data = state['data']
+        for i, path in enumerate(state['paths']):
+            d = data
+            for k in path[:-1]:
+                d = d[k]
+            d[path[-1]] = z[f'a{i}']
+    return data
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+'''
+AXOB的二进制跟踪：每处理一条消息写一条定长记录，代替调试日志逐条格式化文本
+  * 记录处理后的最优价/量、订单与价格档规模、交易阶段，可用numpy按结构数组直接加载比对
+  * 记录缓冲后批量写盘
+'''
+
+import os
+import struct
+import numpy as np
+
+AXOB_TRACE_FIELDS = [
+    ('msg_nb', '<u4'),
+    ('SecurityID', '<u4'),
+    ('kind', 'u1'),             # MSG_KIND_*
+    ('TradingPhaseMarket', 'u1'),
+    ('ApplSeqNum', '<u8'),      # 交易阶段信号为0
+    ('current_inc_tick', '<u8'),
+    ('bid_max_level_price', '<i8'),
+    ('bid_max_level_qty', '<i8'),
+    ('ask_min_level_price', '<i8'),
+    ('ask_min_level_qty', '<i8'),
+    ('order_map_size', '<u4'),
+    ('bid_level_tree_size', '<u4'),
+    ('ask_level_tree_size', '<u4'),
+]
+AXOB_TRACE_DTYPE = np.dtype(AXOB_TRACE_FIELDS)
+AXOB_TRACE_REC = struct.Struct('<IIBBQQqqqqIII')
+AXOB_TRACE_FLUSH_NB = 1<<12     # 缓冲的记录数
+
+assert AXOB_TRACE_REC.size==AXOB_TRACE_DTYPE.itemsize
+
+
+class axob_trace():
+    '''跟踪文件写入'''
+    __slots__ = [
+        'f',
+        'buf',
+    ]
+
+    def __init__(self, fileName):
+        self.f = open(fileName, 'wb')
+        self.buf = []
+
+    def write(self, axob, kind, msg):
+        self.buf.append(AXOB_TRACE_REC.pack(
+            axob.msg_nb, axob.SecurityID, kind, axob.TradingPhaseMarket,
+            getattr(msg, 'ApplSeqNum', 0), axob.current_inc_tick,
+            axob.bid_max_level_price, axob.bid_max_level_qty, axob.ask_min_level_price, axob.ask_min_level_qty,
+            axob.order_map_size, axob.bid_level_tree_size, axob.ask_level_tree_size,
+        ))
+        if len(self.buf)>=AXOB_TRACE_FLUSH_NB:
+            self.flush()
+
+    def flush(self):
+        self.f.write(b''.join(self.buf))
+        self.buf = []
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.flush()
+        self.f.close()
+
+
+def axob_trace_load(fileName, mmap=True):
+    '''加载跟踪文件为结构数组，字段见AXOB_TRACE_FIELDS'''
+    if mmap and os.path.getsize(fileName):
+        return np.memmap(fileName, dtype=AXOB_TRACE_DTYPE, mode='r')
+    return np.fromfile(fileName, dtype=AXOB_TRACE_DTYPE)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+'''
+价格档位容器，用于AXOB的买方/卖方价格树：
+  * 以价格为key，保存level_node（需含price、qty字段）
+  * 兼容dict的 in / [] / pop / len / items / keys 访问
+  * 提供与导出的LEVEL_ACCESS同名的有序访问接口：
+      locate_min / locate_max / locate_higher / locate_lower / inorder_list_inc / inorder_list_dec
+
+可选实现：
+  * level_tree_dict:   原始实现，哈希表，每次有序访问都全排序，O(nlogn)，仅用于对照
+  * level_tree_sorted: 哈希表+有序价格数组，插入/删除二分定位O(logn)后移动数组元素O(n)(memmove，常数小)，相邻档定位O(logn)、有序遍历每步O(1)
+  * level_tree_ladder: 以[跌停价,涨停价]预分配的稠密价格阶梯+占用位图，对应FPGA的RAM布局，
+                       插入/删除O(1)，相邻档定位为位图扫描；范围外的价格(如溢出价)存入稀疏的level_tree_sorted
+'''
+from bisect import bisect_left, bisect_right, insort
+
+
+class level_tree_dict(dict):
+    '''哈希表价格档，有序访问时全排序'''
+    __slots__ = []
+
+    def locate_min(self):
+        if not len(self):
+            return None
+        return self[min(self.keys())]
+
+    def locate_max(self):
+        if not len(self):
+            return None
+        return self[max(self.keys())]
+
+    def locate_higher(self, price):
+        '''大于price的最低价格档，不存在时返回None'''
+        for p, l in sorted(self.items(), key=lambda x:x[0], reverse=False):    #从小到大遍历
+            if p>price:
+                return l
+        return None
+
+    def locate_lower(self, price):
+        '''小于price的最高价格档，不存在时返回None'''
+        for p, l in sorted(self.items(), key=lambda x:x[0], reverse=True):    #从大到小遍历
+            if p<price:
+                return l
+        return None
+
+    def inorder_list_inc(self):
+        '''从小到大遍历，返回(price, level)'''
+        return iter(sorted(self.items(), key=lambda x:x[0], reverse=False))
+
+    def inorder_list_dec(self):
+        '''从大到小遍历，返回(price, level)'''
+        return iter(sorted(self.items(), key=lambda x:x[0], reverse=True))
+
+
+class level_tree_sorted(dict):
+    '''哈希表价格档 + 升序价格数组(二分查找)'''
+    __slots__ = [
+        '_prices',  # 升序排列的价格，与dict的key一一对应
+    ]
+
+    def __init__(self):
+        super(level_tree_sorted, self).__init__()
+        self._prices = []
+
+    def __setitem__(self, price, level):
+        if price not in self:
+            insort(self._prices, price)
+        dict.__setitem__(self, price, level)
+
+    def __delitem__(self, price):
+        dict.__delitem__(self, price)
+        del self._prices[bisect_left(self._prices, price)]
+
+    def pop(self, price, *default):
+        if price in self:
+            del self._prices[bisect_left(self._prices, price)]
+        return dict.pop(self, price, *default)
+
+    def clear(self):
+        dict.clear(self)
+        self._prices = []
+
+    def __reduce__(self):
+        return (self.__class__, (), None, None, iter(self.items()))
+
+    def locate_min(self):
+        if not self._prices:
+            return None
+        return dict.__getitem__(self, self._prices[0])
+
+    def locate_max(self):
+        if not self._prices:
+            return None
+        return dict.__getitem__(self, self._prices[-1])
+
+    def locate_higher(self, price):
+        '''大于price的最低价格档，不存在时返回None'''
+        i = bisect_right(self._prices, price)
+        if i>=len(self._prices):
+            return None
+        return dict.__getitem__(self, self._prices[i])
+
+    def locate_lower(self, price):
+        '''小于price的最高价格档，不存在时返回None'''
+        i = bisect_left(self._prices, price)
+        if i==0:
+            return None
+        return dict.__getitem__(self, self._prices[i-1])
+
+    def inorder_list_inc(self):
+        '''从小到大遍历，返回(price, level)；遍历期间不可增删价格档'''
+        return ((p, dict.__getitem__(self, p)) for p in self._prices)
+
+    def inorder_list_dec(self):
+        '''从大到小遍历，返回(price, level)；遍历期间不可增删价格档'''
+        return ((p, dict.__getitem__(self, p)) for p in reversed(self._prices))
+
+
+LADDER_MAX_TICKS = 1<<20  # 价格阶梯最大档数，超过则退化为稀疏存储
+
+
+class level_tree_ladder():
+    '''稠密价格阶梯：下标=price-lo，位图第i位表示下标i上有价格档'''
+    __slots__ = [
+        'lo',       # 阶梯最低价(含)，即跌停价
+        'hi',       # 阶梯最高价(含)，即涨停价
+        '_nodes',   # 预分配的level_node数组
+        '_bitmap',  # 占用位图
+        '_size',    # 阶梯内价格档数
+        '_ex',      # 阶梯外的价格档，level_tree_sorted
+    ]
+
+    def __init__(self, lo, hi):
+        self.lo = lo
+        self.hi = hi
+        self._nodes = [None] * (hi-lo+1)
+        self._bitmap = 0
+        self._size = 0
+        self._ex = level_tree_sorted()
+
+    def __len__(self):
+        return self._size + len(self._ex)
+
+    def __contains__(self, price):
+        if self.lo<=price<=self.hi:
+            return self._nodes[price-self.lo] is not None
+        return price in self._ex
+
+    def __getitem__(self, price):
+        if self.lo<=price<=self.hi:
+            l = self._nodes[price-self.lo]
+            if l is None:
+                raise KeyError(price)
+            return l
+        return self._ex[price]
+
+    def __setitem__(self, price, level):
+        if self.lo<=price<=self.hi:
+            i = price-self.lo
+            if self._nodes[i] is None:
+                self._bitmap |= 1<<i
+                self._size += 1
+            self._nodes[i] = level
+        else:
+            self._ex[price] = level
+
+    def __delitem__(self, price):
+        if self.lo<=price<=self.hi:
+            i = price-self.lo
+            if self._nodes[i] is None:
+                raise KeyError(price)
+            self._nodes[i] = None
+            self._bitmap ^= 1<<i
+            self._size -= 1
+        else:
+            del self._ex[price]
+
+    def pop(self, price, *default):
+        if price in self:
+            l = self[price]
+            del self[price]
+            return l
+        if default:
+            return default[0]
+        raise KeyError(price)
+
+    def clear(self):
+        self._nodes = [None] * (self.hi-self.lo+1)
+        self._bitmap = 0
+        self._size = 0
+        self._ex.clear()
+
+    def __iter__(self):
+        return (p for p, _ in self.inorder_list_inc())
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (l for _, l in self.inorder_list_inc())
+
+    def items(self):
+        return self.inorder_list_inc()
+
+    def locate_min(self):
+        l = self._ex.locate_min()
+        if l is not None and l.price<self.lo:
+            return l
+        if self._bitmap:
+            m = self._bitmap
+            return self._nodes[(m & -m).bit_length()-1]
+        return l
+
+    def locate_max(self):
+        l = self._ex.locate_max()
+        if l is not None and l.price>self.hi:
+            return l
+        if self._bitmap:
+            return self._nodes[self._bitmap.bit_length()-1]
+        return l
+
+    def locate_higher(self, price):
+        '''大于price的最低价格档，不存在时返回None'''
+        if price<self.lo:
+            l = self._ex.locate_higher(price)
+            if l is not None and l.price<self.lo:
+                return l
+            i = -1
+        elif price<=self.hi:
+            i = price-self.lo
+        else:
+            return self._ex.locate_higher(price)
+        m = self._bitmap >> (i+1)
+        if m:
+            return self._nodes[i+(m & -m).bit_length()]
+        return self._ex.locate_higher(self.hi)
+
+    def locate_lower(self, price):
+        '''小于price的最高价格档，不存在时返回None'''
+        if price>self.hi:
+            l = self._ex.locate_lower(price)
+            if l is not None and l.price>self.hi:
+                return l
+            i = self.hi-self.lo+1
+        elif price>=self.lo:
+            i = price-self.lo
+        else:
+            return self._ex.locate_lower(price)
+        m = self._bitmap & ((1<<i)-1)
+        if m:
+            return self._nodes[m.bit_length()-1]
+        return self._ex.locate_lower(self.lo)
+
+    def inorder_list_inc(self):
+        '''从小到大遍历，返回(price, level)；遍历期间不可增删价格档'''
+        ex = list(self._ex.inorder_list_inc())
+        for p, l in ex:
+            if p<self.lo:
+                yield p, l
+        m = self._bitmap
+        while m:
+            b = m & -m
+            i = b.bit_length()-1
+            yield self.lo+i, self._nodes[i]
+            m ^= b
+        for p, l in ex:
+            if p>self.hi:
+                yield p, l
+
+    def inorder_list_dec(self):
+        '''从大到小遍历，返回(price, level)；遍历期间不可增删价格档'''
+        ex = list(self._ex.inorder_list_dec())
+        for p, l in ex:
+            if p>self.hi:
+                yield p, l
+        m = self._bitmap
+        while m:
+            i = m.bit_length()-1
+            yield self.lo+i, self._nodes[i]
+            m ^= 1<<i
+        for p, l in ex:
+            if p<self.lo:
+                yield p, l
+
+
+LEVEL_TREE_TYPES = {
+    'dict'   : level_tree_dict,
+    'sorted' : level_tree_sorted,
+    'ladder' : level_tree_ladder,
+}
+
+def new_level_tree(tree_type, lo=0, hi=0):
+    '''
+    tree_type='ladder'时需给出价格范围[lo, hi]（内部精度的跌停价、涨停价），
+    范围无效（如无涨跌停限制）或过宽时退化为稀疏的'sorted'
+    '''
+    if tree_type not in LEVEL_TREE_TYPES:
+        raise Exception(f'level tree type={tree_type} not support!')
+    if tree_type=='ladder':
+        if 0<lo<=hi and hi-lo<LADDER_MAX_TICKS:
+            return level_tree_ladder(lo, hi)
+        return level_tree_sorted()
+    return LEVEL_TREE_TYPES[tree_type]()
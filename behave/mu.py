@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 
-from behave.axob import AXOB, AX_SIGNAL
+import behave.axob as axob
+from behave.axob import AXOB, AX_SIGNAL, CHECK_POLICY
+from behave.order_store import order_table_dense
+from behave.axob_checkpoint import checkpoint_save
 from tool.axsbe_base import TPM, SecurityIDSource_SSE, SecurityIDSource_SZSE
+from tool.axsbe_base import MSG_KIND_ORDER, MSG_KIND_EXE, MSG_KIND_SNAP, MSG_KIND_STATUS
 from tool.msg_util import *
 
+import os
 import logging
 
 class MU():
@@ -22,6 +27,8 @@ class MU():
 
         'msg_nb',
 
+        'order_tables', # 深交所ORDER_STORE_TYPE='dense'时，unique_ChannelNo : 通道内各AXOB共享的order_table_dense；否则为None
+
         # profile
         'pf_order_map_maxSize',
         'pf_level_tree_maxSize',
@@ -32,6 +39,15 @@ class MU():
         'pf_BidWeightSize_max',
         'pf_BidWeightValue_max',
 
+        # profile的当前汇总值，由各AXOB每次处理消息前后的差值增量维护，不保存
+        'cur_order_map_size',
+        'cur_bid_level_tree_size',
+        'cur_ask_level_tree_size',
+        'cur_AskWeightSize_max',
+        'cur_AskWeightValue_max',
+        'cur_BidWeightSize_max',
+        'cur_BidWeightValue_max',
+
         'logger',
         'DBG',
         'INFO',
@@ -52,6 +68,8 @@ class MU():
                                   #在FPGA实现时，开盘前：FPGA先报告ChannelID、新股SecID；
                                   #             host将ChannelID相同的分到一个MU，新股按最大成交量分配。
 
+            self.order_tables = {} if SecurityIDSource==SecurityIDSource_SZSE and axob.ORDER_STORE_TYPE=='dense' else None
+
             # for test
             self.msg_nb = 0
             self.pf_order_map_maxSize = 0
@@ -62,7 +80,8 @@ class MU():
             self.pf_AskWeightValue_max = 0
             self.pf_BidWeightSize_max = 0
             self.pf_BidWeightValue_max = 0
-            
+            self.profileReset()
+
             # for debug
             self.logger = logging.getLogger(f'mu-{SecurityID_list[0]:06d}...')
             g_logger = logging.getLogger('main')
@@ -76,13 +95,38 @@ class MU():
             self.ERR = self.logger.error
         self.INFO(f'SecurityID_list={SecurityID_list}')
 
+    def setCheckPolicy(self, policy:CHECK_POLICY, interval=None):
+        '''设置所有AXOB的自检策略，见AXOB.setCheckPolicy'''
+        for x in self.axobs.values():
+            x.setCheckPolicy(policy, interval)
+
+    def setTrace(self, trace_dir):
+        '''所有AXOB写二进制跟踪到trace_dir/axob_trace_XXXXXX.bin，见AXOB.setTrace；trace_dir为None时关闭'''
+        if trace_dir is not None and not os.path.exists(trace_dir):
+            os.makedirs(trace_dir)
+        for id, x in self.axobs.items():
+            x.setTrace(None if trace_dir is None else os.path.join(trace_dir, f'axob_trace_{id:06d}.bin'))
+
+    def setSnapSpill(self, spill_dir):
+        '''所有AXOB被淘汰的交易所快照写到spill_dir/axob_snap_spill_XXXXXX.bin，见AXOB.setSnapSpill；spill_dir为None时关闭'''
+        if spill_dir is not None and not os.path.exists(spill_dir):
+            os.makedirs(spill_dir)
+        for id, x in self.axobs.items():
+            x.setSnapSpill(None if spill_dir is None else os.path.join(spill_dir, f'axob_snap_spill_{id:06d}.bin'))
+
+    def close(self):
+        '''所有AXOB写盘并关闭跟踪、快照淘汰文件，见AXOB.close'''
+        for x in self.axobs.values():
+            x.close()
+
     def unique_ChannelNo(self, msg):
         # 将逐笔和快照的ChannelNo统一，用于管理分组
         if self.SecurityIDSource==SecurityIDSource_SZSE:
             # 深交所 逐笔和快照的ChannelNo相差1000
-            if isinstance(msg, (axsbe_order, axsbe_exe)):
+            kind = msg.KIND
+            if kind==MSG_KIND_ORDER or kind==MSG_KIND_EXE:
                 return msg.ChannelNo - 2000
-            elif isinstance(msg, axsbe_snap_stock):
+            elif kind==MSG_KIND_SNAP:
                 return msg.ChannelNo - 1000
             else:
                 return 0
@@ -96,8 +140,23 @@ class MU():
         '''
         交易阶段管理
         '''
+        unique_ChannelNo, signal = self.updateChannel(msg)
+        if unique_ChannelNo is None:
+            return
+        if signal is not None:
+            self.broadcast(self.channel_map[unique_ChannelNo]['SecurityID_list'], signal)
 
-        
+        # 上面借用msg修正了交易状态, 这里判断是否进入业务处理如果没在订阅列表, 就跳出把
+        if msg.SecurityID not in self.axobs:
+            return
+
+        self.dispatch(msg)
+
+    def updateChannel(self, msg):
+        '''
+        用msg更新所属通道的交易阶段
+        返回 (unique_ChannelNo, AX_SIGNAL)：通道内还没有订阅的标的时unique_ChannelNo为None；没有阶段切换时AX_SIGNAL为None
+        '''
         unique_ChannelNo = self.unique_ChannelNo(msg)
         # print(type(msg), unique_ChannelNo, msg.ChannelNo, msg)
 
@@ -111,76 +170,100 @@ class MU():
         if msg.SecurityID in self.axobs and msg.SecurityID not in self.channel_map[unique_ChannelNo]['SecurityID_list']:
             # 那就 添加到 管理通道 内
             self.channel_map[unique_ChannelNo]['SecurityID_list'].append(msg.SecurityID)
+            if self.order_tables is not None:
+                self.bindOrderTable(unique_ChannelNo, self.axobs[msg.SecurityID])
         
         # 修改通道状态, 然后广播给通道内的所有 axob
         # 如果当前通道内 有 股票, 根据这个msg, 修正通道内的交易状态
         # 解决“无消息时段”的状态切换。例如，9:15:00 这一刻可能没有任何逐笔数据到达，但状态必须切换为 OpenCall。或者中午 11:30:00 休市，可能没有最后一笔成交，必须由 MU 监控时间或快照来强制触发 SIGNAL
         if len(self.channel_map[unique_ChannelNo]['SecurityID_list']):
+            kind = msg.KIND
+            is_inc = kind==MSG_KIND_ORDER or kind==MSG_KIND_EXE
             # 如果当前通道内的 是 开始状态 < 91500000
             if self.channel_map[unique_ChannelNo]['TPM']==TPM.Starting: # Starting -> OpenCall
                 #深交所：任意逐笔，或快照时戳大于等于开盘或快照状态（TODO:回归测试）
                 #上交所：逐笔要等到9:25才发送，仅用快照时戳或快照状态
-                if (isinstance(msg, (axsbe_order, axsbe_exe))) or\
-                   (isinstance(msg, axsbe_status) and msg.TradingPhaseMarket==TPM.OpenCall) or\
-                   (isinstance(msg, axsbe_snap_stock) and (msg.HHMMSSms>=91500000 or msg.TradingPhaseMarket==TPM.OpenCall)):
+                if is_inc or\
+                   (kind==MSG_KIND_STATUS and msg.TradingPhaseMarket==TPM.OpenCall) or\
+                   (kind==MSG_KIND_SNAP and (msg.HHMMSSms>=91500000 or msg.TradingPhaseMarket==TPM.OpenCall)):
                     self.WARN(f'Chnl {unique_ChannelNo} Starting -> OpenCall')
                     self.channel_map[unique_ChannelNo]['TPM'] = TPM.OpenCall
-                    for id in self.channel_map[unique_ChannelNo]['SecurityID_list']: self.axobs[id].onMsg(AX_SIGNAL.OPENCALL_BGN)
+                    return unique_ChannelNo, AX_SIGNAL.OPENCALL_BGN
             elif self.channel_map[unique_ChannelNo]['TPM']==TPM.OpenCall: # OpenCall -> PreTradingBreaking
                 # 任意逐笔离开开盘集合竞价(都开始撮合了)，或快照时戳超过盘前休市15s
                 # 上交所: 债券市场状态进入连续自动撮合
-                if (isinstance(msg, axsbe_exe) and msg.TradingPhaseMarket==TPM.PreTradingBreaking) or\
-                   (isinstance(msg, axsbe_status) and msg.TradingPhaseMarket==TPM.ContinuousAutomaticMatching) or\
-                   (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms>=92515000):
+                if (kind==MSG_KIND_EXE and msg.TradingPhaseMarket==TPM.PreTradingBreaking) or\
+                   (kind==MSG_KIND_STATUS and msg.TradingPhaseMarket==TPM.ContinuousAutomaticMatching) or\
+                   (kind==MSG_KIND_SNAP and msg.HHMMSSms>=92515000):
 
                     self.WARN(f'Chnl {unique_ChannelNo} OpenCall -> PreTradingBreaking')
                     self.channel_map[unique_ChannelNo]['TPM'] = TPM.PreTradingBreaking
-                    for id in self.channel_map[unique_ChannelNo]['SecurityID_list']: self.axobs[id].onMsg(AX_SIGNAL.OPENCALL_END)
+                    return unique_ChannelNo, AX_SIGNAL.OPENCALL_END
             elif self.channel_map[unique_ChannelNo]['TPM']==TPM.PreTradingBreaking: # PreTradingBreaking -> AMTrading
                 #任意逐笔进入上午连续竞价阶段，或快照时戳大于等于上午连续竞价
-                if (isinstance(msg, (axsbe_order, axsbe_exe)) and msg.TradingPhaseMarket==TPM.AMTrading) or\
-                   (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms>=93000000):
+                if (is_inc and msg.TradingPhaseMarket==TPM.AMTrading) or\
+                   (kind==MSG_KIND_SNAP and msg.HHMMSSms>=93000000):
                     self.WARN(f'Chnl {unique_ChannelNo} PreTradingBreaking -> AMTrading')
                     self.channel_map[unique_ChannelNo]['TPM'] = TPM.AMTrading
-                    for id in self.channel_map[unique_ChannelNo]['SecurityID_list']: self.axobs[id].onMsg(AX_SIGNAL.AMTRADING_BGN)
+                    return unique_ChannelNo, AX_SIGNAL.AMTRADING_BGN
             elif self.channel_map[unique_ChannelNo]['TPM']==TPM.AMTrading: # AMTrading -> Breaking
                 #快照时戳大于等于中午休市15s
-                if (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms>=113015000):
+                if (kind==MSG_KIND_SNAP and msg.HHMMSSms>=113015000):
                     self.WARN(f'Chnl {unique_ChannelNo} AMTrading -> Breaking')
                     self.channel_map[unique_ChannelNo]['TPM'] = TPM.Breaking
-                    for id in self.channel_map[unique_ChannelNo]['SecurityID_list']: self.axobs[id].onMsg(AX_SIGNAL.AMTRADING_END)
+                    return unique_ChannelNo, AX_SIGNAL.AMTRADING_END
             elif self.channel_map[unique_ChannelNo]['TPM']==TPM.Breaking: # Breaking -> PMTrading
                 #任意逐笔，或快照时戳大于等于下午连续竞价
-                if (isinstance(msg, (axsbe_order, axsbe_exe))) or\
-                   (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms>=130000000):
+                if is_inc or\
+                   (kind==MSG_KIND_SNAP and msg.HHMMSSms>=130000000):
                     self.WARN(f'Chnl {unique_ChannelNo} Breaking -> PMTrading')
                     self.channel_map[unique_ChannelNo]['TPM'] = TPM.PMTrading
-                    for id in self.channel_map[unique_ChannelNo]['SecurityID_list']: self.axobs[id].onMsg(AX_SIGNAL.PMTRADING_BGN)
+                    return unique_ChannelNo, AX_SIGNAL.PMTRADING_BGN
             elif self.channel_map[unique_ChannelNo]['TPM']==TPM.PMTrading: # PMTrading -> CloseCall
                 #任意逐笔进入收盘集合竞价阶段，或快照时戳大于等于收盘集合竞价15s
-                if (isinstance(msg, (axsbe_order, axsbe_exe)) and msg.TradingPhaseMarket==TPM.CloseCall) or\
-                   (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms>=145715000):
+                if (is_inc and msg.TradingPhaseMarket==TPM.CloseCall) or\
+                   (kind==MSG_KIND_SNAP and msg.HHMMSSms>=145715000):
                     self.WARN(f'Chnl {unique_ChannelNo} PMTrading -> CloseCall')
                     self.channel_map[unique_ChannelNo]['TPM'] = TPM.CloseCall
-                    for id in self.channel_map[unique_ChannelNo]['SecurityID_list']: self.axobs[id].onMsg(AX_SIGNAL.PMTRADING_END)
+                    return unique_ChannelNo, AX_SIGNAL.PMTRADING_END
             elif self.channel_map[unique_ChannelNo]['TPM']==TPM.CloseCall: # CloseCall -> Ending
                 #任意成交离开收盘集合竞价阶段，或快照时戳大于等于闭市15s
                 # 上交所: 债券市场状态进入闭市=15:00:00~15:04:59
-                if (isinstance(msg, axsbe_exe) and msg.TradingPhaseMarket==TPM.Ending) or\
-                   (isinstance(msg, axsbe_status) and msg.TradingPhaseMarket==TPM.Closing) or\
-                   (isinstance(msg, axsbe_snap_stock) and msg.HHMMSSms>=150015000):
+                if (kind==MSG_KIND_EXE and msg.TradingPhaseMarket==TPM.Ending) or\
+                   (kind==MSG_KIND_STATUS and msg.TradingPhaseMarket==TPM.Closing) or\
+                   (kind==MSG_KIND_SNAP and msg.HHMMSSms>=150015000):
                     self.WARN(f'Chnl {unique_ChannelNo} CloseCall -> Ending')
                     self.channel_map[unique_ChannelNo]['TPM'] = TPM.Ending
-                    for id in self.channel_map[unique_ChannelNo]['SecurityID_list']: self.axobs[id].onMsg(AX_SIGNAL.ALL_END)
+                    return unique_ChannelNo, AX_SIGNAL.ALL_END
+            return unique_ChannelNo, None
         else:
-            return
-
-        # 上面借用msg修正了交易状态, 这里判断是否进入业务处理如果没在订阅列表, 就跳出把
-        if msg.SecurityID not in self.axobs:
-            return
-
+            return None, None
+
+    def bindOrderTable(self, unique_ChannelNo, x:AXOB):
+        '''AXOB的订单容器换成通道共享的order_table_dense上的视图，须在AXOB收到订单前'''
+        if len(x.order_map) or len(x.illegal_order_map):
+            raise Exception(f'{x.SecurityID:06d} order_map not empty, unable to bind order table!')
+        if unique_ChannelNo not in self.order_tables:
+            self.order_tables[unique_ChannelNo] = order_table_dense()
+        t = self.order_tables[unique_ChannelNo]
+        x.order_map = t.view()
+        x.illegal_order_map = t.view()
+
+    def broadcast(self, SecurityID_list, signal:AX_SIGNAL):
+        '''向通道内的AXOB广播交易阶段切换'''
+        for id in SecurityID_list:
+            x = self.axobs[id]
+            o, b, a = x.order_map_size, x.bid_level_tree_size, x.ask_level_tree_size
+            x.onMsg(signal)
+            self.profileUpdate(x, o, b, a)
+
+    def dispatch(self, msg):
+        '''订阅标的的消息交给对应的AXOB'''
         # TODO: 重构消息给axob？
-        self.axobs[msg.SecurityID].onMsg(msg)
+        x = self.axobs[msg.SecurityID]
+        o, b, a = x.order_map_size, x.bid_level_tree_size, x.ask_level_tree_size
+        x.onMsg(msg)
+        self.profileUpdate(x, o, b, a)
 
         self.msg_nb += 1
         self.profile()
@@ -189,6 +272,7 @@ class MU():
         ok_nb = 0
         ng_list = []
         for id, x in self.axobs.items():
+            x.flush()
             if isTPMfreeze(x):
                 ok = x.are_you_ok()
                 if not ok:
@@ -210,35 +294,48 @@ class MU():
                 ret = max(ret, t) #取最晚的TPM
         return ret
 
+    def profileReset(self):
+        '''由所有AXOB重新计算当前汇总值'''
+        self.cur_order_map_size = sum(x.order_map_size for x in self.axobs.values())
+        self.cur_bid_level_tree_size = sum(x.bid_level_tree_size for x in self.axobs.values())
+        self.cur_ask_level_tree_size = sum(x.ask_level_tree_size for x in self.axobs.values())
+        self.cur_AskWeightSize_max = max([x.pf_AskWeightSize_max for x in self.axobs.values()], default=0)
+        self.cur_AskWeightValue_max = max([x.pf_AskWeightValue_max for x in self.axobs.values()], default=0)
+        self.cur_BidWeightSize_max = max([x.pf_BidWeightSize_max for x in self.axobs.values()], default=0)
+        self.cur_BidWeightValue_max = max([x.pf_BidWeightValue_max for x in self.axobs.values()], default=0)
+
+    def profileUpdate(self, x, order_map_size, bid_level_tree_size, ask_level_tree_size):
+        '''x处理一条消息后，以其处理前的规模累加差值；AXOB的pf_*_max单调不减，只需与x比较'''
+        self.cur_order_map_size += x.order_map_size - order_map_size
+        self.cur_bid_level_tree_size += x.bid_level_tree_size - bid_level_tree_size
+        self.cur_ask_level_tree_size += x.ask_level_tree_size - ask_level_tree_size
+        if x.pf_AskWeightSize_max>self.cur_AskWeightSize_max:self.cur_AskWeightSize_max=x.pf_AskWeightSize_max
+        if x.pf_AskWeightValue_max>self.cur_AskWeightValue_max:self.cur_AskWeightValue_max=x.pf_AskWeightValue_max
+        if x.pf_BidWeightSize_max>self.cur_BidWeightSize_max:self.cur_BidWeightSize_max=x.pf_BidWeightSize_max
+        if x.pf_BidWeightValue_max>self.cur_BidWeightValue_max:self.cur_BidWeightValue_max=x.pf_BidWeightValue_max
+
     def profile(self):
-        k = [x.order_map_size for _, x in self.axobs.items()]
-        k = sum(k)
+        '''O(1)：只比较增量维护的当前汇总值，不遍历AXOB'''
+        k = self.cur_order_map_size
         if k>self.pf_order_map_maxSize:self.pf_order_map_maxSize=k
 
-        k = [x.level_tree_size for _, x in self.axobs.items()]
-        k = sum(k)
+        k = self.cur_bid_level_tree_size + self.cur_ask_level_tree_size
         if k>self.pf_level_tree_maxSize:self.pf_level_tree_maxSize=k
 
-        k = [x.bid_level_tree_size for _, x in self.axobs.items()]
-        k = sum(k)
+        k = self.cur_bid_level_tree_size
         if k>self.pf_bid_level_tree_maxSize:self.pf_bid_level_tree_maxSize=k
 
-        k = [x.ask_level_tree_size for _, x in self.axobs.items()]
-        k = sum(k)
+        k = self.cur_ask_level_tree_size
         if k>self.pf_ask_level_tree_maxSize:self.pf_ask_level_tree_maxSize=k
 
-        k = [x.pf_AskWeightSize_max for _, x in self.axobs.items()]
-        k = max(k)
+        k = self.cur_AskWeightSize_max
         if k>self.pf_AskWeightSize_max:self.pf_AskWeightSize_max=k
-        k = [x.pf_AskWeightValue_max for _, x in self.axobs.items()]
-        k = max(k)
+        k = self.cur_AskWeightValue_max
         if k>self.pf_AskWeightValue_max:self.pf_AskWeightValue_max=k
-        
-        k = [x.pf_BidWeightSize_max for _, x in self.axobs.items()]
-        k = max(k)
+
+        k = self.cur_BidWeightSize_max
         if k>self.pf_BidWeightSize_max:self.pf_BidWeightSize_max=k
-        k = [x.pf_BidWeightValue_max for _, x in self.axobs.items()]
-        k = max(k)
+        k = self.cur_BidWeightValue_max
         if k>self.pf_BidWeightValue_max:self.pf_BidWeightValue_max=k
 
     def __str__(self) -> str:
@@ -257,11 +354,15 @@ class MU():
 
         return s
 
+    def saveCheckpoint(self, fileName, compress=False):
+        '''save()的结果写为二进制检查点，见behave.axob_checkpoint；加载：MU(None, None, None, load_data=checkpoint_load(fileName))'''
+        checkpoint_save(fileName, self.save(), compress)
+
     def save(self):
         '''save/load 用于保存/加载测试时刻'''
         data = {}
         for attr in self.__slots__:
-            if attr in ['logger', 'DBG', 'INFO', 'WARN', 'ERR']:
+            if attr in ['logger', 'DBG', 'INFO', 'WARN', 'ERR', 'order_tables'] or attr.startswith('cur_'):
                 continue
 
             value = getattr(self, attr)
@@ -275,7 +376,7 @@ class MU():
 
     def load(self, data):
         for attr in self.__slots__:
-            if attr in ['logger', 'DBG', 'INFO', 'WARN', 'ERR']:
+            if attr in ['logger', 'DBG', 'INFO', 'WARN', 'ERR', 'order_tables'] or attr.startswith('cur_'):
                 continue
 
             if attr in ['axobs']:
@@ -285,6 +386,8 @@ class MU():
                 setattr(self, attr, v)
             else:
                 setattr(self, attr, data[attr])
+        self.profileReset()
+        self.order_tables = None    # 加载的AXOB各自持有订单容器
         ## 日志
         SecurityID_list = list(data['axobs'].keys())
         self.logger = logging.getLogger(f'mu-{SecurityID_list[0]:06d}...')
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+'''
+多进程分片运行MU：
+  * 订阅标的按通道、再按负载估计分到多个分片，每个分片是一个子进程内的MU
+  * 主进程只做读取和通道交易阶段管理(MU_router)，订阅标的的消息以二进制(bytes_stream)批量发给所属分片
+  * 通道交易阶段切换(AX_SIGNAL)按批内位置随消息一起发给该通道有标的的分片，与单进程MU的顺序一致
+  * 结束时汇总各分片的 are_you_ok 和统计值；分片异常或进程退出时该分片结果为失败并记录错误，主进程不阻塞
+'''
+
+import queue
+import logging
+import traceback
+from multiprocessing import Process, Queue
+from behave.mu import MU
+from behave.axob import AX_SIGNAL, CHECK_POLICY
+from tool.axsbe_base import INSTRUMENT_TYPE
+from tool.msg_util import axsbe_bytes, bitSizeOf
+
+SHARD_BATCH_NB = 4096     # 每批消息数
+SHARD_QUEUE_DEPTH = 64    # 每个分片的队列深度(批)
+SHARD_POLL_S = 1.0        # 主进程收发队列的超时，超时后检查分片进程是否已退出
+
+
+def shard_partition(SecurityID_list, shard_nb, channel_of:dict=None, load:dict=None):
+    '''
+    把标的分成shard_nb组：同通道的标的尽量放在一起，再按负载(默认每只标的为1)贪心均衡；
+    单个通道的负载超过平均值时按标的拆开
+    channel_of: SecurityID : 通道号；load: SecurityID : 负载估计(如消息数)
+    返回 [[SecurityID]]
+    '''
+    channel_of = channel_of or {}
+    load = load or {}
+    w = lambda x:load.get(x, 1)
+    avg = sum(w(x) for x in SecurityID_list) / max(shard_nb, 1)
+
+    groups = {}
+    for x in SecurityID_list:
+        groups.setdefault(channel_of.get(x, ('id', x)), []).append(x)
+    items = []
+    for g in groups.values():
+        if sum(w(x) for x in g)>avg:
+            items += [[x] for x in g]
+        else:
+            items.append(g)
+    items.sort(key=lambda g:-sum(w(x) for x in g))
+
+    shards = [[] for _ in range(shard_nb)]
+    shard_load = [0] * shard_nb
+    for g in items:
+        i = shard_load.index(min(shard_load))
+        shards[i] += g
+        shard_load[i] += sum(w(x) for x in g)
+    return [s for s in shards if len(s)]
+
+
+class MU_router(MU):
+    '''只做通道交易阶段管理，不持有AXOB；axobs记录 SecurityID : 分片号'''
+    __slots__ = []
+
+    def __init__(self, shard_of:dict, SecurityIDSource):
+        self.axobs = shard_of
+        self.SecurityIDSource = SecurityIDSource
+        self.channel_map = {}
+        self.msg_nb = 0
+        self.order_tables = None
+
+        self.logger = logging.getLogger('mu-router')
+        g_logger = logging.getLogger('main')
+        self.logger.setLevel(g_logger.getEffectiveLevel())
+        for h in g_logger.handlers:
+            self.logger.addHandler(h)
+
+        self.DBG = self.logger.debug
+        self.INFO = self.logger.info
+        self.WARN = self.logger.warning
+        self.ERR = self.logger.error
+
+
+def _shard_main(shard, SecurityID_list, SecurityIDSource, instrument_type, check_policy, q_in, q_out):
+    '''
+    分片进程：批 = (消息字节流, [(批内消息序号, AX_SIGNAL值, [SecurityID])])，None表示结束
+    异常时结果为 {'shard', 'ok':False, 'error':traceback}，之后丢弃剩余的批直到None，使主进程不阻塞
+    '''
+    batch = ()  # 收到None后异常时不再丢弃
+    try:
+        mu = MU(SecurityID_list, SecurityIDSource, instrument_type)
+        if check_policy is not None:
+            mu.setCheckPolicy(check_policy)
+        while True:
+            batch = q_in.get()
+            if batch is None:
+                break
+            buf, signals = batch
+            s = 0
+            for i, msg in enumerate(axsbe_bytes(buf)):
+                while s<len(signals) and signals[s][0]==i:
+                    mu.broadcast(signals[s][2], AX_SIGNAL(signals[s][1]))
+                    s += 1
+                mu.dispatch(msg)
+            for _, sig, ids in signals[s:]:
+                mu.broadcast(ids, AX_SIGNAL(sig))
+
+        ok = mu.are_you_ok()
+        result = {
+            'shard' : shard,
+            'ok' : ok,
+            'msg_nb' : mu.msg_nb,
+            'axobs' : {x:{'msg_nb':ob.msg_nb, 'ok':ob.are_you_ok()} for x, ob in mu.axobs.items()},
+            'pf' : {k:getattr(mu, k) for k in MU.__slots__ if k.startswith('pf_')},
+        }
+    except Exception:
+        q_out.put({'shard':shard, 'ok':False, 'error':traceback.format_exc()})
+        if batch is not None:
+            while q_in.get() is not None:
+                pass
+        return
+    q_out.put(result)
+
+
+class MU_shard():
+    '''
+    多进程分片的MU，用法同MU：onMsg逐条送入，结束后调用are_you_ok
+    统计值中：各分片最大值之和(如pf_order_map_maxSize)是单进程MU统计值的上界，各标的最大值(如pf_AskWeightSize_max)与单进程一致
+    '''
+    __slots__ = [
+        'router',
+        'shards',       # [[SecurityID]]
+        'procs',
+        'q_in',         # 分片号 : Queue
+        'q_out',
+        'bufs',         # 分片号 : 当前批的消息字节流
+        'signals',      # 分片号 : 当前批的交易阶段切换
+        'results',      # 分片号 : 分片结果
+    ]
+
+    def __init__(self, SecurityID_list, SecurityIDSource, instrument_type:INSTRUMENT_TYPE, shard_nb,
+                 channel_of:dict=None, load:dict=None, check_policy:CHECK_POLICY=None):
+        self.shards = shard_partition(SecurityID_list, shard_nb, channel_of, load)
+        shard_of = {x:i for i, s in enumerate(self.shards) for x in s}
+        self.router = MU_router(shard_of, SecurityIDSource)
+
+        self.q_in = [Queue(SHARD_QUEUE_DEPTH) for _ in self.shards]
+        self.q_out = Queue()
+        self.procs = [Process(target=_shard_main, args=(i, s, SecurityIDSource, instrument_type, check_policy, q, self.q_out), daemon=True)
+                      for i, (s, q) in enumerate(zip(self.shards, self.q_in))]
+        for p in self.procs:
+            p.start()
+        self.bufs = [[] for _ in self.shards]
+        self.signals = [[] for _ in self.shards]
+        self.results = None
+
+    def _put(self, i, batch):
+        '''分片进程已退出时丢弃batch，不阻塞'''
+        while self.procs[i].is_alive():
+            try:
+                self.q_in[i].put(batch, timeout=SHARD_POLL_S)
+                return
+            except queue.Full:
+                pass
+
+    def _flush(self, i):
+        self._put(i, (b''.join(self.bufs[i]), self.signals[i]))
+        self.bufs[i] = []
+        self.signals[i] = []
+
+    def onMsg(self, msg):
+        router = self.router
+        unique_ChannelNo, signal = router.updateChannel(msg)
+        if unique_ChannelNo is None:
+            return
+        if signal is not None:
+            ids = {}
+            for x in router.channel_map[unique_ChannelNo]['SecurityID_list']:
+                ids.setdefault(router.axobs[x], []).append(x)
+            for i, l in ids.items():
+                self.signals[i].append((len(self.bufs[i]), signal.value, l))
+
+        i = router.axobs.get(msg.SecurityID)
+        if i is None:
+            return
+        self.bufs[i].append(msg.bytes_stream)
+        router.msg_nb += 1
+        if len(self.bufs[i])>=SHARD_BATCH_NB:
+            self._flush(i)
+
+    def close(self):
+        '''发送剩余消息，等待各分片结束并收集结果'''
+        if self.results is not None:
+            return self.results
+        for i in range(len(self.shards)):
+            if len(self.bufs[i]) or len(self.signals[i]):
+                self._flush(i)
+            self._put(i, None)
+        results = [None] * len(self.procs)
+        while None in results:
+            dead = [i for i, p in enumerate(self.procs) if results[i] is None and not p.is_alive()]
+            try:
+                r = self.q_out.get(timeout=SHARD_POLL_S)
+                results[r['shard']] = r
+                continue
+            except queue.Empty:
+                pass
+            for i in dead:  # 退出前写入的结果此时已可读到，仍没有即为未留下结果
+                if results[i] is None:
+                    results[i] = {'shard':i, 'ok':False, 'error':f'shard process exitcode={self.procs[i].exitcode} without result'}
+        for p in self.procs:
+            p.join()
+        self.results = results
+        return results
+
+    def are_you_ok(self):
+        results = self.close()
+        for r in results:
+            if 'error' in r:
+                self.router.ERR(f'shard {r["shard"]} {self.shards[r["shard"]]} failed:\n{r["error"]}')
+        return all(r['ok'] for r in results)
+
+    @property
+    def msg_nb(self):
+        return self.router.msg_nb
+
+    def __str__(self) -> str:
+        results = [r for r in self.close() if 'pf' in r]
+        s = '========================\n'
+        s+= f'  MU_shard-{len(self.shards)}: ' + ' '.join(str(len(x)) for x in self.shards) + '\n'
+        if not len(results):
+            return s
+        for k in results[0]['pf']:
+            if k.endswith('_max'):
+                v = max(r['pf'][k] for r in results)
+            else:
+                v = sum(r['pf'][k] for r in results)
+            s+= f'  MU_shard.{k}={v}({bitSizeOf(v)}b)\n'
+        return s
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+
+'''
+订单容器，用于AXOB.order_map：
+  * 以applSeqNum为key，保存ob_order（需含applSeqNum、price、qty、side、type字段）
+  * 兼容dict的 in / [] / get / pop / len / keys / values / items 访问
+
+可选实现：
+  * order_store_dict: 原始实现，哈希表，每个订单一个ob_order对象
+  * order_store_soa:  按列保存(seq, price, qty, side, type)的定长数组 + 开放寻址索引(applSeqNum->槽位) + 空闲槽位表，
+                      不保存ob_order对象，读出时临时构造；仅用于测试的traded、TransactTime字段不保存
+  * order_store_dense: order_table_dense上的视图，按ApplSeqNum直接寻址(同FPGA订单RAM的寻址)；
+                       深交所通道内ApplSeqNum稠密递增，MU把同通道各AXOB的订单容器放在同一张表上，
+                       表按块分配，块内订单全部删除后释放；字段保存同order_store_soa
+
+各容器可用to_records/from_records按列导出/导入为ORDER_REC_DTYPE结构数组，用于检查点
+'''
+from array import array
+import numpy as np
+
+
+ORDER_REC_DTYPE = np.dtype([
+    ('applSeqNum', '<u8'),
+    ('price', '<i8'),
+    ('qty', '<i8'),
+    ('side', 'i1'),     # side代码，即to_records同时返回的成员列表的下标
+    ('type', 'i1'),     # type代码，同上
+])
+
+
+def _np(a:array):
+    '''array的numpy视图，共享内存'''
+    return np.frombuffer(a, dtype=a.typecode)
+
+
+class order_store_dict(dict):
+    '''哈希表订单容器'''
+    __slots__ = []
+
+    def to_records(self):
+        '''返回 (ORDER_REC_DTYPE结构数组, side/type成员列表)'''
+        codes = {}
+        def code(x):
+            c = codes.get(x)
+            if c is None:
+                c = codes[x] = len(codes)
+            return c
+        rec = np.array([(seq, o.price, o.qty, code(o.side), code(o.type)) for seq, o in self.items()], dtype=ORDER_REC_DTYPE)
+        return rec, list(codes)
+
+    def from_records(self, rec, members:list):
+        '''加入to_records导出的订单，订单为ob_order_view'''
+        for seq, price, qty, side, type in rec.tolist():
+            order = ob_order_view()
+            order.applSeqNum = seq
+            order.price = price
+            order.qty = qty
+            order.side = members[side]
+            order.type = members[type]
+            self[seq] = order
+
+
+ORDER_STORE_INIT_SIZE = 1<<10   # 开放寻址索引的初始大小(2的幂)
+ORDER_STORE_LOAD = 0.5          # 索引中 有效+已删除 占比超过时扩容或整理
+
+_EMPTY = -1     # 索引位置：空
+_DELETED = -2   # 索引位置：已删除
+
+
+class order_store_soa():
+    '''列存订单 + 线性探测的开放寻址索引'''
+    __slots__ = [
+        '_seq',     # 各槽位的applSeqNum，array('Q')
+        '_price',   # array('q')
+        '_qty',     # array('q')
+        '_side',    # side代码，array('b')
+        '_type',    # type代码，array('b')
+        '_codes',   # side/type成员 : 代码，代码按首次出现的顺序分配
+        '_members', # 代码 : side/type成员
+        '_free',    # 空闲槽位，array('l')
+        '_idx',     # 开放寻址索引，值为槽位或_EMPTY/_DELETED，array('l')
+        '_mask',    # 索引大小-1
+        '_size',    # 有效订单数
+        '_deleted', # 索引中的_DELETED数
+    ]
+
+    def __init__(self):
+        self._seq = array('Q')
+        self._price = array('q')
+        self._qty = array('q')
+        self._side = array('b')
+        self._type = array('b')
+        self._codes = {}
+        self._members = []
+        self._free = array('l')
+        self._idx = array('l', [_EMPTY]) * ORDER_STORE_INIT_SIZE
+        self._mask = ORDER_STORE_INIT_SIZE-1
+        self._size = 0
+        self._deleted = 0
+
+    def _probe(self, seq):
+        '''返回(索引位置, 槽位)；不存在时槽位为-1，索引位置为可插入的位置'''
+        idx = self._idx
+        seqs = self._seq
+        mask = self._mask
+        i = seq & mask
+        ins = -1
+        while True:
+            s = idx[i]
+            if s==_EMPTY:
+                return (i if ins<0 else ins), -1
+            if s==_DELETED:
+                if ins<0:
+                    ins = i
+            elif seqs[s]==seq:
+                return i, s
+            i = (i+1) & mask
+
+    def _rehash(self, size):
+        '''按新的索引大小重建索引，同时清除_DELETED'''
+        idx = array('l', [_EMPTY]) * size
+        mask = size-1
+        seqs = self._seq
+        for s in self._idx:
+            if s>=0:
+                i = seqs[s] & mask
+                while idx[i]!=_EMPTY:
+                    i = (i+1) & mask
+                idx[i] = s
+        self._idx = idx
+        self._mask = mask
+        self._deleted = 0
+
+    def _code(self, x):
+        c = self._codes.get(x)
+        if c is None:
+            c = self._codes[x] = len(self._members)
+            self._members.append(x)
+        return c
+
+    def _order(self, s):
+        order = ob_order_view()
+        order.applSeqNum = self._seq[s]
+        order.price = self._price[s]
+        order.qty = self._qty[s]
+        order.side = self._members[self._side[s]]
+        order.type = self._members[self._type[s]]
+        return order
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, seq):
+        return self._probe(seq)[1]>=0
+
+    def __getitem__(self, seq):
+        s = self._probe(seq)[1]
+        if s<0:
+            raise KeyError(seq)
+        return self._order(s)
+
+    def get(self, seq, default=None):
+        s = self._probe(seq)[1]
+        if s<0:
+            return default
+        return self._order(s)
+
+    def __setitem__(self, seq, order):
+        i, s = self._probe(seq)
+        if s<0:
+            if len(self._free):
+                s = self._free.pop()
+                self._seq[s] = seq
+                self._price[s] = order.price
+                self._qty[s] = order.qty
+                self._side[s] = self._code(order.side)
+                self._type[s] = self._code(order.type)
+            else:
+                s = len(self._seq)
+                self._seq.append(seq)
+                self._price.append(order.price)
+                self._qty.append(order.qty)
+                self._side.append(self._code(order.side))
+                self._type.append(self._code(order.type))
+            if self._idx[i]==_DELETED:
+                self._deleted -= 1
+            self._idx[i] = s
+            self._size += 1
+            size = self._mask+1
+            if self._size+self._deleted>size*ORDER_STORE_LOAD:
+                self._rehash(size*2 if self._size>size*ORDER_STORE_LOAD/2 else size)
+        else:
+            self._price[s] = order.price
+            self._qty[s] = order.qty
+            self._side[s] = self._code(order.side)
+            self._type[s] = self._code(order.type)
+
+    def __delitem__(self, seq):
+        self.pop(seq)
+
+    def pop(self, seq, *default):
+        i, s = self._probe(seq)
+        if s<0:
+            if default:
+                return default[0]
+            raise KeyError(seq)
+        order = self._order(s)
+        self._idx[i] = _DELETED
+        self._deleted += 1
+        self._size -= 1
+        self._free.append(s)
+        return order
+
+    def clear(self):
+        self.__init__()
+
+    def __iter__(self):
+        seqs = self._seq
+        return (seqs[s] for s in self._idx if s>=0)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (self._order(s) for s in self._idx if s>=0)
+
+    def items(self):
+        return ((self._seq[s], self._order(s)) for s in self._idx if s>=0)
+
+    def to_records(self):
+        '''有效槽位按列导出，不构造订单对象；返回同order_store_dict.to_records'''
+        idx = _np(self._idx)
+        s = idx[idx>=0]
+        rec = np.empty(len(s), dtype=ORDER_REC_DTYPE)
+        rec['applSeqNum'] = _np(self._seq)[s]
+        rec['price'] = _np(self._price)[s]
+        rec['qty'] = _np(self._qty)[s]
+        rec['side'] = _np(self._side)[s]
+        rec['type'] = _np(self._type)[s]
+        return rec, list(self._members)
+
+    def from_records(self, rec, members:list):
+        '''导入到空容器：各列直接作为槽位数组，再重建索引'''
+        if len(self._seq):
+            raise Exception('order store not empty, unable to load records!')
+        remap = np.array([self._code(x) for x in members], dtype='b')
+        n = len(rec)
+        self._seq = array('Q', rec['applSeqNum'].tobytes())
+        self._price = array('q', rec['price'].tobytes())
+        self._qty = array('q', rec['qty'].tobytes())
+        self._side = array('b', remap[rec['side']].tobytes())
+        self._type = array('b', remap[rec['type']].tobytes())
+        size = ORDER_STORE_INIT_SIZE
+        while n>size*ORDER_STORE_LOAD:
+            size *= 2
+        self._size = n
+        self._idx = array('l', range(n))    # _rehash按索引中的槽位重建
+        self._rehash(size)
+
+
+class ob_order_view():
+    '''order_store_soa读出的订单，字段同ob_order中订单簿使用的部分'''
+    __slots__ = [
+        'applSeqNum',
+        'price',
+        'qty',
+        'side',
+        'type',
+    ]
+
+
+ORDER_TABLE_CHUNK_BITS = 16     # 每块的订单数=2^ORDER_TABLE_CHUNK_BITS
+ORDER_TABLE_CHUNK_MASK = (1<<ORDER_TABLE_CHUNK_BITS)-1
+ORDER_TABLE_OWNER_MAX = 0xffff
+
+
+class order_table_chunk():
+    '''order_table_dense的一块，owner为0表示空'''
+    __slots__ = [
+        'price',    # array('q')
+        'qty',      # array('q')
+        'side',     # side代码，array('b')
+        'type',     # type代码，array('b')
+        'owner',    # 所属视图编号，array('H')
+        'live',     # 块内订单数
+    ]
+
+    def __init__(self):
+        n = 1<<ORDER_TABLE_CHUNK_BITS
+        self.price = array('q', [0]) * n
+        self.qty = array('q', [0]) * n
+        self.side = array('b', [0]) * n
+        self.type = array('b', [0]) * n
+        self.owner = array('H', [0]) * n
+        self.live = 0
+
+
+class order_table_dense():
+    '''按ApplSeqNum直接寻址的订单表：块号=(ApplSeqNum>>ORDER_TABLE_CHUNK_BITS)-base'''
+    __slots__ = [
+        'base',     # chunks[0]的块号
+        'chunks',   # [order_table_chunk or None]
+        'owner_nb', # 已分配的视图编号数
+        'codes',    # side/type成员 : 代码
+        'members',  # 代码 : side/type成员
+    ]
+
+    def __init__(self):
+        self.base = 0
+        self.chunks = []
+        self.owner_nb = 0
+        self.codes = {}
+        self.members = []
+
+    def view(self):
+        '''新建一个共享本表的订单容器'''
+        self.owner_nb += 1
+        if self.owner_nb>ORDER_TABLE_OWNER_MAX:
+            raise Exception(f'order table owner nb={self.owner_nb} > {ORDER_TABLE_OWNER_MAX}')
+        return order_store_dense(self, self.owner_nb)
+
+    def code(self, x):
+        c = self.codes.get(x)
+        if c is None:
+            c = self.codes[x] = len(self.members)
+            self.members.append(x)
+        return c
+
+    def chunk(self, seq):
+        '''seq所在的块，不存在时返回None'''
+        c = (seq>>ORDER_TABLE_CHUNK_BITS) - self.base
+        if 0<=c<len(self.chunks):
+            return self.chunks[c]
+        return None
+
+    def chunk_alloc(self, seq):
+        '''seq所在的块，不存在时分配'''
+        n = seq>>ORDER_TABLE_CHUNK_BITS
+        if not len(self.chunks):
+            self.base = n
+        elif n<self.base:
+            self.chunks[0:0] = [None] * (self.base-n)
+            self.base = n
+        c = n - self.base
+        if c>=len(self.chunks):
+            self.chunks += [None] * (c+1-len(self.chunks))
+        k = self.chunks[c]
+        if k is None:
+            k = self.chunks[c] = order_table_chunk()
+        return k
+
+    def chunk_release(self, seq):
+        '''seq所在的块已空，释放；并去掉头部的空块'''
+        self.chunks[(seq>>ORDER_TABLE_CHUNK_BITS) - self.base] = None
+        i = 0
+        while i<len(self.chunks) and self.chunks[i] is None:
+            i += 1
+        if i:
+            del self.chunks[:i]
+            self.base += i
+
+
+class order_store_dense():
+    '''order_table_dense上属于同一owner的订单'''
+    __slots__ = [
+        'table',
+        'owner',
+        '_size',
+    ]
+
+    def __init__(self, table:order_table_dense=None, owner=None):
+        if table is None:
+            table = order_table_dense()
+            table.owner_nb = owner = 1
+        self.table = table
+        self.owner = owner
+        self._size = 0
+
+    def _order(self, k, seq, o):
+        members = self.table.members
+        order = ob_order_view()
+        order.applSeqNum = seq
+        order.price = k.price[o]
+        order.qty = k.qty[o]
+        order.side = members[k.side[o]]
+        order.type = members[k.type[o]]
+        return order
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, seq):
+        k = self.table.chunk(seq)
+        return k is not None and k.owner[seq & ORDER_TABLE_CHUNK_MASK]==self.owner
+
+    def __getitem__(self, seq):
+        k = self.table.chunk(seq)
+        o = seq & ORDER_TABLE_CHUNK_MASK
+        if k is None or k.owner[o]!=self.owner:
+            raise KeyError(seq)
+        return self._order(k, seq, o)
+
+    def get(self, seq, default=None):
+        if seq in self:
+            return self[seq]
+        return default
+
+    def __setitem__(self, seq, order):
+        table = self.table
+        k = table.chunk_alloc(seq)
+        o = seq & ORDER_TABLE_CHUNK_MASK
+        if k.owner[o]!=self.owner:
+            if k.owner[o]:
+                raise Exception(f'order table ApplSeqNum={seq} already used by owner={k.owner[o]}')
+            k.owner[o] = self.owner
+            k.live += 1
+            self._size += 1
+        k.price[o] = order.price
+        k.qty[o] = order.qty
+        k.side[o] = table.code(order.side)
+        k.type[o] = table.code(order.type)
+
+    def __delitem__(self, seq):
+        self.pop(seq)
+
+    def pop(self, seq, *default):
+        k = self.table.chunk(seq)
+        o = seq & ORDER_TABLE_CHUNK_MASK
+        if k is None or k.owner[o]!=self.owner:
+            if default:
+                return default[0]
+            raise KeyError(seq)
+        order = self._order(k, seq, o)
+        k.owner[o] = 0
+        k.live -= 1
+        self._size -= 1
+        if k.live==0:
+            self.table.chunk_release(seq)
+        return order
+
+    def clear(self):
+        for seq in list(self):
+            self.pop(seq)
+
+    def __iter__(self):
+        table = self.table
+        base = table.base
+        for c, k in enumerate(list(table.chunks)):
+            if k is None:
+                continue
+            bgn = (base+c)<<ORDER_TABLE_CHUNK_BITS
+            for o, w in enumerate(k.owner):
+                if w==self.owner:
+                    yield bgn+o
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (self[seq] for seq in list(self))
+
+    def items(self):
+        return ((seq, self[seq]) for seq in list(self))
+
+    def to_records(self):
+        '''按块导出本owner的订单，不构造订单对象；返回同order_store_dict.to_records'''
+        table = self.table
+        parts = []
+        for c, k in enumerate(table.chunks):
+            if k is None:
+                continue
+            o = np.flatnonzero(_np(k.owner)==self.owner)
+            if not len(o):
+                continue
+            r = np.empty(len(o), dtype=ORDER_REC_DTYPE)
+            r['applSeqNum'] = ((table.base+c)<<ORDER_TABLE_CHUNK_BITS) + o
+            r['price'] = _np(k.price)[o]
+            r['qty'] = _np(k.qty)[o]
+            r['side'] = _np(k.side)[o]
+            r['type'] = _np(k.type)[o]
+            parts.append(r)
+        if not len(parts):
+            return np.empty(0, dtype=ORDER_REC_DTYPE), list(table.members)
+        return np.concatenate(parts), list(table.members)
+
+    def from_records(self, rec, members:list):
+        '''按块写入订单表，不构造订单对象'''
+        table = self.table
+        remap = np.array([table.code(x) for x in members], dtype='b')
+        seqs = rec['applSeqNum'].astype('i8')
+        chunk_nbs = seqs>>ORDER_TABLE_CHUNK_BITS
+        for n in np.unique(chunk_nbs).tolist():
+            sel = chunk_nbs==n
+            o = seqs[sel] & ORDER_TABLE_CHUNK_MASK
+            k = table.chunk_alloc(n<<ORDER_TABLE_CHUNK_BITS)
+            owner = _np(k.owner)
+            if owner[o].any():
+                raise Exception(f'order table chunk={n} already used, unable to load records!')
+            owner[o] = self.owner
+            _np(k.price)[o] = rec['price'][sel]
+            _np(k.qty)[o] = rec['qty'][sel]
+            _np(k.side)[o] = remap[rec['side'][sel]]
+            _np(k.type)[o] = remap[rec['type'][sel]]
+            k.live += len(o)
+        self._size += len(rec)
+
+
+ORDER_STORE_TYPES = {
+    'dict'  : order_store_dict,
+    'soa'   : order_store_soa,
+    'dense' : order_store_dense,
+}
+
+def new_order_store(store_type):
+    '''store_type='dense'时为独占一张订单表的容器，共享通道订单表时用order_table_dense.view()'''
+    if store_type not in ORDER_STORE_TYPES:
+        raise Exception(f'order store type={store_type} not support!')
+    return ORDER_STORE_TYPES[store_type]()
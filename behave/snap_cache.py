@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+'''
+AXOB用于比对重建快照和交易所快照的快照缓存：
+  * 按 {NumTrades:{内容指纹:[快照]}} 组织，只对NumTrades和指纹都相同的快照做is_same
+  * 记录缓存的快照数；按保留策略(NumTrades窗口、时间窗口、最大快照数)从最早缓存的开始淘汰，并计数
+  * 另按加入顺序记录(NumTrades, 指纹, 快照)，用于找最早缓存的快照；remove/drop_below不改该队列，
+    已丢弃的在取最早快照时跳过，积压过多时整理
+'''
+
+from collections import deque
+
+
+class snap_cache(dict):
+    '''{NumTrades:{fingerprint:[snap]}}，按加入顺序即为时间顺序'''
+    __slots__ = [
+        'nb',       # 缓存的快照数
+        'evict_nb', # 按保留策略淘汰的快照数
+        'order',    # deque[(NumTrades, fingerprint, snap)]，加入顺序，可能含已丢弃的
+        'live',     # set[id(snap)]，仍在缓存中的快照；order持有快照引用，其中快照的id不会被复用
+    ]
+
+    def __init__(self):
+        super(snap_cache, self).__init__()
+        self.nb = 0
+        self.evict_nb = 0
+        self.order = deque()
+        self.live = set()
+
+    def add(self, snap):
+        bucket = self.get(snap.NumTrades)
+        if bucket is None:
+            self[snap.NumTrades] = {snap.fingerprint():[snap]}
+        else:
+            ls = bucket.get(snap.fingerprint())
+            if ls is None:
+                bucket[snap.fingerprint()] = [snap]
+            else:
+                ls.append(snap)
+        self.order.append((snap.NumTrades, snap.fingerprint(), snap))
+        self.live.add(id(snap))
+        self.nb += 1
+
+    def find(self, snap):
+        '''NumTrades和指纹都与snap相同的快照列表，没有时返回None'''
+        bucket = self.get(snap.NumTrades)
+        if bucket is None:
+            return None
+        return bucket.get(snap.fingerprint())
+
+    def remove(self, snaps):
+        '''丢弃snaps(须在缓存中，且与同一个快照匹配)'''
+        if not len(snaps):
+            return
+        bucket = self[snaps[0].NumTrades]
+        fp = snaps[0].fingerprint()
+        dropped = set(id(x) for x in snaps)
+        ls = [s for s in bucket[fp] if id(s) not in dropped]
+        self.live -= dropped
+        self.nb -= len(bucket[fp]) - len(ls)
+        if len(ls):
+            bucket[fp] = ls
+        else:
+            bucket.pop(fp)
+            if len(bucket)==0:
+                self.pop(snaps[0].NumTrades)
+        self._compact()
+
+    def drop_below(self, NumTrades):
+        '''丢弃NumTrades更小的全部快照'''
+        for k in [k for k in self if k<NumTrades]:
+            for ls in self.pop(k).values():
+                self.nb -= len(ls)
+                self.live.difference_update(id(s) for s in ls)
+        self._compact()
+
+    def _cached(self, item):
+        '''order中的一项是否仍在缓存中'''
+        return id(item[2]) in self.live
+
+    def _compact(self):
+        '''order中已丢弃的项过多时整理'''
+        if len(self.order) > 2*self.nb + 64:
+            self.order = deque(x for x in self.order if self._cached(x))
+
+    def snaps(self):
+        '''按加入顺序'''
+        for x in self.order:
+            if self._cached(x):
+                yield x[2]
+
+    def oldest(self):
+        '''最早缓存的快照'''
+        while len(self.order):
+            x = self.order[0]
+            if self._cached(x):
+                return x[2]
+            self.order.popleft()
+        return None
+
+    def pop_oldest(self):
+        snap = self.oldest()
+        k, fp, _ = self.order.popleft()
+        bucket = self[k]
+        ls = [s for s in bucket[fp] if s is not snap]
+        if len(ls):
+            bucket[fp] = ls
+        else:
+            bucket.pop(fp)
+            if len(bucket)==0:
+                self.pop(k)
+        self.live.discard(id(snap))
+        self.nb -= 1
+        return snap
+
+    def retain(self, newest, numtrades_window=0, ms_window=0, max_nb=0):
+        '''
+        按保留策略淘汰，返回被淘汰的快照；各窗口/上限为0时不限：
+          numtrades_window: 淘汰NumTrades < newest.NumTrades - numtrades_window 的
+          ms_window: 淘汰日内时戳早于 newest 超过ms_window毫秒的
+          max_nb: 最多保留的快照数
+        '''
+        evicted = []
+        while self.nb:
+            s = self.oldest()
+            if (max_nb and self.nb>max_nb) \
+            or (numtrades_window and s.NumTrades<newest.NumTrades-numtrades_window) \
+            or (ms_window and s.ms<newest.ms-ms_window):
+                evicted.append(self.pop_oldest())
+            else:
+                break
+        self.evict_nb += len(evicted)
+        return evicted
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+'''
+行为模型的吞吐/延迟基准：
+  * 消息先全部加载到内存，只对MU.onMsg计时，不含解析
+  * 报告 总吞吐(msg/s)、按消息类别(委托/撤单/成交/快照/其它)的单条延迟分位数、重建快照(genSnap)的次数与耗时、峰值内存
+  * 结果连同工作开关(LEVEL_TREE_TYPE等)和git版本写出json，bench_compare比较两次结果
+  * 合成负载：把记录的逐笔/快照流复制scale份，交错送入同一个MU；每份换成与原标的同板块(market_subtype，决定价格笼子等规则)的未使用SecurityID，
+    通道号整体平移到所有真实通道之外，各份的交易阶段和ApplSeqNum互不干扰
+'''
+
+import os
+import copy
+import json
+import platform
+import resource
+import subprocess
+import numpy as np
+from array import array
+from itertools import chain
+from time import time, perf_counter_ns
+from datetime import datetime
+from tool.axsbe_base import SecurityIDSource_SZSE, SecurityIDSource_SSE, INSTRUMENT_TYPE
+from tool.axsbe_base import MSG_KIND_ORDER, MSG_KIND_EXE, MSG_KIND_SNAP
+from tool.msg_util import market_subtype
+from tool.axsbe_cache import axsbe_file_cached
+from tool.test_util import getMemUsageGB
+import behave.axob as axob
+from behave.axob import AXOB, CHECK_POLICY
+from behave.mu import MU
+
+BENCH_LOG_DIR = 'log/behave_bench'
+BENCH_CHANNEL_GAP = 1000    # 深交所逐笔与快照的通道号相差1000/2000，平移量再留出此间隔，使合成通道不与真实通道重合
+BENCH_PERCENTILES = [50, 90, 99, 99.9]
+BENCH_KINDS = ['order', 'cancel', 'trade', 'snap', 'other']
+
+
+def bench_kind(msg):
+    '''消息类别，见BENCH_KINDS'''
+    kind = msg.KIND
+    if kind==MSG_KIND_ORDER:
+        if msg.SecurityIDSource==SecurityIDSource_SSE and msg.OrdType==axob.SSE_ORDTYPE_DEL:
+            return 'cancel'
+        return 'order'
+    elif kind==MSG_KIND_EXE:
+        if msg.SecurityIDSource==SecurityIDSource_SZSE and msg.ExecType!=axob.SZSE_EXECTYPE_TRADE:
+            return 'cancel'
+        return 'trade'
+    elif kind==MSG_KIND_SNAP:
+        return 'snap'
+    return 'other'
+
+
+def bench_syn_id(SecurityIDSource, SecurityID, used:set):
+    '''与SecurityID同板块的未使用SecurityID，先向上、再向下查找；结果加入used'''
+    mst = market_subtype(SecurityIDSource, SecurityID)
+    for x in chain(range(SecurityID+1, 1000000), range(SecurityID-1, -1, -1)):
+        if x not in used and market_subtype(SecurityIDSource, x)==mst:
+            used.add(x)
+            return x
+    raise Exception(f'no unused SecurityID like {SecurityID:06d}')
+
+
+def bench_load(md_file, instrument_list:list, n_max=0, scale=1, SecurityIDSource=SecurityIDSource_SZSE):
+    '''
+    加载md_file中instrument_list的消息到内存；scale>1时复制为合成负载
+    返回 (消息列表, 订阅标的列表)
+    '''
+    ids = set(instrument_list)
+    msgs = []
+    for msg in axsbe_file_cached(md_file):
+        if msg.SecurityID not in ids:
+            continue
+        msgs.append(msg)
+        if n_max>0 and len(msgs)>=n_max:
+            break
+    if scale<=1:
+        return msgs, list(instrument_list)
+
+    id_map = {}   # (份, 原SecurityID) : 合成SecurityID
+    used = set(instrument_list)
+    for k in range(1, scale):
+        for x in instrument_list:
+            id_map[(k, x)] = bench_syn_id(SecurityIDSource, x, used)
+    # 第k份的通道号平移k*channel_step，均大于所有真实通道号，换算后的通道(MU.unique_ChannelNo)也不重合
+    channel_step = max((m.ChannelNo for m in msgs), default=0) + 1 + BENCH_CHANNEL_GAP
+    out = []
+    for msg in msgs:
+        out.append(msg)
+        for k in range(1, scale):
+            m = copy.copy(msg)
+            m.SecurityID = id_map[(k, msg.SecurityID)]
+            m.ChannelNo = msg.ChannelNo + k*channel_step     # 各份在不同通道，通道内ApplSeqNum不重复
+            out.append(m)
+    return out, list(instrument_list) + list(id_map.values())
+
+
+def _percentiles(ns:array):
+    if not len(ns):
+        return {'nb':0}
+    us = np.frombuffer(ns, dtype=np.int64) / 1000
+    r = {'nb':len(ns), 'mean_us':round(float(us.mean()), 3)}
+    for p, v in zip(BENCH_PERCENTILES, np.percentile(us, BENCH_PERCENTILES)):
+        r[f'p{p}_us'] = round(float(v), 3)
+    r['max_us'] = round(float(us.max()), 3)
+    return r
+
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return ''
+
+
+def BENCH_axob(msgs:list, instrument_list:list,
+               SecurityIDSource=SecurityIDSource_SZSE,
+               instrument_type=INSTRUMENT_TYPE.STOCK,
+               check_policy=CHECK_POLICY.OFF,
+               name='bench',
+               logPack=(print, print, print, print)
+            ):
+    '''msgs逐条送入MU，返回结果dict'''
+    DBG, INFO, WARN, ERR = logPack
+
+    mu = MU(instrument_list, SecurityIDSource, instrument_type)
+    mu.setCheckPolicy(check_policy)
+    mem_bgn = getMemUsageGB()
+
+    # 快照生成计时(合并模式下为实际生成的)：临时替换类方法，结束后恢复
+    snap_ns = array('q')
+    genSnap = AXOB._genSnap
+    def genSnap_timed(self):
+        t = perf_counter_ns()
+        r = genSnap(self)
+        snap_ns.append(perf_counter_ns()-t)
+        return r
+
+    lat = {k:array('q') for k in BENCH_KINDS}
+    kinds = [lat[bench_kind(m)] for m in msgs]
+    AXOB._genSnap = genSnap_timed
+    try:
+        t_bgn = time()
+        for msg, l in zip(msgs, kinds):
+            t = perf_counter_ns()
+            mu.onMsg(msg)
+            l.append(perf_counter_ns()-t)
+        seconds = time()-t_bgn
+    finally:
+        AXOB._genSnap = genSnap
+
+    r = {
+        'name' : name,
+        'time' : f'{datetime.today():%Y-%m-%d %H:%M:%S}',
+        'git' : _git_rev(),
+        'python' : platform.python_version(),
+        'switch' : {
+            'LEVEL_TREE_TYPE' : axob.LEVEL_TREE_TYPE,
+            'ORDER_STORE_TYPE' : axob.ORDER_STORE_TYPE,
+            'SNAP_TOP_LEVEL_NB' : axob.SNAP_TOP_LEVEL_NB,
+            'SNAP_COALESCE_TICK' : axob.SNAP_COALESCE_TICK,
+            'check_policy' : check_policy.name,
+        },
+        'instrument_nb' : len(instrument_list),
+        'msg_nb' : len(msgs),
+        'seconds' : round(seconds, 3),
+        'msg_per_sec' : round(len(msgs)/seconds, 1) if seconds>0 else 0,
+        'latency' : {k:_percentiles(v) for k, v in lat.items()},
+        'genSnap' : dict(_percentiles(snap_ns), total_s=round(sum(snap_ns)/1e9, 3)),
+        'mem_GB' : round(getMemUsageGB()-mem_bgn, 3),
+        'peak_rss_GB' : round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024**2), 3),
+        'ok' : mu.are_you_ok(),
+    }
+    INFO(f"{datetime.today()} {name}: msg={r['msg_nb']} {r['seconds']}s {r['msg_per_sec']}msg/s "
+         f"genSnap={r['genSnap']['nb']}/{r['genSnap']['total_s']}s peak_rss={r['peak_rss_GB']}GB ok={r['ok']}")
+    return r
+
+
+def BENCH_axob_file(md_file, instrument_list:list, n_max=0, scale=1,
+                    SecurityIDSource=SecurityIDSource_SZSE,
+                    instrument_type=INSTRUMENT_TYPE.STOCK,
+                    check_policy=CHECK_POLICY.OFF,
+                    name=None,
+                    log_dir=BENCH_LOG_DIR,
+                    logPack=(print, print, print, print)
+                ):
+    '''加载md_file后运行BENCH_axob，结果写到 {log_dir}/{name}.json'''
+    if not os.path.exists(md_file):
+        raise Exception(f'{md_file} not exists')
+    if name is None:
+        name = f'{os.path.basename(md_file)[:-4]}_x{scale}_{datetime.today():%Y%m%d_%H%M%S}'
+    msgs, ids = bench_load(md_file, instrument_list, n_max, scale, SecurityIDSource)
+    r = BENCH_axob(msgs, ids, SecurityIDSource, instrument_type, check_policy, name, logPack)
+    r['md_file'] = md_file
+    r['scale'] = scale
+
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    with open(os.path.join(log_dir, name+'.json'), 'w') as f:
+        json.dump(r, f, indent=1)
+    return r
+
+
+def bench_compare(base_json, new_json, logPack=(print, print, print, print)):
+    '''比较两次结果：吞吐、各类别p50/p99、genSnap总耗时、峰值内存；返回 {指标: (基准, 新, 新/基准)}'''
+    DBG, INFO, WARN, ERR = logPack
+    with open(base_json) as f:
+        a = json.load(f)
+    with open(new_json) as f:
+        b = json.load(f)
+
+    def pick(r):
+        d = {'msg_per_sec':r['msg_per_sec'], 'genSnap_s':r['genSnap']['total_s'], 'peak_rss_GB':r['peak_rss_GB']}
+        for k, v in r['latency'].items():
+            if v['nb']:
+                d[f'{k}_p50_us'] = v['p50_us']
+                d[f'{k}_p99_us'] = v['p99_us']
+        return d
+
+    pa, pb = pick(a), pick(b)
+    cmp = {}
+    INFO(f"{a['name']}({a['git']}) -> {b['name']}({b['git']})")
+    for k in pa:
+        if k in pb:
+            ratio = round(pb[k]/pa[k], 3) if pa[k] else None
+            cmp[k] = (pa[k], pb[k], ratio)
+            INFO(f'  {k}: {pa[k]} -> {pb[k]} ({ratio}x)')
+    return cmp
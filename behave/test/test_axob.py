@@ -5,7 +5,9 @@ from time import sleep
 from tool.axsbe_base import SecurityIDSource_SZSE, TPM, INSTRUMENT_TYPE
 from tool.test_util import *
 from tool.msg_util import *
+from tool.axsbe_cache import axsbe_cache
 from behave.mu import *
+from behave.axob_checkpoint import checkpoint_save, checkpoint_load
 import os
 import pickle
 
@@ -20,15 +22,34 @@ def TEST_axob_core(loader_itor, instrument_list:list, n_max=500,
                     SecurityIDSource=SecurityIDSource_SZSE, 
                     instrument_type=INSTRUMENT_TYPE.STOCK,
                     HHMMSSms_max=None,
-                    logPack=(print, print, print, print)
+                    logPack=(print, print, print, print),
+                    check_policy=CHECK_POLICY.EVERY,
+                    checkpoint_file=None,
+                    checkpoint_HHMMSSms=None,
+                    checkpoint_compress=False,
+                    checkpoint_data=None,
+                    log_nb=None
                 ):
+    '''
+    checkpoint_data: checkpoint_load的结果，从该检查点继续，loader_itor须从检查点记录的日志位置('log_nb')开始，见TEST_axob_bat
+    checkpoint_file: 处理完首条时戳>=checkpoint_HHMMSSms的消息后写检查点，见behave.axob_checkpoint
+    log_nb(n): 处理完前n条消息时已读过的日志'//'行数，写检查点时记录，继续时据此直接定位日志
+    '''
     DBG, INFO, WARN, ERR = logPack
+    if checkpoint_HHMMSSms is not None and log_nb is None:
+        raise Exception('checkpoint needs log_nb')
 
-    # instrument_list 是订阅的股票列表, 传入受到MU管理
-    mu = MU(instrument_list, SecurityIDSource, instrument_type)
+    n = 0 #只计算在 instrument_list 内的消息
+    if checkpoint_data is not None:
+        mu = MU(None, None, None, load_data=checkpoint_data['mu'])
+        n = checkpoint_data['n']
+        print_log(INFO, f'{datetime.today()} load checkpoint, n={n} log_nb={checkpoint_data["log_nb"]}')
+    else:
+        # instrument_list 是订阅的股票列表, 传入受到MU管理
+        mu = MU(instrument_list, SecurityIDSource, instrument_type)
+    mu.setCheckPolicy(check_policy) # 回归测试默认逐条自检
     print_log(INFO, f'{datetime.today()} instrumen_nb={len(instrument_list)}, current memory usage={getMemUsageGB():.3f} GB')
 
-    n = 0 #只计算在 instrument_list 内的消息
     n_bgn = 0
     boc = 0
     ecc = 0
@@ -36,80 +57,111 @@ def TEST_axob_core(loader_itor, instrument_list:list, n_max=500,
     t_pf = t_bgn
     profile_memUsage = 0
     profile_memFree = getMemFreeGB()
-    for msg in loader_itor:
-        # 集合竞价开始和收盘 打印日志用的
-        if msg.TradingPhaseMarket==TPM.OpenCall and boc==0:
-            boc = 1
-            print_log(INFO, f'{datetime.today()} openCall start')
-
-        if msg.TradingPhaseMarket==TPM.Ending and ecc==0:
-            ecc = 1
-            print_log(INFO, f'{datetime.today()} closeCall over')
-
-        mu.onMsg(msg)
-        n += 1
+    try:
+        for msg in loader_itor:
+            # 集合竞价开始和收盘 打印日志用的
+            if msg.TradingPhaseMarket==TPM.OpenCall and boc==0:
+                boc = 1
+                print_log(INFO, f'{datetime.today()} openCall start')
+
+            if msg.TradingPhaseMarket==TPM.Ending and ecc==0:
+                ecc = 1
+                print_log(INFO, f'{datetime.today()} closeCall over')
+
+            mu.onMsg(msg)
+            n += 1
+
+            if checkpoint_HHMMSSms is not None and msg.HHMMSSms>=checkpoint_HHMMSSms:
+                checkpoint_save(checkpoint_file, {'mu':mu.save(), 'n':n, 'log_nb':log_nb(n)}, checkpoint_compress)
+                print_log(INFO, f'{datetime.today()} save checkpoint {checkpoint_file}, n={n} @{msg.HHMMSSms}')
+                checkpoint_HHMMSSms = None
         
-        if n_max>0 and n>=n_max:
-            print_log(INFO, f'{datetime.today()} nb over, n={n}')
-            break
-
-        if (openCall_only and msg.HHMMSSms>92600000) or \
-           (msg.HHMMSSms>150100000):
-            print_log(INFO, f'{datetime.today()} Ending: over, n={n}')
-            break
-
-        if HHMMSSms_max is not None and HHMMSSms_max>0 and msg.HHMMSSms>HHMMSSms_max:
-            print_log(INFO, f'{datetime.today()} HHMMSSms_max: over, n={n}, msg @({msg.TransactTime})')
-            break
-
-        now = time()
-
-        if now > t_pf+30: #内存占用采样周期30s
-            memUsage = getMemUsageGB()
-            if memUsage>profile_memUsage:
-                profile_memUsage = memUsage
-            memFree = getMemFreeGB()
-            if memFree<profile_memFree:
-                profile_memFree = memFree
-            t_pf = now
-
-            if now>t_bgn+60*10:#内存情况，报告周期10min
-                print_log(INFO, f'{datetime.today()} current memory usage={memUsage:.3f} GB free={memFree:.3f} GB'
-                    f'(epoch peak={profile_memUsage:.3f} GB, minFree={profile_memFree:.3f} GB),' 
-                    f' @{msg.HHMMSSms}')
-                t_bgn = now
-                profile_memUsage = 0
-                profile_memFree = memFree
-
-    if WARN is not None:
-        WARN(mu) #保证能记录到文件中
-    assert mu.are_you_ok()
+            if n_max>0 and n>=n_max:
+                print_log(INFO, f'{datetime.today()} nb over, n={n}')
+                break
+
+            if (openCall_only and msg.HHMMSSms>92600000) or \
+               (msg.HHMMSSms>150100000):
+                print_log(INFO, f'{datetime.today()} Ending: over, n={n}')
+                break
+
+            if HHMMSSms_max is not None and HHMMSSms_max>0 and msg.HHMMSSms>HHMMSSms_max:
+                print_log(INFO, f'{datetime.today()} HHMMSSms_max: over, n={n}, msg @({msg.TransactTime})')
+                break
+
+            now = time()
+
+            if now > t_pf+30: #内存占用采样周期30s
+                memUsage = getMemUsageGB()
+                if memUsage>profile_memUsage:
+                    profile_memUsage = memUsage
+                memFree = getMemFreeGB()
+                if memFree<profile_memFree:
+                    profile_memFree = memFree
+                t_pf = now
+
+                if now>t_bgn+60*10:#内存情况，报告周期10min
+                    print_log(INFO, f'{datetime.today()} current memory usage={memUsage:.3f} GB free={memFree:.3f} GB'
+                        f'(epoch peak={profile_memUsage:.3f} GB, minFree={profile_memFree:.3f} GB),' 
+                        f' @{msg.HHMMSSms}')
+                    t_bgn = now
+                    profile_memUsage = 0
+                    profile_memFree = memFree
+
+        if WARN is not None:
+            WARN(mu) #保证能记录到文件中
+        assert mu.are_you_ok()
+    finally:
+        mu.close()  # 跟踪记录写盘，异常时也保留最后的记录
     print_log(INFO, f'== TEST_axob_bat PASS ==')
-    return
+    return n
 
 def TEST_axob_bat(source_file, instrument_list:list, n_max=500, 
                     openCall_only=False,
                     SecurityIDSource=SecurityIDSource_SZSE, 
                     instrument_type=INSTRUMENT_TYPE.STOCK,
                     HHMMSSms_max=None,
-                    logPack=(print, print, print, print)
+                    logPack=(print, print, print, print),
+                    use_cache=True,
+                    checkpoint_file=None,
+                    checkpoint_HHMMSSms=None,
+                    checkpoint_compress=False
                 ):
+    '''checkpoint_file存在时从该检查点继续，日志直接定位到检查点的位置；否则在checkpoint_HHMMSSms写检查点，见TEST_axob_core'''
     if not os.path.exists(source_file):
         raise f"{source_file} not exists"
 
-    # 解析文件出来
-    loader_itor = axsbe_file(source_file)
-
-    TEST_axob_core(loader_itor, 
+    checkpoint_data = None
+    skip_nb = 0
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        checkpoint_data = checkpoint_load(checkpoint_file)
+        skip_nb = checkpoint_data['log_nb']
+        checkpoint_HHMMSSms = None
+
+    # 解析文件出来；use_cache时读取(必要时先建立)日志旁的二进制缓存
+    if use_cache:
+        cache = axsbe_cache(source_file)
+        loader_itor = cache.messages(skip_nb)
+        log_nb = lambda n:int(cache.seq['nb'][n-1])
+    else:
+        pos = [skip_nb]
+        loader_itor = axsbe_file_fast(source_file, skip_nb, pos)
+        log_nb = lambda n:pos[0]
+
+    return TEST_axob_core(loader_itor, 
                     instrument_list, 
                     n_max=n_max,
                     openCall_only=openCall_only,
                     SecurityIDSource=SecurityIDSource,
                     instrument_type=instrument_type,
                     HHMMSSms_max=HHMMSSms_max,
-                    logPack=logPack
+                    logPack=logPack,
+                    checkpoint_file=checkpoint_file,
+                    checkpoint_HHMMSSms=checkpoint_HHMMSSms,
+                    checkpoint_compress=checkpoint_compress,
+                    checkpoint_data=checkpoint_data,
+                    log_nb=log_nb
     )
-    return
 
 
 def TEST_axob(date, instrument:int, n_max=0, 
@@ -126,7 +178,5 @@ def TEST_axob(date, instrument:int, n_max=0,
     if not os.path.exists(md_file):
         raise f"{md_file} not exists"
 
-    TEST_axob_bat(md_file, [instrument], n_max, openCall_only, SecurityIDSource, instrument_type, logPack=logPack)
-
-    return
+    return TEST_axob_bat(md_file, [instrument], n_max, openCall_only, SecurityIDSource, instrument_type, logPack=logPack)
 
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+'''
+日期×标的 批量回归：
+  * 每个(日期, 标的)是一个任务，在独立子进程中运行TEST_axob
+  * 并发数受进程数和内存预算共同限制：按日志大小估计每个任务的内存，运行中任务的估计之和不超过预算
+  * 任务按日志从大到小调度，最后汇总 通过/失败/异常、消息数、耗时、吞吐、峰值内存 到报告
+  * 子进程被杀(如OOM)时，进程池中运行的任务都会失败：重建进程池，这些任务各单独重试一次，再失败才记为异常；
+    中途退出时也写出已完成任务的报告
+'''
+
+import os
+import re
+import json
+import glob
+import logging
+import resource
+import traceback
+from time import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from tool.axsbe_base import SecurityIDSource_SZSE, SecurityIDSource_SSE, INSTRUMENT_TYPE
+from tool.test_util import getMemFreeGB
+import behave.test.test_axob as test_axob
+
+BAT_DATA_DIR = 'data'
+BAT_LOG_DIR = 'log/behave_bat'
+BAT_MEM_BASE_GB = 0.3       # 每个任务的固定内存估计
+BAT_MEM_PER_LOG_BYTE = 1.0  # 每字节日志的内存估计(含解析缓存、订单簿、快照)
+BAT_MEM_RATIO = 0.8         # 内存预算占当前空闲内存的比例
+
+_SRC_CHAR = {
+    SecurityIDSource_SZSE : 'szse',
+    SecurityIDSource_SSE  : 'sse',
+}
+
+
+def bat_dates(bgn, end, data_dir=BAT_DATA_DIR):
+    '''data_dir下名为YYYYMMDD、且在[bgn, end]内的日期'''
+    dates = []
+    for name in os.listdir(data_dir):
+        if re.fullmatch(r'\d{8}', name) and bgn<=int(name)<=end:
+            dates.append(int(name))
+    return sorted(dates)
+
+def bat_md_file(date, instrument, SecurityIDSource=SecurityIDSource_SZSE, data_dir=BAT_DATA_DIR):
+    return f'{data_dir}/{date}/AX_sbe_{_SRC_CHAR[SecurityIDSource]}_{instrument:06d}.log'
+
+def bat_instruments(date, SecurityIDSource=SecurityIDSource_SZSE, data_dir=BAT_DATA_DIR):
+    '''data_dir/{date}下所有的单标的日志'''
+    l = []
+    for f in glob.glob(f'{data_dir}/{date}/AX_sbe_{_SRC_CHAR[SecurityIDSource]}_*.log'):
+        m = re.search(r'_(\d{6})\.log$', f)
+        if m:
+            l.append(int(m.group(1)))
+    return sorted(l)
+
+def bat_mem_estimate_GB(md_file):
+    return BAT_MEM_BASE_GB + os.path.getsize(md_file) * BAT_MEM_PER_LOG_BYTE / (1024**3)
+
+
+def _bat_job(date, instrument, SecurityIDSource, instrument_type, n_max, log_dir, data_dir):
+    '''子进程：运行一个(日期, 标的)，返回结果dict'''
+    logger = logging.getLogger('main')
+    logger.setLevel(logging.WARNING)
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    fh = logging.FileHandler(f'{log_dir}/{date}_{instrument:06d}.log', mode='w')
+    fh.setFormatter(logging.Formatter('%(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(fh)
+    logPack = logger.debug, logger.info, logger.warning, logger.error
+
+    r = {
+        'date' : date,
+        'instrument' : instrument,
+        'status' : 'PASS',
+        'msg_nb' : 0,
+        'seconds' : 0,
+        'msg_per_sec' : 0,
+        'peak_mem_GB' : 0,
+        'error' : '',
+    }
+    t = time()
+    try:
+        md_file = bat_md_file(date, instrument, SecurityIDSource, data_dir)
+        r['msg_nb'] = test_axob.TEST_axob_bat(md_file, [instrument], n_max=n_max,
+                                              SecurityIDSource=SecurityIDSource, instrument_type=instrument_type,
+                                              logPack=logPack) or 0
+    except AssertionError:
+        r['status'] = 'FAIL'
+        r['error'] = traceback.format_exc().strip().split('\n')[-1]
+    except Exception:
+        r['status'] = 'ERROR'
+        r['error'] = traceback.format_exc().strip().split('\n')[-1]
+    r['seconds'] = round(time()-t, 3)
+    if r['seconds']>0:
+        r['msg_per_sec'] = round(r['msg_nb'] / r['seconds'], 1)
+    r['peak_mem_GB'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024**2), 3)
+    return r
+
+
+def _bat_error(date, instrument, e):
+    return {'date':date, 'instrument':instrument, 'status':'ERROR', 'msg_nb':0, 'seconds':0,
+            'msg_per_sec':0, 'peak_mem_GB':0, 'error':f'{type(e).__name__}: {e}'}
+
+
+def TEST_axob_batch(dates:list, instrument_list:list=None,
+                    SecurityIDSource=SecurityIDSource_SZSE,
+                    instrument_type=INSTRUMENT_TYPE.STOCK,
+                    n_max=0,
+                    nproc=None,
+                    mem_budget_GB=None,
+                    data_dir=BAT_DATA_DIR,
+                    log_dir=BAT_LOG_DIR,
+                    report_name='behave_bat_report',
+                    logPack=(print, print, print, print)
+                ):
+    '''
+    dates: 日期列表，可用bat_dates(bgn, end)生成；instrument_list为None时取每个日期目录下的所有标的
+    mem_budget_GB为None时取当前空闲内存的BAT_MEM_RATIO
+    返回结果列表，并写出 {log_dir}/{report_name}.json 和 .md
+    '''
+    DBG, INFO, WARN, ERR = logPack
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    nproc = nproc or os.cpu_count()
+    if mem_budget_GB is None:
+        mem_budget_GB = getMemFreeGB() * BAT_MEM_RATIO
+
+    jobs = []
+    results = []
+    for date in dates:
+        for instrument in (instrument_list if instrument_list is not None else bat_instruments(date, SecurityIDSource, data_dir)):
+            md_file = bat_md_file(date, instrument, SecurityIDSource, data_dir)
+            if not os.path.exists(md_file):
+                results.append({'date':date, 'instrument':instrument, 'status':'MISSING', 'msg_nb':0, 'seconds':0,
+                                'msg_per_sec':0, 'peak_mem_GB':0, 'error':f'{md_file} not exists'})
+                continue
+            jobs.append((bat_mem_estimate_GB(md_file), date, instrument, False))   # (内存估计, 日期, 标的, 是否重试)
+    jobs.sort(key=lambda x:-x[0])   # 大任务先跑
+    INFO(f'{datetime.today()} jobs={len(jobs)} nproc={nproc} mem_budget={mem_budget_GB:.3f} GB')
+
+    t_bgn = time()
+    running = {}    # future : (进程池代号, 内存估计, 日期, 标的, 是否重试)
+    new_pool = lambda:ProcessPoolExecutor(max_workers=nproc, max_tasks_per_child=1)
+    pool = new_pool()
+    pool_gen = 0
+    try:
+        while len(jobs) or len(running):
+            # 在进程数和内存预算内尽量多提交；预算不足时至少保证有一个任务在运行
+            # 重试的任务排在最前，等运行中的任务结束后单独运行，再失败时可确定是它自身的问题
+            i = 0
+            while i<len(jobs) and len(running)<nproc:
+                mem, date, instrument, retry = jobs[i]
+                if any(x[4] for x in running.values()) or (retry and len(running)):
+                    break
+                if len(running) and sum(x[1] for x in running.values())+mem>mem_budget_GB:
+                    i += 1
+                    continue
+                f = pool.submit(_bat_job, date, instrument, SecurityIDSource, instrument_type, n_max,
+                                os.path.abspath(log_dir), os.path.abspath(data_dir))
+                running[f] = (pool_gen,) + jobs.pop(i)
+                if retry:
+                    break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for f in done:
+                gen, mem, date, instrument, retry = running.pop(f)
+                try:
+                    r = f.result()
+                except BrokenProcessPool as e:
+                    broken |= gen==pool_gen
+                    if not retry:   # 可能是同一进程池中别的任务的子进程被杀，重试一次
+                        WARN(f'{datetime.today()} {date} {instrument:06d} process pool broken, retry')
+                        jobs.insert(0, (mem, date, instrument, True))
+                        continue
+                    r = _bat_error(date, instrument, e)
+                except Exception as e:
+                    r = _bat_error(date, instrument, e)
+                results.append(r)
+                INFO(f"{datetime.today()} [{len(results)}] {r['date']} {r['instrument']:06d} {r['status']} "
+                     f"msg={r['msg_nb']} {r['seconds']}s {r['msg_per_sec']}msg/s {r['peak_mem_GB']}GB {r['error']}")
+            if broken:
+                WARN(f'{datetime.today()} process pool broken, rebuild')
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = new_pool()
+                pool_gen += 1
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        results.sort(key=lambda r:(r['date'], r['instrument']))
+        bat_report(results, f'{log_dir}/{report_name}', time()-t_bgn)
+    nb = {s:sum(r['status']==s for r in results) for s in ('PASS', 'FAIL', 'ERROR', 'MISSING')}
+    INFO(f'{datetime.today()} batch over: {nb}')
+    return results
+
+
+def bat_report(results, name, seconds=0):
+    '''写出 {name}.json 和 {name}.md'''
+    with open(name+'.json', 'w') as f:
+        json.dump({'seconds':round(seconds, 3), 'results':results}, f, indent=1)
+
+    nb = {s:sum(r['status']==s for r in results) for s in ('PASS', 'FAIL', 'ERROR', 'MISSING')}
+    msg_nb = sum(r['msg_nb'] for r in results)
+    cpu_s = sum(r['seconds'] for r in results)
+    with open(name+'.md', 'w') as f:
+        f.write(f'# 批量回归 {datetime.today():%Y-%m-%d %H:%M:%S}\n\n')
+        f.write(f"任务{len(results)}个：通过{nb['PASS']}，失败{nb['FAIL']}，异常{nb['ERROR']}，缺文件{nb['MISSING']}；"
+                f"消息{msg_nb}条，墙钟{seconds:.1f}s，累计{cpu_s:.1f}s\n\n")
+        f.write('日期|标的|状态|消息数|耗时(s)|吞吐(msg/s)|峰值内存(GB)|错误\n')
+        f.write('--|--|--|--|--|--|--|--\n')
+        for r in results:
+            f.write(f"{r['date']}|{r['instrument']:06d}|{r['status']}|{r['msg_nb']}|{r['seconds']}|{r['msg_per_sec']}|{r['peak_mem_GB']}|{r['error']}\n")
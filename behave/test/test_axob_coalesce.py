@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+'''
+快照合并(SNAP_COALESCE_TICK)的回归：同一日志分别以不合并、各合并窗口回放，
+比对每个证券的比对结果(are_you_ok、未匹配/淘汰的交易所快照)和每个交易阶段的最后一个重建快照，须全部一致
+'''
+
+import os
+from datetime import datetime
+from tool.axsbe_base import SecurityIDSource_SZSE, INSTRUMENT_TYPE
+from tool.axsbe_cache import axsbe_file_cached
+from behave.mu import MU
+from behave.axob import AXOB, CHECK_POLICY
+import behave.axob as axob_mod
+from behave.test.test_axob import print_log
+
+
+def coalesce_replay(source_file, instrument_list:list, coalesce_tick,
+                    SecurityIDSource=SecurityIDSource_SZSE,
+                    instrument_type=INSTRUMENT_TYPE.STOCK,
+                    check_policy=CHECK_POLICY.EVERY
+                ):
+    '''
+    以SNAP_COALESCE_TICK=coalesce_tick回放，返回 {SecurityID:(ok, 未匹配的交易所快照_seq, 淘汰数, 各阶段最后快照)}
+    各阶段最后快照为[(TradingPhaseMarket, 指纹)]：重建快照按生成时的交易阶段分段，每段取最后一个
+    '''
+    phases = {}
+    _genSnap = AXOB._genSnap
+    def _genSnap_phase(x):
+        last_snap = x.last_snap
+        r = _genSnap(x)
+        if x.last_snap is not last_snap:
+            ls = phases.setdefault(x.SecurityID, [])
+            if len(ls) and ls[-1][0]==x.TradingPhaseMarket:
+                ls.pop()
+            ls.append((x.TradingPhaseMarket, x.last_snap.fingerprint()))
+        return r
+
+    coalesce_tick_bak = axob_mod.SNAP_COALESCE_TICK
+    axob_mod.SNAP_COALESCE_TICK = coalesce_tick
+    AXOB._genSnap = _genSnap_phase
+    mu = MU(instrument_list, SecurityIDSource, instrument_type)
+    try:
+        mu.setCheckPolicy(check_policy)
+        for msg in axsbe_file_cached(source_file):
+            mu.onMsg(msg)
+        result = {}
+        for id, x in mu.axobs.items():
+            ok = x.are_you_ok()     # 先生成最后一个窗口的快照
+            unmatched = sorted(s._seq for s in x.market_snaps.snaps())
+            result[id] = (ok, unmatched, x.market_snaps.evict_nb, phases.get(id, []))
+    finally:
+        mu.close()
+        AXOB._genSnap = _genSnap
+        axob_mod.SNAP_COALESCE_TICK = coalesce_tick_bak
+    return result
+
+
+def TEST_axob_coalesce(source_file, instrument_list:list, coalesce_ticks=(1, 100),
+                    SecurityIDSource=SecurityIDSource_SZSE,
+                    instrument_type=INSTRUMENT_TYPE.STOCK,
+                    logPack=(print, print, print, print)
+                ):
+    DBG, INFO, WARN, ERR = logPack
+    if not os.path.exists(source_file):
+        raise Exception(f'{source_file} not exists')
+
+    ref = coalesce_replay(source_file, instrument_list, 0, SecurityIDSource, instrument_type)
+    print_log(INFO, f'{datetime.today()} SNAP_COALESCE_TICK=0 ok_nb={sum(r[0] for r in ref.values())}/{len(ref)}')
+    for tick in coalesce_ticks:
+        res = coalesce_replay(source_file, instrument_list, tick, SecurityIDSource, instrument_type)
+        ng = [id for id in ref if res[id]!=ref[id]]
+        for id in ng:
+            print_log(ERR, f'{id:06d} SNAP_COALESCE_TICK={tick}: {res[id]} != {ref[id]}')
+        assert len(ng)==0, f'SNAP_COALESCE_TICK={tick} ng nb={len(ng)}'
+        print_log(INFO, f'{datetime.today()} SNAP_COALESCE_TICK={tick} same as uncoalesced')
+    print_log(INFO, f'== TEST_axob_coalesce PASS ==')
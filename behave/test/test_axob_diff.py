@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+
+'''
+AXOB差分回归：用随机的委托/撤单/成交序列回放，逐条自检(CHECK_POLICY.EVERY)，
+比较不同实现生成的全部重建快照，须完全一致：
+  * 盘口最优档缓存(SNAP_TOP_LEVEL_NB) 与 遍历价格档(原实现)
+  * 价格档容器(LEVEL_TREE_TYPE)、订单容器(ORDER_STORE_TYPE) 与 原实现('dict')
+  * 中途写检查点、从检查点继续 与 不中断
+随机序列由简单的交易所模型(rand_exchange)生成：集合竞价按最优价撮合，连续竞价按价格时间优先撮合，创业板有价格笼子
+'''
+
+import os
+import random
+import tempfile
+from datetime import datetime
+import tool.axsbe_base as axsbe_base
+from tool.axsbe_base import SecurityIDSource_SZSE, INSTRUMENT_TYPE
+from tool.axsbe_order import axsbe_order
+from tool.axsbe_exe import axsbe_exe
+from tool.axsbe_snap_stock import axsbe_snap_stock
+from behave.mu import MU
+from behave.axob import CHECK_POLICY
+from behave.axob_checkpoint import checkpoint_save, checkpoint_load
+import behave.axob as axob_mod
+from behave.test.test_axob import print_log
+
+RAND_DATE = 20220426
+RAND_CHANNEL_INC = 2011
+RAND_CHANNEL_SNAP = 1011
+
+
+def _cage_upper(x):
+    '''创业板买入笼子上限，x为整数价(分)'''
+    return x + 1 if x <= 24 else (x * 102 + 50) // 100
+
+def _cage_lower(x):
+    return x - 1 if x <= 25 else (x * 98 + 50) // 100
+
+def _ts(sec, ms=0):
+    '''日内秒数 -> 深交所时戳'''
+    return RAND_DATE * 1000000000 + ((sec//3600 * 100 + sec%3600//60) * 100 + sec%60) * 1000 + ms
+
+
+class rand_exchange():
+    '''生成一个标的全天的随机逐笔和快照，价格以分为单位，数量为100股的整数倍'''
+    def __init__(self, SecurityID, seed, gem=False, n_per_sec=2, prev_close=1000, out_of_cage_rate=0.03):
+        self.rnd = random.Random(seed)
+        self.SecurityID = SecurityID
+        self.gem = gem
+        self.prev_close = prev_close
+        limit = 0.2 if gem else 0.1
+        self.up = int(round(prev_close * (1 + limit)))
+        self.dn = int(round(prev_close * (1 - limit)))
+        self.n_per_sec = n_per_sec
+        self.out_of_cage_rate = out_of_cage_rate
+        self.seq = 0
+        self.book = {'B':{}, 'S':{}}        # side : {price : [[seq, qty]]}，队列按时间优先
+        self.orders = {}                    # seq : (side, price)
+        self.hidden = {'B':{}, 'S':{}}      # 笼外订单 side : {seq : [price, qty]}
+        self.last = 0
+        self.t = 0
+        self.msgs = []
+
+    # 消息
+    def _order(self, side, price, qty, OrdType='2'):
+        self.seq += 1
+        o = axsbe_order(SecurityIDSource_SZSE)
+        o.SecurityID = self.SecurityID
+        o.ChannelNo = RAND_CHANNEL_INC
+        o.ApplSeqNum = self.seq
+        o.TransactTime = self.t
+        o.Price = price * 100 if OrdType=='2' else 0
+        o.OrderQty = qty
+        o.Side = ord('1') if side=='B' else ord('2')
+        o.OrdType = ord(OrdType)
+        self.msgs.append(o)
+        return self.seq
+
+    def _exe(self, bid_seq, ask_seq, price, qty, ExecType='F'):
+        self.seq += 1
+        e = axsbe_exe(SecurityIDSource_SZSE)
+        e.SecurityID = self.SecurityID
+        e.ChannelNo = RAND_CHANNEL_INC
+        e.ApplSeqNum = self.seq
+        e.TransactTime = self.t
+        e.BidApplSeqNum = bid_seq
+        e.OfferApplSeqNum = ask_seq
+        e.LastPx = price * 100
+        e.LastQty = qty
+        e.ExecType = ord(ExecType)
+        self.msgs.append(e)
+
+    def _cancel(self, side, seq, qty):
+        if side=='B':
+            self._exe(seq, 0, 0, qty, '4')
+        else:
+            self._exe(0, seq, 0, qty, '4')
+
+    def _snap(self, TradingPhaseCode):
+        '''只用于推进交易阶段、提供涨跌停价，内容与订单簿无关'''
+        s = axsbe_snap_stock(SecurityIDSource_SZSE)
+        s.MsgType = axsbe_base.MsgType_snap_stock
+        s.SecurityID = self.SecurityID
+        s.ChannelNo = RAND_CHANNEL_SNAP
+        s.TransactTime = self.t
+        s.TradingPhaseCode = TradingPhaseCode
+        s.PrevClosePx = self.prev_close * 100
+        s.UpLimitPx = self.up * 100
+        s.DnLimitPx = self.dn * 100
+        s.LastPx = self.last * 100
+        self.msgs.append(s)
+
+    # 订单簿
+    def _best(self, side):
+        prices = self.book[side]
+        if not prices:
+            return None
+        return max(prices) if side=='B' else min(prices)
+
+    def _rest(self, side, seq, price, qty):
+        self.book[side].setdefault(price, []).append([seq, qty])
+        self.orders[seq] = (side, price)
+
+    def _remove(self, side, price, i=0):
+        q = self.book[side][price]
+        seq, qty = q.pop(i)
+        if not q:
+            self.book[side].pop(price)
+        self.orders.pop(seq, None)
+        return qty
+
+    def _ref(self, side):
+        '''笼子基准价：对手方最优，其次本方最优，其次最新价、昨收'''
+        opp = 'S' if side=='B' else 'B'
+        for p in (self._best(opp), self._best(side)):
+            if p is not None:
+                return p
+        return self.last or self.prev_close
+
+    def _match(self, side, seq, price, qty, market=False):
+        '''连续竞价撮合新订单，返回剩余数量和首笔成交价；市价单只成交对手方最优一档'''
+        opp = 'S' if side=='B' else 'B'
+        first_px = None
+        while qty>0:
+            p = self._best(opp)
+            if p is None:
+                break
+            if market:
+                if first_px is not None and p!=first_px:
+                    break
+            elif (side=='B' and p>price) or (side=='S' and p<price):
+                break
+            rest = self.book[opp][p][0]
+            trade_qty = min(qty, rest[1])
+            if side=='B':
+                self._exe(seq, rest[0], p, trade_qty)
+            else:
+                self._exe(rest[0], seq, p, trade_qty)
+            self.last = p
+            if first_px is None:
+                first_px = p
+            qty -= trade_qty
+            if trade_qty==rest[1]:
+                self._remove(opp, p)
+            else:
+                rest[1] -= trade_qty
+        return qty, first_px
+
+    def _release_cage(self):
+        '''创业板：基准价变化后，进入笼子的笼外订单按价格、时间顺序撮合'''
+        if not self.gem:
+            return
+        changed = True
+        while changed:
+            changed = False
+            for side in ('B', 'S'):
+                hidden = self.hidden[side]
+                if not hidden:
+                    continue
+                if side=='B':
+                    price = min(p for p, _ in hidden.values())
+                    inside = price<=_cage_upper(self._ref('B'))
+                else:
+                    price = max(p for p, _ in hidden.values())
+                    inside = price>=_cage_lower(self._ref('S'))
+                if not inside:
+                    continue
+                for seq in sorted(s for s in hidden if hidden[s][0]==price):
+                    _, qty = hidden.pop(seq)
+                    self.orders.pop(seq, None)
+                    rem, _ = self._match(side, seq, price, qty)
+                    if rem:
+                        self._rest(side, seq, price, rem)
+                changed = True
+
+    def _pick_price(self, side):
+        b, a = self._best('B'), self._best('S')
+        mid = (a + b)//2 if (a and b) else (a or b or self.last or self.prev_close)
+        d = int(abs(self.rnd.gauss(0, 6)))
+        cross = self.rnd.randint(0, 3) if self.rnd.random()<0.25 else 0
+        p = mid - d + cross if side=='B' else mid + d - cross
+        if self.gem and self.rnd.random()<self.out_of_cage_rate:
+            p = _cage_upper(self._ref('B')) + self.rnd.randint(1, 6) if side=='B' else _cage_lower(self._ref('S')) - self.rnd.randint(1, 6)
+        return max(self.dn, min(self.up, p))
+
+    def _qty(self):
+        return self.rnd.choice([1, 1, 2, 3, 5, 10, 20]) * 10000
+
+    def _cancel_random(self):
+        if not self.orders:
+            return
+        seq = self.rnd.choice(list(self.orders))
+        side, price = self.orders.pop(seq)
+        if seq in self.hidden[side]:
+            _, qty = self.hidden[side].pop(seq)
+        else:
+            q = self.book[side][price]
+            self.orders[seq] = (side, price)
+            qty = self._remove(side, price, [x[0] for x in q].index(seq))
+        self._cancel(side, seq, qty)
+        self._release_cage()
+
+    def _step_call(self):
+        if self.rnd.random()<0.8 or not self.orders:
+            side = self.rnd.choice('BS')
+            price = self._pick_price(side)
+            qty = self._qty()
+            self._rest(side, self._order(side, price, qty), price, qty)
+        else:
+            self._cancel_random()
+
+    def _step_cont(self):
+        r = self.rnd.random()
+        if r<0.62 or len(self.orders)<10:   # 限价单
+            side = self.rnd.choice('BS')
+            price = self._pick_price(side)
+            qty = self._qty()
+            seq = self._order(side, price, qty)
+            if self.gem and ((side=='B' and price>_cage_upper(self._ref('B'))) or (side=='S' and price<_cage_lower(self._ref('S')))):
+                self.hidden[side][seq] = [price, qty]
+                self.orders[seq] = (side, price)
+                return
+            rem, _ = self._match(side, seq, price, qty)
+            if rem:
+                self._rest(side, seq, price, rem)
+            self._release_cage()
+        elif r<0.70 and not self.gem:       # 市价单：剩余转限价或撤销
+            side = self.rnd.choice('BS')
+            if self._best('S' if side=='B' else 'B') is None:
+                return
+            qty = self._qty()
+            seq = self._order(side, 0, qty, '1')
+            rem, price = self._match(side, seq, 0, qty, market=True)
+            if rem:
+                if self.rnd.random()<0.5:
+                    self._rest(side, seq, price, rem)
+                else:
+                    self._cancel(side, seq, rem)
+        elif r<0.74 and not self.gem:       # 本方最优
+            side = self.rnd.choice('BS')
+            price = self._best(side)
+            if price is None:
+                return
+            qty = self._qty()
+            self._rest(side, self._order(side, price, qty, 'U'), price, qty)
+        else:
+            self._cancel_random()
+
+    def _call_match(self):
+        '''集合竞价撮合，全部成交使用同一价格'''
+        trades = []
+        while True:
+            b, a = self._best('B'), self._best('S')
+            if b is None or a is None or b<a:
+                break
+            bid, ask = self.book['B'][b][0], self.book['S'][a][0]
+            qty = min(bid[1], ask[1])
+            trades.append((bid[0], ask[0], qty, b, a))
+            for side, p, x in (('B', b, bid), ('S', a, ask)):
+                if qty==x[1]:
+                    self._remove(side, p)
+                else:
+                    x[1] -= qty
+        if trades:
+            price = (trades[-1][3] + trades[-1][4])//2
+            for bid_seq, ask_seq, qty, _, _ in trades:
+                self._exe(bid_seq, ask_seq, price, qty)
+            self.last = price
+
+    def _call(self, bgn, end, TradingPhaseCode):
+        for sec in range(bgn, end):
+            self.t = _ts(sec, self.rnd.randint(0, 99) * 10)
+            for _ in range(self.rnd.randint(0, self.n_per_sec)):
+                self._step_call()
+            if sec%30==0:
+                self.t = _ts(sec, 990)
+                self._snap(TradingPhaseCode)
+
+    def run(self):
+        self.t = _ts(9*3600)
+        self._snap(0)
+        self._call(9*3600+15*60, 9*3600+25*60, 1)
+        self.t = _ts(9*3600+25*60)
+        self._call_match()
+        for sec in (9*3600+25*60+15, 9*3600+29*60+50):
+            self.t = _ts(sec)
+            self._snap(3)
+        for bgn, end in ((9*3600+30*60, 11*3600+30*60), (13*3600, 14*3600+57*60)):
+            for sec in range(bgn, end):
+                self.t = _ts(sec, self.rnd.randint(0, 99) * 10)
+                for _ in range(self.rnd.randint(0, self.n_per_sec)):
+                    self._step_cont()
+                if sec%3==0:
+                    self.t = _ts(sec, 990)
+                    self._snap(2)
+            if bgn<12*3600:
+                for sec, code in ((11*3600+30*60, 2), (11*3600+30*60+15, 3), (12*3600+59*60, 3)):
+                    self.t = _ts(sec)
+                    self._snap(code)
+        # 收盘集合竞价：笼外订单参与
+        for side in ('B', 'S'):
+            for seq, (price, qty) in list(self.hidden[side].items()):
+                self.hidden[side].pop(seq)
+                self._rest(side, seq, price, qty)
+        self._call(14*3600+57*60, 15*3600, 4)
+        self.t = _ts(15*3600)
+        self._call_match()
+        for sec in (15*3600+15, 15*3600+30):
+            self.t = _ts(sec)
+            self._snap(5)
+        return self.msgs
+
+
+def rand_stream(seed, gem=False, n_per_sec=2):
+    '''随机的一天：主板标的000001或创业板标的300750'''
+    if gem:
+        return 300750, rand_exchange(300750, seed, gem=True, n_per_sec=n_per_sec, prev_close=2000).run()
+    return 1, rand_exchange(1, seed, n_per_sec=n_per_sec).run()
+
+
+def _snap_key(s):
+    return (s.TransactTime, s.TradingPhaseCode, s.NumTrades, s.TotalVolumeTrade, s.TotalValueTrade,
+            s.LastPx, s.OpenPx, s.HighPx, s.LowPx, s.BidWeightPx, s.BidWeightSize, s.AskWeightPx, s.AskWeightSize,
+            tuple((s.bid[i].Price, s.bid[i].Qty, s.ask[i].Price, s.ask[i].Qty) for i in range(10)))
+
+def axob_replay(msgs, SecurityID, snap_top_level_nb=None, level_tree_type=None, order_store_type=None, checkpoint_at=0):
+    '''
+    逐条自检地回放msgs，返回全部重建快照的内容；各开关为None时用axob模块的当前值
+    checkpoint_at>0时处理完前checkpoint_at条后写检查点，从检查点新建MU继续
+    '''
+    switches = {'SNAP_TOP_LEVEL_NB':snap_top_level_nb, 'LEVEL_TREE_TYPE':level_tree_type, 'ORDER_STORE_TYPE':order_store_type}
+    switches_bak = {k:getattr(axob_mod, k) for k in switches}
+    for k, v in switches.items():
+        if v is not None:
+            setattr(axob_mod, k, v)
+    snaps = []
+    try:
+        mu = MU([SecurityID], SecurityIDSource_SZSE, INSTRUMENT_TYPE.STOCK)
+        mu.setCheckPolicy(CHECK_POLICY.EVERY)
+        last_snap = None
+        for i, msg in enumerate(msgs):
+            if checkpoint_at and i==checkpoint_at:
+                fd, fileName = tempfile.mkstemp(suffix='.npz')
+                os.close(fd)
+                try:
+                    checkpoint_save(fileName, mu.save())
+                    mu = MU(None, None, None, load_data=checkpoint_load(fileName))
+                finally:
+                    os.remove(fileName)
+                mu.setCheckPolicy(CHECK_POLICY.EVERY)
+                last_snap = mu.axobs[SecurityID].last_snap    # 恢复出的是另一个对象，不是新快照
+            mu.onMsg(msg)
+            x = mu.axobs[SecurityID]
+            if x.last_snap is not last_snap:
+                last_snap = x.last_snap
+                snaps.append(_snap_key(last_snap))
+    finally:
+        for k, v in switches_bak.items():
+            setattr(axob_mod, k, v)
+    return snaps
+
+
+# 与原实现(遍历价格档、'dict'价格档容器、'dict'订单容器)比较的各实现
+AXOB_DIFF_CASES = [
+    {'snap_top_level_nb':10},
+    {'snap_top_level_nb':10, 'level_tree_type':'sorted'},
+    {'snap_top_level_nb':10, 'level_tree_type':'ladder'},
+    {'snap_top_level_nb':10, 'order_store_type':'soa'},
+    {'snap_top_level_nb':10, 'order_store_type':'dense'},
+    {'snap_top_level_nb':10, 'order_store_type':'dict', 'checkpoint_at':0.5},
+    {'snap_top_level_nb':10, 'order_store_type':'soa', 'checkpoint_at':0.5},
+    {'snap_top_level_nb':10, 'order_store_type':'dense', 'level_tree_type':'ladder', 'checkpoint_at':0.5},
+]
+
+def TEST_axob_diff(seeds=(1, 2), n_per_sec=2, cases=AXOB_DIFF_CASES, logPack=(print, print, print, print)):
+    '''checkpoint_at为小数时表示在序列中的比例'''
+    DBG, INFO, WARN, ERR = logPack
+    for seed in seeds:
+        for gem in (False, True):
+            SecurityID, msgs = rand_stream(seed, gem, n_per_sec)
+            ref = axob_replay(msgs, SecurityID, snap_top_level_nb=0, level_tree_type='dict', order_store_type='dict')
+            for case in cases:
+                case = dict(case)
+                if isinstance(case.get('checkpoint_at'), float):
+                    case['checkpoint_at'] = int(len(msgs) * case['checkpoint_at'])
+                res = axob_replay(msgs, SecurityID, **case)
+                if res!=ref:
+                    n = next((i for i, (a, b) in enumerate(zip(res, ref)) if a!=b), min(len(res), len(ref)))
+                    print_log(ERR, f'seed={seed} {SecurityID:06d} {case}: snap #{n} differs, nb={len(res)}/{len(ref)}')
+                assert res==ref, f'seed={seed} {SecurityID:06d} {case} NG'
+            print_log(INFO, f'{datetime.today()} seed={seed} {SecurityID:06d} msg_nb={len(msgs)} snap_nb={len(ref)} {len(cases)} cases same')
+    print_log(INFO, f'== TEST_axob_diff PASS ==')
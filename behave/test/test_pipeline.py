@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+'''
+流水线回归：读日志 -> MU 两个子进程，级间经shm_ring_queue(共享内存)传递消息，
+结果须与在本进程中直接回放相同；读日志级异常时，MU级和调用者须收到PPStageError
+'''
+
+from datetime import datetime
+from functools import partial
+from tool.axsbe_base import SecurityIDSource_SZSE, INSTRUMENT_TYPE
+from tool.axsbe_cache import axsbe_file_cached
+from tool.pipeline import PPStageBatch, PPStageError
+from tool.shm_ring import shm_ring_queue
+from behave.mu import MU
+from behave.test.test_axob import print_log
+
+
+def _pp_reader(source_file, n_max, stage):
+    for n, msg in enumerate(axsbe_file_cached(source_file)):
+        if n_max and n>=n_max:
+            raise Exception(f'reader stopped at n_max={n_max}')
+        stage.output(msg)
+
+def _pp_mu(instrument_list, SecurityIDSource, instrument_type, stage):
+    mu = MU(instrument_list, SecurityIDSource, instrument_type)
+    n = 0
+    for msg in stage.inputs():
+        mu.onMsg(msg)
+        n += 1
+    stage.output((n, mu.are_you_ok(), str(mu)))
+    mu.close()
+
+def pipeline_replay(source_file, instrument_list:list, SecurityIDSource=SecurityIDSource_SZSE, instrument_type=INSTRUMENT_TYPE.STOCK, reader_n_max=0):
+    '''读日志、MU各在一个子进程中，返回MU级的 (消息数, are_you_ok, MU统计)；reader_n_max>0时读日志级在读到该条数时抛出异常'''
+    reader = PPStageBatch(partial(_pp_reader, source_file, reader_n_max), backend='process', Q=shm_ring_queue())
+    mu = PPStageBatch(partial(_pp_mu, instrument_list, SecurityIDSource, instrument_type), reader, backend='process')
+    try:
+        reader.start()
+        mu.start()
+        r = list(mu.results())
+        reader.join()
+        mu.join()
+    finally:
+        reader.release()
+    return r[0]
+
+
+def TEST_pipeline(source_file, instrument_list:list,
+                    SecurityIDSource=SecurityIDSource_SZSE,
+                    instrument_type=INSTRUMENT_TYPE.STOCK,
+                    logPack=(print, print, print, print)
+                ):
+    DBG, INFO, WARN, ERR = logPack
+
+    mu = MU(instrument_list, SecurityIDSource, instrument_type)
+    n = 0
+    for msg in axsbe_file_cached(source_file):
+        mu.onMsg(msg)
+        n += 1
+    ref = (n, mu.are_you_ok(), str(mu))
+    mu.close()
+
+    res = pipeline_replay(source_file, instrument_list, SecurityIDSource, instrument_type)
+    if res!=ref:
+        print_log(ERR, f'pipeline {res[:2]} != direct {ref[:2]}')
+    assert res==ref, 'pipeline result NG'
+    print_log(INFO, f'{datetime.today()} pipeline msg_nb={n} same as direct')
+
+    try:
+        pipeline_replay(source_file, instrument_list, SecurityIDSource, instrument_type, reader_n_max=n//2)
+        error = None
+    except PPStageError as e:
+        error = str(e)
+    assert error is not None and 'reader stopped' in error, 'pipeline error not propagated'
+    print_log(INFO, f'{datetime.today()} pipeline reader error propagated')
+    print_log(INFO, f'== TEST_pipeline PASS ==')
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sys
+import behave.test.bench_axob as behave_bench
+
+if __name__== '__main__':
+    '''
+    用法: python run_bench_behave.py 日志文件 标的,标的,... [复制份数] [消息数上限]
+          python run_bench_behave.py compare 基准.json 新.json
+    结果写到 log/behave_bench/*.json
+    '''
+    logger = logging.getLogger('main')
+    logger.setLevel(logging.ERROR)  # 基准不输出调试日志和阶段切换日志
+
+    sh = logging.StreamHandler()
+    sh.setLevel(logging.INFO)
+    sh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(sh)
+    logPack = logger.debug, print, logger.warning, logger.error
+
+    if sys.argv[1]=='compare':
+        behave_bench.bench_compare(sys.argv[2], sys.argv[3], logPack=logPack)
+    else:
+        md_file = sys.argv[1]
+        instrument_list = [int(x) for x in sys.argv[2].split(',')]
+        scale = int(sys.argv[3]) if len(sys.argv)>3 else 1
+        n_max = int(sys.argv[4]) if len(sys.argv)>4 else 0
+        behave_bench.BENCH_axob_file(md_file, instrument_list, n_max=n_max, scale=scale, logPack=logPack)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sys
+import behave.test.test_axob_batch as behave_bat
+
+if __name__== '__main__':
+    '''
+    用法: python run_test_behave_bat.py 起始日期 结束日期 [标的,标的,...] [进程数]
+    标的缺省时回归 data/{日期} 下的所有标的
+    '''
+    myname = os.path.split(__file__)[1][:-3]
+
+    logger = logging.getLogger('main')
+    logger.setLevel(logging.DEBUG)
+
+    if not os.path.exists('log'):
+        os.makedirs('log')
+    fh = logging.FileHandler(f'log/{myname}.log', mode='w')
+    fh.setLevel(logging.DEBUG)
+
+    sh = logging.StreamHandler()
+    sh.setLevel(logging.INFO)
+
+    formatter_ts = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    formatter_nts = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
+    fh.setFormatter(formatter_nts)
+    sh.setFormatter(formatter_ts)
+
+    logger.addHandler(fh)
+    logger.addHandler(sh)
+    logPack = logger.debug, logger.info, logger.warn, logger.error
+
+    bgn = int(sys.argv[1]) if len(sys.argv)>1 else 20220426
+    end = int(sys.argv[2]) if len(sys.argv)>2 else bgn
+    instrument_list = [int(x) for x in sys.argv[3].split(',')] if len(sys.argv)>3 and sys.argv[3]!='all' else None
+    nproc = int(sys.argv[4]) if len(sys.argv)>4 else None
+
+    behave_bat.TEST_axob_batch(behave_bat.bat_dates(bgn, end), instrument_list, nproc=nproc, logPack=logPack)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import abc
+import struct
 import numpy as np
 from enum import Enum
 
@@ -30,6 +31,14 @@ MsgTypes_snap  = [MsgType_snap_stock, MsgType_snap_szse_bond, MsgType_snap_sse_b
 MsgType_heartbeat = 1
 MsgType_status_sse_bond = 83
 MsgTypes_headerOnly = [MsgType_heartbeat, MsgType_status_sse_bond]
+
+## 消息种类，消息类的KIND，用于热路径上按整数分派，代替isinstance
+MSG_KIND_NULL   = 0
+MSG_KIND_ORDER  = 1 # axsbe_order
+MSG_KIND_EXE    = 2 # axsbe_exe
+MSG_KIND_SNAP   = 3 # axsbe_snap_stock
+MSG_KIND_STATUS = 4 # axsbe_status
+MSG_KIND_SIGNAL = 5 # AX_SIGNAL
     
 class INSTRUMENT_TYPE(Enum): # 3bit
     STOCK  = 0   #股票
@@ -164,11 +173,38 @@ class TPC3():
     def str(tpc3):
         return TPC3.TPC3_str[tpc3]
 
+## 二进制布局：小端、紧凑(无对齐)、每种 (SecurityIDSource, MsgType) 定长
+## 公共头：SecurityIDSource(u8) MsgType(u8) MsgLen(u16,整条消息的字节数) SecurityID(i32) ChannelNo(u16)，其后为消息体字段
+SBE_HEAD_FMT = '<BBHiH'
+SBE_HEAD = struct.Struct('<BBH')    # 只解公共头前3个字段，用于从字节流中识别消息类型和切分消息
+
+class sbe_layout():
+    '''一种消息的定长二进制布局，struct预编译'''
+    __slots__ = [
+        'attrs',    # 消息体字段名，按打包顺序
+        'level_nb', # 消息体字段之后的价格档数，每档依次为 BidPrice BidQty AskPrice AskQty
+        'st',       # struct.Struct
+    ]
+
+    def __init__(self, fields:list, level_nb=0):
+        '''fields: [(字段名, struct格式)]'''
+        self.attrs = [a for a, _ in fields]
+        self.level_nb = level_nb
+        self.st = struct.Struct(SBE_HEAD_FMT + ''.join(f for _, f in fields) + 'q' * (4*level_nb))
+
+    @property
+    def size(self):
+        return self.st.size
+
+
 class axsbe_base(metaclass=abc.ABCMeta):
     '''
     sbe消息基类：
     目前先按照深交所精度来实现，待需要加入上交所支持时通过SecurityIDSource实现精度切换。
     '''
+    SBE_LAYOUTS = {}    # (SecurityIDSource, MsgType) : sbe_layout，派生类定义
+    KIND = MSG_KIND_NULL
+
     def __init__(self, MsgType, SecurityIDSource):
         self.SecurityIDSource = SecurityIDSource #"证券代码源101=上交所;102=深交所;103=香港交易所"
         self.MsgType = MsgType
@@ -288,6 +324,37 @@ class axsbe_base(metaclass=abc.ABCMeta):
     def unpack_stream(self, bytes_i:bytes):
         return NotImplemented
 
+    def sbe_layout(self, SecurityIDSource, MsgType)->sbe_layout:
+        '''查派生类的SBE_LAYOUTS，不支持时抛异常'''
+        layout = self.SBE_LAYOUTS.get((SecurityIDSource, MsgType))
+        if layout is None:
+            raise Exception(f'Not support {self.__class__.__name__} SecurityIDSource={SecurityIDSource} MsgType={MsgType}')
+        return layout
+
+    def sbe_pack(self, levels=()):
+        '''按SBE_LAYOUTS打包，levels为价格档字段值(已展开)'''
+        layout = self.sbe_layout(self.SecurityIDSource, self.MsgType)
+        return layout.st.pack(self.SecurityIDSource, self.MsgType, layout.size, self.SecurityID, self.ChannelNo,
+                              *[getattr(self, a) for a in layout.attrs], *levels)
+
+    def sbe_unpack(self, bytes_i:bytes):
+        '''按公共头中的类型解包到本消息，返回价格档字段值(已展开)'''
+        SecurityIDSource, MsgType, MsgLen = SBE_HEAD.unpack_from(bytes_i)
+        layout = self.sbe_layout(SecurityIDSource, MsgType)
+        if MsgLen!=layout.size:
+            raise Exception(f'SecurityIDSource={SecurityIDSource} MsgType={MsgType} MsgLen={MsgLen} != {layout.size}')
+        v = layout.st.unpack_from(bytes_i)
+        self.SecurityIDSource, self.MsgType, _, self.SecurityID, self.ChannelNo = v[:5]
+        n = 5 + len(layout.attrs)
+        for a, x in zip(layout.attrs, v[5:n]):
+            setattr(self, a, x)
+
+        # 清除内部缓存
+        self._tick = None
+        self._HHMMSSms = None
+        self._ms = None
+        return v[n:]
+
     def unpack_np(self, np_i:np.ndarray):
         '''将numpy字节流解包成字段值'''
         bytes_i = np_i.tobytes()
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+'''
+AX_sbe日志的二进制列式缓存：
+  * 缓存目录为 {日志文件}.axcache/，与日志放在一起
+  * 每种 (SecurityIDSource, MsgType) 一个定宽结构化数组 kind_{SecurityIDSource}_{MsgType}.npy，字段同msg_util.AXSBE_LOG_LAYOUT
+  * 快速路径不支持的消息（心跳、未知类型等）按原始行保存在 raw.npy
+  * seq.npy 按日志原顺序记录每条消息的 (kind, row, nb)，nb为该消息在日志中的'//'行号(从1开始，同axsbe_file的skip_nb计数)
+  * meta.npy 记录日志的文件大小、mtime和缓存版本，不一致时重建
+所有.npy均可用mmap加载，读取时不需要把整个缓存放入内存
+'''
+
+import os
+import numpy as np
+from tool.msg_util import AXSBE_LOG_LAYOUT, axsbe_line_parser, dict_to_axsbe, str_to_dict
+from tool.axsbe_snap_stock import price_level
+
+AXSBE_CACHE_VERSION = 1
+AXSBE_CACHE_BLOCK = 1<<16  # 读取时每次转换成python对象的记录数
+
+_LEVEL_KEYS = [k for i in range(10) for k in ('BidLevel[%d].Price'%i, 'BidLevel[%d].Qty'%i, 'AskLevel[%d].Price'%i, 'AskLevel[%d].Qty'%i)]
+_INT64_MIN = -(1<<63)
+_INT64_MAX = (1<<63)-1
+
+SEQ_DTYPE = np.dtype([('kind', 'u2'), ('row', 'u4'), ('nb', 'u8')])
+
+
+def _layout_attrs(key):
+    '''(消息类, 普通字段列表, 是否含10档)'''
+    cls, fields, has_level = AXSBE_LOG_LAYOUT[key]
+    attrs = [f[1] if isinstance(f, tuple) else f for f in fields]
+    return cls, attrs, has_level
+
+def _layout_dtype(key):
+    _, attrs, has_level = _layout_attrs(key)
+    names = attrs + (_LEVEL_KEYS if has_level else [])
+    return np.dtype([(n, 'i8') for n in names])
+
+def _record_of(msg, attrs, has_level):
+    rec = [getattr(msg, a) for a in attrs]
+    if has_level:
+        for i in range(10):
+            rec += [msg.bid[i].Price, msg.bid[i].Qty, msg.ask[i].Price, msg.ask[i].Qty]
+    for x in rec:
+        if not isinstance(x, int) or x<_INT64_MIN or x>_INT64_MAX:
+            return None
+    return tuple(rec)
+
+def _msg_of(cls, MsgType, attrs, has_level, rec):
+    msg = cls(MsgType=MsgType)
+    for a, x in zip(attrs, rec):
+        setattr(msg, a, x)
+    if has_level:
+        n = len(attrs)
+        msg.bid = {i:price_level(rec[n+i*4], rec[n+i*4+1]) for i in range(10)}
+        msg.ask = {i:price_level(rec[n+i*4+2], rec[n+i*4+3]) for i in range(10)}
+    return msg
+
+
+def axsbe_cache_dir(fileName):
+    return fileName + '.axcache'
+
+def axsbe_file_meta(fileName):
+    st = os.stat(fileName)
+    return np.array([st.st_size, st.st_mtime_ns, AXSBE_CACHE_VERSION], dtype='i8')
+
+def axsbe_cache_valid(fileName):
+    '''缓存存在，且与日志的文件大小、mtime、缓存版本一致'''
+    meta = os.path.join(axsbe_cache_dir(fileName), 'meta.npy')
+    if not os.path.exists(meta):
+        return False
+    return np.array_equal(np.load(meta), axsbe_file_meta(fileName))
+
+
+class _npy_writer():
+    '''按块追加记录：每AXSBE_CACHE_BLOCK条转换为结构数组追加到临时文件，finish时写成.npy，内存中只有一块'''
+    __slots__ = [
+        'fileName',
+        'dtype',
+        'tmp',  # 临时文件，记录首尾相接
+        'buf',  # 未写出的记录
+        'nb',   # 已写出的记录数
+    ]
+
+    def __init__(self, fileName, dtype):
+        self.fileName = fileName
+        self.dtype = np.dtype(dtype)
+        self.tmp = open(fileName + '.tmp', 'wb')
+        self.buf = []
+        self.nb = 0
+
+    def __len__(self):
+        return self.nb + len(self.buf)
+
+    def append(self, rec):
+        self.buf.append(rec)
+        if len(self.buf)>=AXSBE_CACHE_BLOCK:
+            self.flush()
+
+    def flush(self):
+        if len(self.buf):
+            np.array(self.buf, dtype=self.dtype).tofile(self.tmp)
+            self.nb += len(self.buf)
+            self.buf = []
+
+    def finish(self, fix=None):
+        '''写出.npy并删除临时文件；fix(块)用于写出前按块修正记录'''
+        self.flush()
+        self.tmp.close()
+        out = np.lib.format.open_memmap(self.fileName, mode='w+', dtype=self.dtype, shape=(self.nb,))
+        if self.nb:
+            src = np.memmap(self.tmp.name, dtype=self.dtype, mode='r', shape=(self.nb,))
+            for i in range(0, self.nb, AXSBE_CACHE_BLOCK):
+                b = np.array(src[i:i+AXSBE_CACHE_BLOCK])
+                if fix is not None:
+                    fix(b)
+                out[i:i+AXSBE_CACHE_BLOCK] = b
+            del src
+        out.flush()
+        del out
+        os.remove(self.tmp.name)
+
+
+_RAW_KIND_TBD = 0xffff  # 解析时原始行的kind，写出时改为len(kinds)
+
+
+def axsbe_cache_build(fileName):
+    '''解析日志并写缓存，返回缓存目录；记录按块写出，内存占用与日志大小无关'''
+    meta = axsbe_file_meta(fileName)
+    d = axsbe_cache_dir(fileName)
+    if not os.path.exists(d):
+        os.makedirs(d)
+    if os.path.exists(os.path.join(d, 'meta.npy')):
+        os.remove(os.path.join(d, 'meta.npy'))   # 先使旧缓存失效，写完后再写meta
+    for name in os.listdir(d):
+        if name.startswith('kind_'):
+            os.remove(os.path.join(d, name))
+
+    parser = axsbe_line_parser()
+    kinds = []      # [(SecurityIDSource, MsgType)]
+    kind_idx = {}   # (SecurityIDSource, MsgType) : kind
+    rows = []       # kind : _npy_writer
+    layouts = []    # kind : (attrs, has_level)
+    raw = open(os.path.join(d, 'raw.txt.tmp'), 'wb')    # 原始行，每行一条
+    raw_nb = 0
+    raw_len = 1
+    seq = _npy_writer(os.path.join(d, 'seq.npy'), SEQ_DTYPE)
+    with open(fileName, 'r') as f:
+        nb = 0
+        for l in f:
+            if l[:2] != '//':
+                continue
+            nb += 1
+            msg = parser.parse(l)
+            if msg is None:
+                continue
+            key = (msg.SecurityIDSource, msg.MsgType)
+            rec = None
+            if key in AXSBE_LOG_LAYOUT:
+                if key not in kind_idx:
+                    _, attrs, has_level = _layout_attrs(key)
+                    kind_idx[key] = len(kinds)
+                    kinds.append(key)
+                    rows.append(_npy_writer(os.path.join(d, f'kind_{key[0]}_{key[1]}.npy'), _layout_dtype(key)))
+                    layouts.append((attrs, has_level))
+                k = kind_idx[key]
+                rec = _record_of(msg, *layouts[k])
+            if rec is not None:
+                seq.append((k, len(rows[k]), nb))
+                rows[k].append(rec)
+            else:
+                seq.append((_RAW_KIND_TBD, raw_nb, nb))
+                b = l.strip().encode()
+                raw.write(b + b'\n')
+                raw_nb += 1
+                raw_len = max(raw_len, len(b))
+    raw.close()
+
+    raw_kind = len(kinds)
+    for w in rows:
+        w.finish()
+    np.save(os.path.join(d, 'kinds.npy'), np.array(kinds, dtype='i8').reshape(-1, 2))
+    w = _npy_writer(os.path.join(d, 'raw.npy'), f'S{raw_len}')
+    with open(raw.name, 'rb') as f:
+        for l in f:
+            w.append(l.rstrip(b'\n'))
+    w.finish()
+    os.remove(raw.name)
+    def fix_kind(b):
+        b['kind'][b['kind']==_RAW_KIND_TBD] = raw_kind
+    seq.finish(fix_kind)
+    np.save(os.path.join(d, 'meta.npy'), meta)
+    return d
+
+
+class axsbe_cache():
+    '''已加载（mmap）的缓存'''
+    __slots__ = [
+        'kinds',    # list of (SecurityIDSource, MsgType)，下标即seq中的kind；下标len(kinds)为原始行
+        'arrays',   # kind : 结构化数组
+        'raw',      # 原始行
+        'seq',      # 消息顺序 SEQ_DTYPE
+    ]
+
+    def __init__(self, fileName, mmap_mode='r'):
+        if not axsbe_cache_valid(fileName):
+            axsbe_cache_build(fileName)
+        d = axsbe_cache_dir(fileName)
+        self.kinds = [tuple(x) for x in np.load(os.path.join(d, 'kinds.npy')).tolist()]
+        self.arrays = [np.load(os.path.join(d, f'kind_{s}_{t}.npy'), mmap_mode=mmap_mode) for s, t in self.kinds]
+        self.raw = np.load(os.path.join(d, 'raw.npy'))
+        self.seq = np.load(os.path.join(d, 'seq.npy'), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.seq)
+
+    def start_of(self, skip_nb):
+        '''跳过日志中前skip_nb条'//'行后，第一条消息在seq中的下标'''
+        return int(np.searchsorted(self.seq['nb'], skip_nb, side='right'))
+
+    def records(self, skip_nb=0):
+        '''按日志顺序返回 ((SecurityIDSource, MsgType), 记录)，记录为缓存数组中的零拷贝视图；原始行的key为None'''
+        raw_kind = len(self.kinds)
+        for k, r, _ in self.seq[self.start_of(skip_nb):]:
+            if k==raw_kind:
+                yield None, self.raw[r]
+            else:
+                yield self.kinds[k], self.arrays[k][r]
+
+    def messages(self, skip_nb=0):
+        '''按日志顺序返回消息对象，与axsbe_file(fileName, skip_nb)相同'''
+        raw_kind = len(self.kinds)
+        layouts = []
+        for key in self.kinds:
+            cls, attrs, has_level = _layout_attrs(key)
+            layouts.append((cls, key[1], attrs, has_level))
+        blocks = [(-1, None)] * raw_kind  # kind : (块号, 块内记录)
+
+        bgn = self.start_of(skip_nb)
+        for i in range(bgn, len(self.seq), AXSBE_CACHE_BLOCK):
+            for k, r, _ in self.seq[i:i+AXSBE_CACHE_BLOCK].tolist():
+                if k==raw_kind:
+                    yield dict_to_axsbe(str_to_dict(self.raw[r].decode()))
+                    continue
+                b = r // AXSBE_CACHE_BLOCK
+                if blocks[k][0]!=b:
+                    blocks[k] = (b, self.arrays[k][b*AXSBE_CACHE_BLOCK:(b+1)*AXSBE_CACHE_BLOCK].tolist())
+                yield _msg_of(*layouts[k], blocks[k][1][r-b*AXSBE_CACHE_BLOCK])
+
+
+def axsbe_file_cached(fileName, skip_nb=0):
+    '''同axsbe_file，缓存不存在或过期时先建立缓存'''
+    return axsbe_cache(fileName).messages(skip_nb)
@@ -26,6 +26,20 @@ class axsbe_exe(axsbe_base.axsbe_base):
 
         'TradeMoney',       #SH-BOND
     ]
+
+    KIND = axsbe_base.MSG_KIND_EXE
+
+    SBE_LAYOUTS = {
+        (axsbe_base.SecurityIDSource_SZSE, axsbe_base.MsgType_exe_stock) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'), ('TransactTime', 'Q'), ('BidApplSeqNum', 'Q'), ('OfferApplSeqNum', 'Q'), ('LastPx', 'q'), ('LastQty', 'q'), ('ExecType', 'B'),
+        ]),
+        (axsbe_base.SecurityIDSource_SSE, axsbe_base.MsgType_exe_stock) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'), ('TransactTime', 'Q'), ('BidApplSeqNum', 'Q'), ('OfferApplSeqNum', 'Q'), ('LastPx', 'q'), ('LastQty', 'q'), ('BizIndex', 'Q'), ('ExecType', 'B'),
+        ]),
+        (axsbe_base.SecurityIDSource_SSE, axsbe_base.MsgType_exe_sse_bond) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'), ('TransactTime', 'Q'), ('BidApplSeqNum', 'Q'), ('OfferApplSeqNum', 'Q'), ('LastPx', 'q'), ('LastQty', 'q'), ('TradeMoney', 'q'), ('ExecType', 'B'),
+        ]),
+    }
     
     def __init__(self, SecurityIDSource=axsbe_base.SecurityIDSource_NULL, MsgType=axsbe_base.MsgType_exe_stock):
         super(axsbe_exe, self).__init__(MsgType, SecurityIDSource)
@@ -142,11 +156,11 @@ class axsbe_exe(axsbe_base.axsbe_base):
 
     @property
     def bytes_stream(self):
-        return
+        return self.sbe_pack()
         
 
     def unpack_stream(self, bytes_i:bytes):
-        return
+        self.sbe_unpack(bytes_i)
         
 
     @property
@@ -154,7 +168,7 @@ class axsbe_exe(axsbe_base.axsbe_base):
         return
         
     def save(self):
-        return
+        return self.bytes_stream
     
     def load(self, data):
-        return
+        self.unpack_stream(data)
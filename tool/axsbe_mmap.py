@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+'''
+AX_sbe日志的内存映射回放，用于全市场日志(20GB+)：
+  * 日志按mmap只读映射，不经过python文本层逐行读
+  * 首次打开时扫描映射区建立'//'消息行的起始偏移索引 {日志文件}.axcache/offsets.npy (uint64)，
+    以 offsets_meta.npy 记录日志的文件大小、mtime和版本，不一致时重建；索引同样按mmap加载
+  * 从第N条消息开始回放只需 offsets[N:]，不再逐行计数跳过
+  * 回放过程中按块对已读过的映射区madvise(MADV_DONTNEED)，常驻内存不随回放进度增长
+已建立二进制缓存(axsbe_cache)的日志，其缓存本身即按mmap加载，可直接使用axsbe_file_cached
+'''
+
+import os
+import mmap
+import numpy as np
+from tool.msg_util import axsbe_line_parser
+from tool.axsbe_cache import axsbe_cache_dir, axsbe_file_meta
+
+AXSBE_MMAP_SCAN_BLOCK = 1<<26       # 建索引时每次扫描的字节数
+AXSBE_MMAP_RELEASE_BLOCK = 1<<28    # 回放时每读过这么多字节释放一次映射区
+AXSBE_MMAP_INDEX_BLOCK = 1<<16      # 回放时每次从索引取出的偏移数
+
+
+def _mmap_open(fileName):
+    '''返回只读mmap，空文件返回None（空文件不能mmap）'''
+    with open(fileName, 'rb') as f:
+        if os.fstat(f.fileno()).st_size==0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def axsbe_offsets_build(fileName):
+    '''扫描日志，写'//'行起始偏移索引，返回索引文件路径'''
+    meta = axsbe_file_meta(fileName)
+    mm = _mmap_open(fileName)
+    parts = []
+    if mm is not None:
+        size = len(mm)
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        def msg_starts(starts):
+            '''行首中'//'行的'''
+            starts = starts[starts+1<size]
+            return starts[(buf[starts]==ord('/')) & (buf[starts+1]==ord('/'))]
+        parts.append(msg_starts(np.array([0], dtype='u8')))    # 首行
+        for bgn in range(0, size, AXSBE_MMAP_SCAN_BLOCK):
+            blk = buf[bgn:bgn+AXSBE_MMAP_SCAN_BLOCK]
+            parts.append(msg_starts(np.flatnonzero(blk==ord('\n')).astype('u8') + (bgn+1)))   # 换行符的下一字节为行首；每块只保留'//'行
+        starts = np.concatenate(parts)
+        del parts, buf, blk
+        mm.close()
+    else:
+        starts = np.zeros(0, dtype='u8')
+
+    d = axsbe_cache_dir(fileName)
+    if not os.path.exists(d):
+        os.makedirs(d)
+    meta_file = os.path.join(d, 'offsets_meta.npy')
+    if os.path.exists(meta_file):
+        os.remove(meta_file)   # 先使旧索引失效，写完后再写meta
+    offsets_file = os.path.join(d, 'offsets.npy')
+    np.save(offsets_file, starts)
+    np.save(meta_file, meta)
+    return offsets_file
+
+def axsbe_offsets(fileName):
+    '''mmap加载'//'行起始偏移索引，不存在或过期时先建立'''
+    d = axsbe_cache_dir(fileName)
+    meta_file = os.path.join(d, 'offsets_meta.npy')
+    if not os.path.exists(meta_file) or not np.array_equal(np.load(meta_file), axsbe_file_meta(fileName)):
+        axsbe_offsets_build(fileName)
+    return np.load(os.path.join(d, 'offsets.npy'), mmap_mode='r')
+
+
+def axsbe_file_mmap(fileName, skip_nb=0):
+    '''同axsbe_file，mmap日志并按偏移索引切片解析；skip_nb为跳过的'//'行数，直接定位'''
+    offsets = axsbe_offsets(fileName)
+    mm = _mmap_open(fileName)
+    if mm is None:
+        return
+    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    can_release = hasattr(mmap, 'MADV_DONTNEED')
+    parser = axsbe_line_parser()
+    released = 0
+    try:
+        for i in range(skip_nb, len(offsets), AXSBE_MMAP_INDEX_BLOCK):
+            for s in offsets[i:i+AXSBE_MMAP_INDEX_BLOCK].tolist():
+                e = mm.find(b'\n', s)
+                e = len(mm) if e<0 else e+1
+                msg = parser.parse(mm[s:e].decode())
+                if msg is not None:
+                    yield msg
+            if can_release and s-released>=AXSBE_MMAP_RELEASE_BLOCK:
+                end = s - s % mmap.PAGESIZE
+                mm.madvise(mmap.MADV_DONTNEED, released, end-released)
+                released = end
+    finally:
+        mm.close()
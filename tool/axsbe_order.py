@@ -27,6 +27,23 @@ class axsbe_order(axsbe_base.axsbe_base):
         'BizIndex',         #SH-STOCK
 
     ]
+
+    KIND = axsbe_base.MSG_KIND_ORDER
+
+    SBE_LAYOUTS = {
+        (axsbe_base.SecurityIDSource_SZSE, axsbe_base.MsgType_order_stock) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'), ('TransactTime', 'Q'), ('Price', 'q'), ('OrderQty', 'q'), ('Side', 'B'), ('OrdType', 'B'),
+        ]),
+        (axsbe_base.SecurityIDSource_SSE, axsbe_base.MsgType_order_stock) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'), ('TransactTime', 'Q'), ('OrderNo', 'Q'), ('BizIndex', 'Q'), ('Price', 'q'), ('OrderQty', 'q'), ('Side', 'B'), ('OrdType', 'B'),
+        ]),
+        (axsbe_base.SecurityIDSource_SSE, axsbe_base.MsgType_order_sse_bond_add) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'), ('TransactTime', 'Q'), ('OrderNo', 'Q'), ('Price', 'q'), ('Qty', 'q'), ('Side', 'B'),
+        ]),
+        (axsbe_base.SecurityIDSource_SSE, axsbe_base.MsgType_order_sse_bond_del) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'), ('TransactTime', 'Q'), ('OrderNo', 'Q'), ('Qty', 'q'), ('Side', 'B'),
+        ]),
+    }
     
     def __init__(self, SecurityIDSource=axsbe_base.SecurityIDSource_NULL, MsgType=axsbe_base.MsgType_order_stock):
         super(axsbe_order, self).__init__(MsgType, SecurityIDSource)
@@ -186,14 +203,18 @@ class axsbe_order(axsbe_base.axsbe_base):
 
     @property
     def bytes_stream(self):
-        return;
+        return self.sbe_pack()
     def unpack_stream(self, bytes_i:bytes):
-        return
+        self.sbe_unpack(bytes_i)
+        if self.MsgType==axsbe_base.MsgType_order_sse_bond_add:
+            self.OrdType = ord('A')
+        elif self.MsgType==axsbe_base.MsgType_order_sse_bond_del:
+            self.OrdType = ord('D')
     @property
     def ccode(self):
         return
 
     def save(self):
-        return
+        return self.bytes_stream
     def load(self, data):
-        return
\ No newline at end of file
+        self.unpack_stream(data)
\ No newline at end of file
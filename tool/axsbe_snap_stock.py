@@ -3,6 +3,7 @@
 import tool.axsbe_base as axsbe_base
 from tool.axsbe_base import TPM, TPI, TPC2, TPC3
 import struct
+from array import array
 
 class price_level:
     '''价格档位'''
@@ -54,6 +55,15 @@ class price_level:
             setattr(self, attr, data[attr])
 
 
+_SNAP_SBE_FIELDS = [
+    ('TransactTime', 'Q'), ('TradingPhaseCode', 'B'), ('TradingPhaseCodePack', 'B'),
+    ('NumTrades', 'q'), ('TotalVolumeTrade', 'q'), ('TotalValueTrade', 'q'),
+    ('PrevClosePx', 'q'), ('LastPx', 'q'), ('OpenPx', 'q'), ('HighPx', 'q'), ('LowPx', 'q'),
+    ('BidWeightPx', 'q'), ('BidWeightSize', 'q'), ('AskWeightPx', 'q'), ('AskWeightSize', 'q'),
+    ('UpLimitPx', 'q'), ('DnLimitPx', 'q'),
+]
+
+
 class axsbe_snap_stock(axsbe_base.axsbe_base):
     __slots__ = [
         'SecurityIDSource',
@@ -88,9 +98,19 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         'AskWeightPx_uncertain', #加权价无法确定
         '_seq',
         '_source',  # MD=from MarketData; AXOB=AXOrderBook rebuild
+        '_fp',      # 内容指纹缓存，见fingerprint()
 
     ]
 
+    KIND = axsbe_base.MSG_KIND_SNAP
+
+    # 各类快照使用同一布局：所有数值字段 + 10档
+    SBE_LAYOUTS = {
+        (SecurityIDSource, MsgType) : axsbe_base.sbe_layout(_SNAP_SBE_FIELDS, 10)
+        for SecurityIDSource in (axsbe_base.SecurityIDSource_SZSE, axsbe_base.SecurityIDSource_SSE)
+        for MsgType in axsbe_base.MsgTypes_snap
+    }
+
     def __init__(self, SecurityIDSource=axsbe_base.SecurityIDSource_NULL, source="MD", MsgType=axsbe_base.MsgType_snap_stock):
         super(axsbe_snap_stock, self).__init__(MsgType, SecurityIDSource)
         self.TradingPhaseCode = 0
@@ -118,10 +138,12 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
 
         self._seq = -1
         self._source = source
+        self._fp = None
 
 
     def load_dict(self, dict:dict):
         '''从字典加载字段'''
+        self._fp = None
         #公共头
         self.SecurityIDSource = dict['SecurityIDSource']
         self.MsgType = dict['MsgType']
@@ -179,6 +201,26 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         else:
             raise Exception(f'Not support SecurityIDSource={self.SecurityIDSource}')
 
+    def fingerprint(self, update=False):
+        '''
+        内容指纹：is_same比较的字段(不含时戳、AskWeightPx)的hash，首次调用或update=True时计算并缓存
+        指纹相等不保证is_same，仍需is_same确认；计算后修改了字段须用update=True重算
+        '''
+        if self._fp is None or update:
+            self._fp = hash((
+                self.MsgType, self.SecurityIDSource, self.ChannelNo, self.TradingPhaseCode, self.SecurityID,
+                self.NumTrades, self.TotalVolumeTrade, self.TotalValueTrade, self.PrevClosePx,
+                self.LastPx, self.OpenPx, self.HighPx, self.LowPx,
+                self.BidWeightPx, self.BidWeightSize, self.AskWeightSize, self.UpLimitPx, self.DnLimitPx,
+                *self.level_pairs(),
+            ))
+        return self._fp
+
+    def level_pairs(self):
+        '''(买方10档(Price, Qty), 卖方10档(Price, Qty))'''
+        return (tuple((self.bid[i].Price, self.bid[i].Qty) for i in range(10)),
+                tuple((self.ask[i].Price, self.ask[i].Qty) for i in range(10)))
+
     def is_same(self, another):
         if not isinstance(another, axsbe_snap_stock):
             return False
@@ -202,15 +244,10 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
         AskWeightSize_isSame = self.AskWeightSize == another.AskWeightSize
         UpLimitPx_isSame = self.UpLimitPx == another.UpLimitPx
         DnLimitPx_isSame = self.DnLimitPx == another.DnLimitPx
-        bid_isSame = True
-        for i in range(10):
-            if self.bid[i] != another.bid[i]:
-                bid_isSame = False
-                
-        ask_isSame = True
-        for i in range(10):
-            if self.ask[i] != another.ask[i]:
-                ask_isSame = False
+        bid, ask = self.level_pairs()
+        another_bid, another_ask = another.level_pairs()
+        bid_isSame = bid == another_bid
+        ask_isSame = ask == another_ask
 
         # TransactTime_isSame = self.TransactTime == another.TransactTime   ## 不关心时戳是否一致
 
@@ -479,19 +516,119 @@ class axsbe_snap_stock(axsbe_base.axsbe_base):
 
     @property
     def bytes_stream(self):
-        return
+        levels = []
+        for i in range(10):
+            levels += [self.bid[i].Price, self.bid[i].Qty, self.ask[i].Price, self.ask[i].Qty]
+        return self.sbe_pack(levels)
 
 
     def unpack_stream(self, bytes_i:bytes):
-        return
+        levels = self.sbe_unpack(bytes_i)
+        self._fp = None
+        self.bid = {i:price_level(levels[i*4], levels[i*4+1]) for i in range(10)}
+        self.ask = {i:price_level(levels[i*4+2], levels[i*4+3]) for i in range(10)}
         
     @property
     def ccode(self):
         return
         
     def save(self):
-        return
+        '''save/load 用于保存/加载测试时刻，除字节流外保存调试字段'''
+        return {
+            'bytes' : self.bytes_stream,
+            'AskWeightPx_uncertain' : self.AskWeightPx_uncertain,
+            '_seq' : self._seq,
+            '_source' : self._source,
+        }
 
     def load(self, data):
-        return
-        
\ No newline at end of file
+        self.unpack_stream(data['bytes'])
+        self.AskWeightPx_uncertain = data['AskWeightPx_uncertain']
+        self._seq = data['_seq']
+        self._source = data['_source']
+        
+
+
+_SNAP_COPY_ATTRS = ['SecurityID', 'ChannelNo'] + [f for f, _ in _SNAP_SBE_FIELDS] + ['AskWeightPx_uncertain', '_seq']
+_SNAP_LEVELS_ZERO = array('q', [0]) * 40
+
+
+class axsbe_snap_compact(axsbe_snap_stock):
+    '''
+    紧凑的快照，用于重建快照：10档保存在一个定长array中，各档依次为 BidPrice BidQty AskPrice AskQty(同SBE布局)，不构造price_level
+      * bid/ask 每次访问时由levels转换出price_level字典，赋值时写回levels
+      * 打印/导出时用to_snap()转换为axsbe_snap_stock
+    '''
+    __slots__ = [
+        'levels',
+    ]
+
+    def __init__(self, SecurityIDSource=axsbe_base.SecurityIDSource_NULL, source="AXOB", MsgType=axsbe_base.MsgType_snap_stock):
+        axsbe_base.axsbe_base.__init__(self, MsgType, SecurityIDSource)
+        self.TradingPhaseCode = 0
+        self.NumTrades = 0
+        self.TotalVolumeTrade = 0
+        self.TotalValueTrade = 0
+        self.PrevClosePx = 0
+        self.LastPx = 0
+        self.OpenPx = 0
+        self.HighPx = 0
+        self.LowPx = 0
+        self.BidWeightPx = 0
+        self.BidWeightSize = 0
+        self.AskWeightPx = 0
+        self.AskWeightSize = 0
+        self.UpLimitPx = 0
+        self.DnLimitPx = 0
+        self.levels = array('q', _SNAP_LEVELS_ZERO)
+        self.TradingPhaseCodePack = 0
+        self.AskWeightPx_uncertain = False
+        self._seq = -1
+        self._source = source
+        self._fp = None
+
+    @property
+    def bid(self):
+        lv = self.levels
+        return {i:price_level(lv[i*4], lv[i*4+1]) for i in range(10)}
+
+    @bid.setter
+    def bid(self, levels:dict):
+        self._set_levels(0, levels)
+
+    @property
+    def ask(self):
+        lv = self.levels
+        return {i:price_level(lv[i*4+2], lv[i*4+3]) for i in range(10)}
+
+    @ask.setter
+    def ask(self, levels:dict):
+        self._set_levels(2, levels)
+
+    def _set_levels(self, ofs, levels:dict):
+        lv = self.levels
+        for i in range(10):
+            l = levels.get(i)
+            lv[i*4+ofs] = 0 if l is None else l.Price
+            lv[i*4+ofs+1] = 0 if l is None else l.Qty
+        self._fp = None
+
+    def level_pairs(self):
+        lv = self.levels
+        return tuple(zip(lv[0::4], lv[1::4])), tuple(zip(lv[2::4], lv[3::4]))
+
+    @property
+    def bytes_stream(self):
+        return self.sbe_pack(self.levels)
+
+    def to_snap(self):
+        '''转换为axsbe_snap_stock'''
+        snap = axsbe_snap_stock(SecurityIDSource=self.SecurityIDSource, source=self._source, MsgType=self.MsgType)
+        for attr in _SNAP_COPY_ATTRS:
+            setattr(snap, attr, getattr(self, attr))
+        snap.bid = self.bid
+        snap.ask = self.ask
+        return snap
+
+    def __str__(self):
+        return str(self.to_snap())
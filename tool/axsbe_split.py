@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+'''
+全市场AX_sbe日志按标的拆分：
+  * 一次扫描源文件，按行首的 SecurityIDSource/SecurityID 前缀分发，不解析整行
+  * 同时写出所有标的的 AX_sbe_{szse|sse}_XXXXXX.log，各标的缓冲后批量追加写，不受打开文件数限制
+  * 可按字节范围切块多进程并行，各块写入临时目录后按块顺序拼接，结果与单进程一致
+  * 写出每个标的在源文件中的'//'行字节偏移索引 AX_sbe_index.npz，key为输出文件名(不含.log)
+'''
+
+import os
+import re
+import shutil
+import numpy as np
+from multiprocessing import Pool
+from tool.axsbe_base import SecurityIDSource_SSE, SecurityIDSource_SZSE
+
+SPLIT_FLUSH_SIZE = 1<<26    # 缓冲的总字节数超过后全部写盘
+SPLIT_INDEX_NAME = 'AX_sbe_index.npz'
+
+_LOG_ID = re.compile(rb'//\s*SecurityIDSource=(\d+)\s.*?\bSecurityID=(\d+)')
+_SRC_CHAR = {
+    SecurityIDSource_SZSE : 'szse',
+    SecurityIDSource_SSE  : 'sse',
+}
+
+
+def split_name(SecurityIDSource, SecurityID):
+    '''输出文件名(不含.log)，同TEST_axob的md_file'''
+    return f'AX_sbe_{_SRC_CHAR[SecurityIDSource]}_{SecurityID:06d}'
+
+
+def _chunk_ranges(src_file, nb):
+    '''按字节数把文件切成nb块，每块起点对齐到行首'''
+    size = os.path.getsize(src_file)
+    bounds = [0]
+    with open(src_file, 'rb') as f:
+        for i in range(1, nb):
+            pos = size * i // nb
+            if pos<=bounds[-1]:
+                continue
+            f.seek(pos-1)
+            f.readline()    # pos-1处为换行符时readline只读该换行符，pos本身即行首
+            pos = f.tell()
+            if pos>=size:
+                break
+            if pos>bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _split_range(src_file, dst_dir, bgn, end, security_set):
+    '''
+    拆分源文件[bgn, end)，追加写到dst_dir下的各标的文件
+    返回 {文件名: [字节偏移]}
+    '''
+    offsets = {}
+    bufs = {}
+    buf_size = 0
+
+    def flush():
+        for name, lines in bufs.items():
+            with open(os.path.join(dst_dir, name+'.log'), 'ab') as d:
+                d.writelines(lines)
+        bufs.clear()
+
+    with open(src_file, 'rb') as s:
+        s.seek(bgn)
+        pos = bgn
+        for l in s:
+            if pos>=end:
+                break
+            p = pos
+            pos += len(l)
+            if l[:2]!=b'//':
+                continue
+            m = _LOG_ID.match(l)
+            if m is None:
+                continue
+            key = (int(m.group(1)), int(m.group(2)))
+            if security_set is not None and key not in security_set:
+                continue
+            name = split_name(*key)
+            if name not in bufs:
+                bufs[name] = []
+                if name not in offsets:
+                    offsets[name] = []
+            bufs[name].append(l)
+            offsets[name].append(p)
+            buf_size += len(l)
+            if buf_size>=SPLIT_FLUSH_SIZE:
+                flush()
+                buf_size = 0
+    flush()
+    return offsets
+
+
+def _split_worker(args):
+    return _split_range(*args)
+
+
+def split_security(src_file, dst_dir, security_list:list=None, SecurityIDSource=SecurityIDSource_SZSE, nproc=1):
+    '''
+    把全市场日志src_file拆分到dst_dir/AX_sbe_{szse|sse}_XXXXXX.log
+    security_list为None时拆分所有标的；nproc>1时按字节范围分块并行
+    返回 {文件名: 行数}
+    '''
+    if not os.path.exists(dst_dir):
+        os.makedirs(dst_dir)
+    security_set = None if security_list is None else {(SecurityIDSource, x) for x in security_list}
+
+    ranges = _chunk_ranges(src_file, max(nproc, 1))
+    part_dirs = [os.path.join(dst_dir, f'.part{i}') for i in range(len(ranges))]
+    for d in part_dirs:
+        if os.path.exists(d):
+            shutil.rmtree(d)
+        os.makedirs(d)
+    args = [(src_file, d, b, e, security_set) for d, (b, e) in zip(part_dirs, ranges)]
+    if len(args)>1:
+        with Pool(min(nproc, len(args))) as pool:
+            parts = pool.map(_split_worker, args)
+    else:
+        parts = [_split_worker(a) for a in args]
+
+    # 按块顺序拼接，只在一个块中出现的直接移动
+    for name in sorted({n for p in parts for n in p}):
+        dst = os.path.join(dst_dir, name+'.log')
+        srcs = [os.path.join(d, name+'.log') for d, p in zip(part_dirs, parts) if name in p]
+        if len(srcs)==1:
+            os.replace(srcs[0], dst)
+            continue
+        with open(dst, 'wb') as d:
+            for src in srcs:
+                with open(src, 'rb') as f:
+                    shutil.copyfileobj(f, d)
+    for d in part_dirs:
+        shutil.rmtree(d)
+
+    index = {}
+    for p in parts:
+        for name, offs in p.items():
+            index.setdefault(name, []).extend(offs)
+    np.savez(os.path.join(dst_dir, SPLIT_INDEX_NAME), **{k:np.array(v, dtype='u8') for k, v in index.items()})
+    return {k:len(v) for k, v in index.items()}
+
+
+def split_index(dst_dir):
+    '''加载split_security写出的字节偏移索引，{文件名: uint64数组}'''
+    with np.load(os.path.join(dst_dir, SPLIT_INDEX_NAME)) as z:
+        return {k:z[k] for k in z.files}
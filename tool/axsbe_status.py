@@ -19,6 +19,20 @@ class axsbe_status(axsbe_base.axsbe_base):
         'ApplSeqNum',
         'TradingPhaseInstrument',
     ]
+
+    KIND = axsbe_base.MSG_KIND_STATUS
+
+    SBE_LAYOUTS = {
+        (axsbe_base.SecurityIDSource_SZSE, axsbe_base.MsgType_heartbeat) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'),
+        ]),
+        (axsbe_base.SecurityIDSource_SSE, axsbe_base.MsgType_heartbeat) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'), ('TradingPhaseInstrument', 'B'),
+        ]),
+        (axsbe_base.SecurityIDSource_SSE, axsbe_base.MsgType_status_sse_bond) : axsbe_base.sbe_layout([
+            ('ApplSeqNum', 'Q'), ('TradingPhaseInstrument', 'B'),
+        ]),
+    }
     
     def __init__(self, SecurityIDSource=axsbe_base.SecurityIDSource_NULL, MsgType=axsbe_base.MsgType_heartbeat):
         super(axsbe_status, self).__init__(MsgType, SecurityIDSource)
@@ -95,10 +109,10 @@ class axsbe_status(axsbe_base.axsbe_base):
 
     @property
     def bytes_stream(self):
-        return
+        return self.sbe_pack()
 
     def unpack_stream(self, bytes_i:bytes):
-        return
+        self.sbe_unpack(bytes_i)
     
     @property
     def ccode(self):
@@ -106,7 +120,7 @@ class axsbe_status(axsbe_base.axsbe_base):
         
 
     def save(self):
-        return
+        return self.bytes_stream
 
     def load(self, data):
-        return
\ No newline at end of file
+        self.unpack_stream(data)
\ No newline at end of file
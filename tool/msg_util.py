@@ -9,8 +9,8 @@ from tool.axsbe_snap_stock import axsbe_snap_stock, price_level
 from enum import Enum
 import pandas as pd
 import numpy
-from decimal import Decimal
 import os
+import re
 
 #### 交易所 板块子类型
 class MARKET_SUBTYPE(Enum):
@@ -122,6 +122,32 @@ def dict_to_axsbe(s:dict):
         return None
 
 
+def bytes_to_axsbe(b:bytes):
+    '''从二进制字节流(bytes_stream)构造消息，类型由公共头确定'''
+    _, MsgType, _ = axsbe_base.SBE_HEAD.unpack_from(b)
+    if MsgType in axsbe_base.MsgTypes_order:
+        msg = axsbe_order(MsgType=MsgType)
+    elif MsgType in axsbe_base.MsgTypes_exe:
+        msg = axsbe_exe(MsgType=MsgType)
+    elif MsgType in axsbe_base.MsgTypes_snap:
+        msg = axsbe_snap_stock(MsgType=MsgType)
+    elif MsgType in axsbe_base.MsgTypes_headerOnly:
+        msg = axsbe_status(MsgType=MsgType)
+    else:
+        raise Exception(f'Not support MsgType={MsgType}')
+    msg.unpack_stream(b)
+    return msg
+
+def axsbe_bytes(buf):
+    '''切分首尾相接的二进制消息流(bytes/bytearray/memoryview/mmap)，逐条返回消息'''
+    buf = memoryview(buf)
+    i = 0
+    while i<len(buf):
+        _, _, MsgLen = axsbe_base.SBE_HEAD.unpack_from(buf, i)
+        yield bytes_to_axsbe(buf[i:i+MsgLen])
+        i += MsgLen
+
+
 def axsbe_file(fileName, skip_nb=0):
     with open(fileName, 'r') as f:
         nb = 0
@@ -140,6 +166,151 @@ def axsbe_file(fileName, skip_nb=0):
                     pass
                     # 11, 12
 
+
+## 快速行解析：按 (SecurityIDSource, MsgType) 预置日志字段到消息字段的映射（与各消息的load_dict一致），
+## 首次遇到某种字段排列时编译成整行正则，此后直接由正则分组填充消息字段，不再构造中间dict
+_LOG_HEAD = re.compile(r'//\s*SecurityIDSource=(\d+)\s+MsgType=(\d+)\s')
+
+_LOG_FIELDS_ORDER = ['SecurityIDSource', 'MsgType', 'SecurityID', 'ChannelNo', 'ApplSeqNum']
+_LOG_FIELDS_EXE   = ['SecurityIDSource', 'SecurityID', 'ChannelNo', 'ApplSeqNum']
+_LOG_FIELDS_SNAP  = ['SecurityIDSource', 'MsgType', 'SecurityID', 'ChannelNo']
+
+# (SecurityIDSource, MsgType) : (消息类, {日志字段:消息字段}, 是否含10档)
+AXSBE_LOG_LAYOUT = {
+    (SecurityIDSource_SZSE, axsbe_base.MsgType_order_stock) : (axsbe_order, _LOG_FIELDS_ORDER + ['Price', 'OrderQty', 'Side', 'TransactTime', 'OrdType'], False),
+    (SecurityIDSource_SSE,  axsbe_base.MsgType_order_stock) : (axsbe_order, _LOG_FIELDS_ORDER + ['OrderNo', 'Price', 'OrderQty', 'OrdType', 'Side', 'TransactTime', 'BizIndex'], False),
+    (SecurityIDSource_SSE,  axsbe_base.MsgType_order_sse_bond_add) : (axsbe_order, _LOG_FIELDS_ORDER + ['OrderNo', ('TradingPhase', 'Side'), 'Qty', ('TickTime', 'TransactTime'), 'Price'], False),
+    (SecurityIDSource_SSE,  axsbe_base.MsgType_order_sse_bond_del) : (axsbe_order, _LOG_FIELDS_ORDER + ['OrderNo', ('TradingPhase', 'Side'), 'Qty', ('TickTime', 'TransactTime')], False),
+
+    (SecurityIDSource_SZSE, axsbe_base.MsgType_exe_stock) : (axsbe_exe, _LOG_FIELDS_EXE + ['BidApplSeqNum', 'OfferApplSeqNum', 'LastPx', 'LastQty', 'ExecType', 'TransactTime'], False),
+    (SecurityIDSource_SSE,  axsbe_base.MsgType_exe_stock) : (axsbe_exe, _LOG_FIELDS_EXE + ['BidApplSeqNum', 'OfferApplSeqNum', 'LastPx', 'LastQty', 'ExecType', 'TransactTime', 'BizIndex'], False),
+    (SecurityIDSource_SSE,  axsbe_base.MsgType_exe_sse_bond) : (axsbe_exe, _LOG_FIELDS_EXE + [('TradingPhase', 'ExecType'), ('BuyOrderNo', 'BidApplSeqNum'), ('SellOrderNo', 'OfferApplSeqNum'),
+                                                                                               ('Price', 'LastPx'), ('Qty', 'LastQty'), 'TradeMoney', ('TickTime', 'TransactTime')], False),
+
+    (SecurityIDSource_SZSE, axsbe_base.MsgType_snap_stock) : (axsbe_snap_stock, _LOG_FIELDS_SNAP + [('TradingPhase', 'TradingPhaseCode'), 'NumTrades', 'TotalVolumeTrade', 'TotalValueTrade', 'PrevClosePx',
+                                                                                                     'LastPx', 'OpenPx', 'HighPx', 'LowPx', 'BidWeightPx', 'BidWeightSize', 'AskWeightPx', 'AskWeightSize',
+                                                                                                     'UpLimitPx', 'DnLimitPx', 'TransactTime'], True),
+    (SecurityIDSource_SSE,  axsbe_base.MsgType_snap_stock) : (axsbe_snap_stock, _LOG_FIELDS_SNAP + [('TradingPhase', 'TradingPhaseCode'), 'NumTrades', 'TotalVolumeTrade', 'TotalValueTrade', 'PrevClosePx',
+                                                                                                     'TradingPhaseCodePack', 'BidWeightPx', 'BidWeightSize', 'AskWeightPx', 'AskWeightSize',
+                                                                                                     'LastPx', 'OpenPx', 'HighPx', 'LowPx', ('DataTimeStamp', 'TransactTime')], True),
+    (SecurityIDSource_SSE,  axsbe_base.MsgType_snap_sse_bond) : (axsbe_snap_stock, _LOG_FIELDS_SNAP + [('TradingPhase', 'TradingPhaseCode'), 'NumTrades', 'TotalVolumeTrade', 'TotalValueTrade',
+                                                                                                        ('AltWeightedAvgBidPx', 'BidWeightPx'), ('TotalBidQty', 'BidWeightSize'),
+                                                                                                        ('AltWeightedAvgOfferPx', 'AskWeightPx'), ('TotalOfferQty', 'AskWeightSize'),
+                                                                                                        'LastPx', 'OpenPx', 'HighPx', 'LowPx', ('DataTimeStamp', 'TransactTime')], True),
+}
+
+class axsbe_line_parser():
+    '''
+    AX_sbe日志行解析，结果与 dict_to_axsbe(str_to_dict(l)) 相同
+    无法走快速路径的行（未知消息类型、字段缺失或排列不一致）退回到 str_to_dict + dict_to_axsbe
+    '''
+    __slots__ = [
+        'layouts',  # (SecurityIDSource, MsgType) : [(整行正则, 消息类, MsgType, [(分组号, 消息字段)], [(买价,买量,卖价,卖量)分组号]), ...]
+    ]
+
+    def __init__(self):
+        self.layouts = {}
+
+    def _compile(self, key, l):
+        '''按本行的字段排列编译快速路径，只捕获用到的字段；不支持时返回None'''
+        if key not in AXSBE_LOG_LAYOUT:
+            return None
+        cls, fields, has_level = AXSBE_LOG_LAYOUT[key]
+
+        used = set()
+        for f in fields:
+            used.add(f[0] if isinstance(f, tuple) else f)
+        if has_level:
+            for i in range(10):
+                used.update(['BidLevel[%d].Price'%i, 'BidLevel[%d].Qty'%i, 'AskLevel[%d].Price'%i, 'AskLevel[%d].Qty'%i])
+
+        tokens = [x.partition('=') for x in l[2:].split()]
+        last = {}   # 重复字段以最后一个为准(同str_to_dict)
+        for n, (k, _, v) in enumerate(tokens):
+            if v!='':
+                last[k] = n
+
+        pattern = []
+        group = {}  # 日志字段: 分组号
+        for n, (k, _, v) in enumerate(tokens):
+            if v=='':
+                pattern.append(re.escape(k) + '=')   # 空值字段(str_to_dict中会被丢弃)
+            elif k in used and last[k]==n:
+                group[k] = len(group)
+                pattern.append(re.escape(k) + r'=(-?\d+)')
+            else:
+                pattern.append(re.escape(k) + r'=-?\d+')
+        regex = re.compile(r'//\s*' + r'\s+'.join(pattern) + r'\s*$')
+
+        setters = []
+        for f in fields:
+            k, attr = f if isinstance(f, tuple) else (f, f)
+            if k not in group:
+                return None
+            setters.append((group[k], attr))
+
+        levels = []
+        if has_level:
+            for i in range(10):
+                ks = ['BidLevel[%d].Price'%i, 'BidLevel[%d].Qty'%i, 'AskLevel[%d].Price'%i, 'AskLevel[%d].Qty'%i]
+                if any(k not in group for k in ks):
+                    return None
+                levels.append(tuple(group[k] for k in ks))
+
+        return (regex, cls, key[1], setters, levels)
+
+    def parse(self, l:str):
+        '''l以'//'开头'''
+        h = _LOG_HEAD.match(l)
+        if h is None:
+            return dict_to_axsbe(str_to_dict(l.lstrip()))
+
+        key = (int(h.group(1)), int(h.group(2)))
+        layouts = self.layouts.get(key)
+        if layouts is None:
+            layouts = self.layouts[key] = []
+        for layout in layouts:
+            m = layout[0].match(l)
+            if m is not None:
+                return self._build(layout, m)
+
+        if len(layouts)<4:  # 同一消息类型的字段排列通常只有一种，这里只保留少量
+            layout = self._compile(key, l.rstrip())
+            if layout is not None:
+                layouts.append(layout)
+                m = layout[0].match(l)
+                if m is not None:
+                    return self._build(layout, m)
+        return dict_to_axsbe(str_to_dict(l.lstrip()))
+
+    def _build(self, layout, m):
+        _, cls, MsgType, setters, levels = layout
+        v = list(map(int, m.groups()))
+        msg = cls(MsgType=MsgType)
+        for i, attr in setters:
+            setattr(msg, attr, v[i])
+        if levels:
+            msg.bid = {n:price_level(v[bp], v[bq]) for n, (bp, bq, _, _) in enumerate(levels)}
+            msg.ask = {n:price_level(v[ap], v[aq]) for n, (_, _, ap, aq) in enumerate(levels)}
+        return msg
+
+
+def axsbe_file_fast(fileName, skip_nb=0, pos=None):
+    '''同axsbe_file，使用axsbe_line_parser解析；pos(list)不为None时，pos[0]为最近返回的消息在日志中的'//'行号'''
+    parser = axsbe_line_parser()
+    with open(fileName, 'r') as f:
+        nb = 0
+        for l in f:
+            if l[:2] == '//':
+                nb += 1
+                if nb<=skip_nb:
+                    continue
+                msg = parser.parse(l)
+                if msg is not None:
+                    if pos is not None:
+                        pos[0] = nb
+                    yield msg
+
 def extract_security(src_file, dst_file, security_list:list):
     dst_dir, _ = os.path.split(os.path.abspath(dst_file))
     if not os.path.exists(dst_dir):
@@ -181,18 +352,38 @@ def formatCSV2AX(df):
             df['SecurityIDSource'] = SecurityIDSource_SZSE
         elif df['SecurityID'][0][-3:]=='.SH':
             df['SecurityIDSource'] = SecurityIDSource_SSE
-            raise '上海格式尚未完成'
-    df['SecurityID'] = df['SecurityID'].map(lambda x:int(x[:-3]))
+            raise Exception('上海格式尚未完成')
+    df['SecurityID'] = df['SecurityID'].str[:-3].astype('int64')
 
     df['ChannelNo'] = 2000
 
-    df['Price'] = df.Price.map(lambda x:int(Decimal(x)*Decimal(10000)))
+    df['Price'] = csv_price_scale(df['Price'], PRICE_SZSE_INCR_PRECISION)
     df['Qty'] = df['Qty']*100
-    df["datetime"]= pd.to_datetime(df[ "datetime"])
-    df['TransactTime'] = df['datetime'].map(lambda x: x.year*YEAR_SHFT + x.month*MONTH_SHFT + x.day*DAY_SHFT + x.hour*HOUR_SHFT + x.minute*MINU_SHFT + x.second*SEC_SHFT + (x.microsecond//1000))
+    dt = pd.to_datetime(df["datetime"]).dt
+    i64 = lambda x:x.astype('int64')
+    df['TransactTime'] = i64(dt.year)*YEAR_SHFT + i64(dt.month)*MONTH_SHFT + i64(dt.day)*DAY_SHFT + i64(dt.hour)*HOUR_SHFT + i64(dt.minute)*MINU_SHFT + i64(dt.second)*SEC_SHFT + i64(dt.microsecond)//1000
 
     return df
 
+def csv_price_scale(s, precision):
+    '''
+    价格字符串列按列放大到整数精度，结果同 int(Decimal(x)*Decimal(precision))（小数位超出精度时截断）
+    '''
+    digits = len(str(precision)) - 1
+    parts = s.astype(str).str.strip().str.split('.', n=1, expand=True)
+    if parts.shape[1]==1:
+        parts[1] = None
+    neg = parts[0].str.startswith('-')
+    ip = parts[0].str.lstrip('+-').replace('', '0').astype('int64')
+    fp = parts[1].fillna('').str.ljust(digits, '0').str[:digits].astype('int64')
+    v = ip*precision + fp
+    return v.where(~neg, -v)
+
+def csv_ord(s):
+    '''单字符列转成ord值，按取值去重后映射'''
+    s = s.astype(str)
+    return s.map({c:ord(c) for c in s.unique()}).astype('int64')
+
 def load_wt(fileName): #order
     '''
     csv典型值：
@@ -214,7 +405,7 @@ def load_wt(fileName): #order
     df.rename(columns={'Qty':'OrderQty'}, inplace=True)
 
     df['OrdType'] = ord('2')
-    df['Side'] = df['Side'].map(lambda x:ord(str(x)))
+    df['Side'] = csv_ord(df['Side'])
     return df
 
 def load_cj(fileName): #execute
@@ -232,14 +423,17 @@ def load_cj(fileName): #execute
     df = pd.read_csv(fileName, header=None, index_col=None, dtype={4:object}) #价格按str读入
     df.columns = ['SecurityID', 'datetime', 'ExecType', 'ApplSeqNum', 'Price', 'BidApplSeqNum', 'Qty', 'OfferApplSeqNum', 'tradeamount']
 
-    df['MsgType'] = axsbe_base.MsgType_exe
+    df['MsgType'] = axsbe_base.MsgType_exe_stock
 
     df = formatCSV2AX(df)
     df.rename(columns={'Price':'LastPx', 'Qty':'LastQty'}, inplace=True)
 
-    df['ExecType'] = df['ExecType'].map(lambda x:ord(str(x)))
+    df['ExecType'] = csv_ord(df['ExecType'])
     return df
 
+_CSV_ORDER_KEYS = ['SecurityIDSource', 'MsgType', 'SecurityID', 'ChannelNo', 'ApplSeqNum', 'Price', 'OrderQty', 'Side', 'OrdType', 'TransactTime']
+_CSV_EXE_KEYS   = ['SecurityIDSource', 'MsgType', 'SecurityID', 'ChannelNo', 'ApplSeqNum', 'BidApplSeqNum', 'OfferApplSeqNum', 'LastPx', 'LastQty', 'ExecType', 'TransactTime']
+
 def axsbe_file_csv(wtName, cjName, snapName):
     snaps = axsbe_file(snapName)
     for snap in snaps:
@@ -248,23 +442,19 @@ def axsbe_file_csv(wtName, cjName, snapName):
         else:
             break
 
+    # 逐笔委托和逐笔成交分别按列取出python int，再按ApplSeqNum归并
     wt = load_wt(wtName)
     cj = load_cj(cjName)
-    inc = pd.concat([wt, cj])
-    for k in ['OrderQty', 'ApplSeqNum', 'Price', 'LastPx', 'BidApplSeqNum', 'LastQty', 'OfferApplSeqNum']:
-        inc[k] = pd.to_numeric(inc[k].fillna(0), errors='coerce').astype('int64')
-
-
-    inc.sort_values(by=['ApplSeqNum'], ascending = [True], inplace=True)
-
-    for i in range(inc.shape[0]):
-        s = inc.iloc[i].to_dict()
-
-        for k,v in s.items():
-            # print(k, type(v))
-            if isinstance(v, numpy.generic):
-                s[k] = numpy.asscalar(v)
-            # print(k, type(v))
+    wt_cols = [wt[k].to_numpy(dtype='int64').tolist() for k in _CSV_ORDER_KEYS]
+    cj_cols = [cj[k].to_numpy(dtype='int64').tolist() for k in _CSV_EXE_KEYS]
+    wt_nb = len(wt)
+    seq = numpy.concatenate([wt['ApplSeqNum'].to_numpy(dtype='int64'), cj['ApplSeqNum'].to_numpy(dtype='int64')])
+
+    for i in numpy.argsort(seq, kind='stable').tolist():
+        if i<wt_nb:
+            s = dict(zip(_CSV_ORDER_KEYS, [c[i] for c in wt_cols]))
+        else:
+            s = dict(zip(_CSV_EXE_KEYS, [c[i-wt_nb] for c in cj_cols]))
 
         msg = dict_to_axsbe(s)
 
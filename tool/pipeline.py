@@ -3,7 +3,9 @@ import abc
 
 import sys
 import time
+import traceback
 import threading
+import multiprocessing
 
 
 # import the Queue class from Python 3
@@ -70,3 +72,141 @@ class PPStageI1E1(PPStage):
             return True
 
 
+
+
+## 阻塞、批量的流水级：
+##   * 级间队列阻塞读写（队列满/空时在条件变量上等待），不再sleep轮询
+##   * 每次put/get一批数据(list)，减少每条数据的队列开销
+##   * 上级结束时向队列写入结束标记(None)，下级读到后结束，不再轮询上级状态
+##   * 上级异常结束时写入错误标记(PPStageError)，下级读到后抛出，不会当作正常结束
+##   * backend='thread'时在线程中运行，'process'时在子进程中运行（级间使用multiprocessing.Queue，或传入的输出队列Q，
+##     如tool.shm_ring.shm_ring_queue）；
+##     子进程只接收本级的main_func、队列和批大小，fork/spawn启动方式均可，main_func须可pickle(如模块级函数)
+PP_EOS = None   # 结束标记，批数据总是list，不会与之混淆
+PP_ERROR_PUT_TIMEOUT_S = 10 # 异常时写错误标记的超时，下级已退出、队列满时放弃，不永久阻塞
+
+class PPStageError(Exception):
+    '''错误标记：参数为异常级的traceback，可跨进程传递'''
+    pass
+
+def _pp_get(Q):
+    batch = Q.get()
+    if isinstance(batch, PPStageError):
+        raise batch
+    return batch
+
+def _pp_stage_main(stage):
+    '''子进程入口'''
+    stage._run()
+
+class PPStageBatch():
+    def __init__(self, main_func, prev_stage=None, backend='thread', queue_size=64, batch_size=1024, Q=None):
+        '''
+        main_func(stage): 通过 stage.inputs()/stage.read_batch() 读上级数据，stage.output()/stage.output_batch() 写给下级，
+                          返回后自动flush并写入结束标记
+        prev_stage: 上级PPStageBatch，为None时本级是源头
+        Q: 本级的输出队列，为None时按backend创建；须提供put(batch, timeout=None)/get()，可跨进程
+        '''
+        if backend not in ('thread', 'process'):
+            raise Exception(f'pipeline backend={backend} not support!')
+        self.main_func = main_func
+        self.prev_stage = prev_stage
+        self.backend = backend
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.Q = self._new_queue(backend) if Q is None else Q
+        self.out_batch = []
+        self.t = None
+
+        # 本级在子进程中运行时，上级的输出队列也需要跨进程
+        if prev_stage is not None and backend=='process' and isinstance(prev_stage.Q, queue.Queue):
+            if prev_stage.t is not None:
+                raise Exception('previous stage already started with thread queue')
+            prev_stage.Q = prev_stage._new_queue('process')
+        self.in_Q = None if prev_stage is None else prev_stage.Q
+
+    def __getstate__(self):
+        '''传给子进程时不带线程/进程句柄和上级，只带上级的输出队列'''
+        state = self.__dict__.copy()
+        state['t'] = None
+        state['prev_stage'] = None
+        return state
+
+    def _new_queue(self, backend):
+        if backend=='process':
+            return multiprocessing.Queue(maxsize=self.queue_size)
+        return queue.Queue(maxsize=self.queue_size)
+
+    def _run(self):
+        try:
+            self.main_func(self)
+        except BaseException:
+            try:
+                if len(self.out_batch):
+                    self.Q.put(self.out_batch, timeout=PP_ERROR_PUT_TIMEOUT_S)
+                    self.out_batch = []
+                self.Q.put(PPStageError(traceback.format_exc()), timeout=PP_ERROR_PUT_TIMEOUT_S)
+            except queue.Full:
+                pass
+            raise
+        self.close()
+
+    def start(self):
+        if self.backend=='process':
+            self.t = multiprocessing.Process(target=_pp_stage_main, args=(self,))
+        else:
+            self.t = threading.Thread(target=self._run, args=())
+        self.t.daemon = True
+        self.t.start()
+
+    def join(self, timeout=None):
+        '''等待本级结束'''
+        self.t.join(timeout)
+
+    def release(self):
+        '''释放输出队列占用的资源(如shm_ring_queue的共享内存)，本级和下级都结束后调用'''
+        if hasattr(self.Q, 'release'):
+            self.Q.release()
+
+    # 写给下级
+    def output(self, data):
+        self.out_batch.append(data)
+        if len(self.out_batch)>=self.batch_size:
+            self.flush()
+
+    def output_batch(self, batch:list):
+        self.flush()
+        if len(batch):
+            self.Q.put(batch)
+
+    def flush(self):
+        if len(self.out_batch):
+            self.Q.put(self.out_batch)
+            self.out_batch = []
+
+    def close(self):
+        '''正常结束'''
+        self.flush()
+        self.Q.put(PP_EOS)
+
+    # 读上级
+    def read_batch(self):
+        '''返回上级的下一批数据，上级结束时返回None，上级异常时抛出PPStageError'''
+        return _pp_get(self.in_Q)
+
+    def inputs(self):
+        '''逐条返回上级数据，直到上级结束；上级异常时抛出PPStageError'''
+        while True:
+            batch = _pp_get(self.in_Q)
+            if batch is PP_EOS:
+                return
+            yield from batch
+
+    # 供最后一级之后的调用者读取
+    def results(self):
+        '''逐条返回本级输出，直到本级结束；本级或上级异常时抛出PPStageError'''
+        while True:
+            batch = _pp_get(self.Q)
+            if batch is PP_EOS:
+                return
+            yield from batch
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+'''
+共享内存上的单生产者/单消费者环形队列，用于跨进程的流水级之间传递定宽二进制消息记录：
+  * 记录槽定宽：2字节长度 + 最长的消息字节流(bytes_stream)，消息不经过pickle
+  * 读写位置(head/tail)为共享内存中的64位计数器，各自只由一方写
+  * 队列空/满时先短暂自旋，再在信号量上阻塞等待，对方推进位置后唤醒
+  * 生产者close后，消费者读空即结束；生产者异常时close(error)写入错误记录，消费者读到时抛出PPStageError
+  * shm_ring_queue把环形队列包装成PPStageBatch的输出队列(参数Q)，流水级之间经共享内存传递消息批
+'''
+
+import os
+import time
+import queue
+import struct
+from multiprocessing import Semaphore, shared_memory
+from tool.pipeline import PP_EOS, PPStageError
+from tool.axsbe_exe import axsbe_exe
+from tool.axsbe_order import axsbe_order
+from tool.axsbe_status import axsbe_status
+from tool.axsbe_snap_stock import axsbe_snap_stock
+from tool.msg_util import bytes_to_axsbe
+
+SHM_RING_MSG_MAX = max(l.size for c in (axsbe_order, axsbe_exe, axsbe_status, axsbe_snap_stock) for l in c.SBE_LAYOUTS.values())
+SHM_RING_SLOT_SIZE = 2 + SHM_RING_MSG_MAX
+SHM_RING_SLOT_NB = 1<<14
+SHM_RING_SPIN = 200         # 阻塞等待前的自旋次数
+SHM_RING_WAIT_TIMEOUT = 0.1 # 信号量等待超时(s)，超时后重新检查位置，防止唤醒丢失
+
+_HEAD_OFS = 0   # 消费者已读计数 u64
+_TAIL_OFS = 8   # 生产者已写计数 u64
+_FLAG_OFS = 16  # closed u8, consumer_waiting u8, producer_waiting u8
+_ERR_OFS = 24   # 错误记录的序号+1 u64，0为无
+_DATA_OFS = 64
+_U64 = struct.Struct('<Q')
+_U16 = struct.Struct('<H')
+
+
+class shm_ring():
+    '''单生产者/单消费者环形队列；在创建方进程中构造，作为参数传给子进程使用'''
+    __slots__ = [
+        'shm',
+        'buf',
+        'slot_nb',
+        'slot_size',
+        'sem_data',     # 消费者等待数据
+        'sem_space',    # 生产者等待空间
+        'owner',        # 创建方的进程号，只在创建方进程中unlink；fork出的子进程不经过pickle，不能靠__setstate__区分
+    ]
+
+    def __init__(self, slot_nb=SHM_RING_SLOT_NB, slot_size=SHM_RING_SLOT_SIZE):
+        self.slot_nb = slot_nb
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=_DATA_OFS + slot_nb*slot_size)
+        self.buf = self.shm.buf
+        self.buf[:_DATA_OFS] = bytes(_DATA_OFS)
+        self.sem_data = Semaphore(0)
+        self.sem_space = Semaphore(0)
+        self.owner = os.getpid()
+
+    def __getstate__(self):
+        return (self.shm.name, self.slot_nb, self.slot_size, self.sem_data, self.sem_space)
+
+    def __setstate__(self, state):
+        name, self.slot_nb, self.slot_size, self.sem_data, self.sem_space = state
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.buf = self.shm.buf
+        self.owner = 0
+
+    def _get(self, ofs):
+        return _U64.unpack_from(self.buf, ofs)[0]
+
+    def _wait(self, ready, flag_ofs, sem, timeout=None):
+        '''自旋后在sem上等待，直到ready()为真；超过timeout(s)时抛出queue.Full'''
+        for _ in range(SHM_RING_SPIN):
+            if ready():
+                return
+        deadline = None if timeout is None else time.monotonic()+timeout
+        while True:
+            if deadline is not None and time.monotonic()>deadline:
+                raise queue.Full
+            self.buf[flag_ofs] = 1
+            if ready():   # 置等待标志后再检查一次，对方在此之前推进的不会丢
+                self.buf[flag_ofs] = 0
+                return
+            sem.acquire(timeout=SHM_RING_WAIT_TIMEOUT)
+            self.buf[flag_ofs] = 0
+            if ready():
+                return
+
+    def _wake(self, flag_ofs, sem):
+        if self.buf[flag_ofs]:
+            self.buf[flag_ofs] = 0
+            sem.release()
+
+    # 生产者
+    def put(self, b:bytes, timeout=None):
+        self.put_many((b,), timeout)
+
+    def put_many(self, bs, timeout=None):
+        '''按序写入多条记录，空间不足时阻塞，超过timeout(s)时抛出queue.Full'''
+        tail = self._get(_TAIL_OFS)
+        n = 0
+        for b in bs:
+            if len(b)>self.slot_size-2:
+                raise Exception(f'shm_ring record size={len(b)} > {self.slot_size-2}')
+            if tail-self._get(_HEAD_OFS)>=self.slot_nb:
+                _U64.pack_into(self.buf, _TAIL_OFS, tail)     # 先发布已写的
+                self._wake(_FLAG_OFS+1, self.sem_data)
+                self._wait(lambda:tail-self._get(_HEAD_OFS)<self.slot_nb, _FLAG_OFS+2, self.sem_space, timeout)
+            ofs = _DATA_OFS + (tail % self.slot_nb) * self.slot_size
+            _U16.pack_into(self.buf, ofs, len(b))
+            self.buf[ofs+2:ofs+2+len(b)] = b
+            tail += 1
+            n += 1
+        if n:
+            _U64.pack_into(self.buf, _TAIL_OFS, tail)
+            self._wake(_FLAG_OFS+1, self.sem_data)
+
+    def close(self, error:str=None, timeout=None):
+        '''生产者结束；error不为None时先写入错误记录(过长时保留末尾)'''
+        if error is not None:
+            b = error.encode()[-(self.slot_size-2):]
+            _U64.pack_into(self.buf, _ERR_OFS, self._get(_TAIL_OFS)+1)   # 先标记序号，消费者读到该记录时已可见
+            self.put(b, timeout)
+        self.buf[_FLAG_OFS] = 1
+        self._wake(_FLAG_OFS+1, self.sem_data)
+
+    # 消费者
+    def get_many(self, max_nb=SHM_RING_SLOT_NB):
+        '''读出至多max_nb条记录(bytes)，无数据时阻塞；生产者已结束且读空时返回空list；读到错误记录时抛出PPStageError'''
+        head = self._get(_HEAD_OFS)
+        self._wait(lambda:self._get(_TAIL_OFS)>head or self.buf[_FLAG_OFS], _FLAG_OFS+1, self.sem_data)
+        tail = self._get(_TAIL_OFS)
+        end = min(tail, head+max_nb)
+        err = self._get(_ERR_OFS) - 1
+        if head<=err<end:
+            if err==head:
+                ofs = _DATA_OFS + (head % self.slot_nb) * self.slot_size
+                n = _U16.unpack_from(self.buf, ofs)[0]
+                error = bytes(self.buf[ofs+2:ofs+2+n]).decode(errors='replace')
+                _U64.pack_into(self.buf, _HEAD_OFS, head+1)
+                self._wake(_FLAG_OFS+2, self.sem_space)
+                raise PPStageError(error)
+            end = err   # 先返回错误记录之前的
+        l = []
+        for i in range(head, end):
+            ofs = _DATA_OFS + (i % self.slot_nb) * self.slot_size
+            n = _U16.unpack_from(self.buf, ofs)[0]
+            l.append(bytes(self.buf[ofs+2:ofs+2+n]))
+        _U64.pack_into(self.buf, _HEAD_OFS, end)
+        self._wake(_FLAG_OFS+2, self.sem_space)
+        return l
+
+    def records(self):
+        '''逐条返回记录，直到生产者结束'''
+        while True:
+            l = self.get_many()
+            if not l:
+                return
+            yield from l
+
+    # 消息
+    def put_msgs(self, msgs, timeout=None):
+        self.put_many((m.bytes_stream for m in msgs), timeout)
+
+    def msgs(self):
+        '''逐条返回消息对象，直到生产者结束'''
+        for b in self.records():
+            yield bytes_to_axsbe(b)
+
+    def release(self):
+        '''解除映射；创建方同时删除共享内存'''
+        self.buf.release()
+        self.shm.close()
+        if self.owner==os.getpid():
+            self.shm.unlink()
+
+
+class shm_ring_queue():
+    '''
+    PPStageBatch的输出队列(参数Q)：消息批经shm_ring传递，批中须为有bytes_stream的消息(axsbe_*)；
+    结束标记PP_EOS、错误标记PPStageError的处理与multiprocessing.Queue相同；所有级结束后由创建方release()
+    '''
+    __slots__ = [
+        'ring',
+    ]
+
+    def __init__(self, slot_nb=SHM_RING_SLOT_NB):
+        self.ring = shm_ring(slot_nb)
+
+    def put(self, batch, timeout=None):
+        if batch is PP_EOS:
+            self.ring.close()
+        elif isinstance(batch, PPStageError):
+            self.ring.close(str(batch.args[0]), timeout)
+        else:
+            self.ring.put_msgs(batch, timeout)
+
+    def get(self):
+        '''返回下一批消息，生产者结束时返回PP_EOS，生产者异常时抛出PPStageError'''
+        l = self.ring.get_many()
+        if not l:
+            return PP_EOS
+        return [bytes_to_axsbe(b) for b in l]
+
+    def release(self):
+        self.ring.release()